@@ -0,0 +1,219 @@
+# Subject performance analytics over the results_rollup table (migration
+# 006). Results count towards the class they were entered in (migration
+# 012), so promotions leave past years alone. Triggers mark (year, term,
+# class, subject) cells dirty as results change; refresh() rebuilds only
+# those cells. pivot() sums cells into any
+# two dimensions, so its cost depends on the number of cells, not results.
+
+HISTOGRAM_SIZE = 101  # final scores 0..100
+MEASURES = ('count', 'mean', 'min', 'max', 'p25', 'median', 'p75', 'grades', 'all')
+DIMENSIONS = {
+    'year': ('year', 'year'),
+    'term': ('term', 'term'),
+    'class': ('class_id', 'class_name'),
+    'subject': ('subject_id', 'subject_name'),
+    'teacher': ('teacher_id', 'teacher_name'),
+}
+_REFRESH_LOCK = 0x726f6c6c  # pg_advisory_xact_lock key; refreshes run one at a time
+
+_BUILD_CELLS = """
+    WITH scored AS (
+        SELECT er.year, er.term, er.class_id, er.subject_id,
+               LEAST(GREATEST(er.final_score, 0), 100) AS score, COALESCE(er.grade, '') AS grade
+        FROM public.exam_results er
+        JOIN rollup_cells c ON c.year = er.year AND c.term = er.term AND c.class_id = er.class_id AND c.subject_id = er.subject_id
+        WHERE er.final_score IS NOT NULL
+    ),
+    by_score AS (
+        SELECT year, term, class_id, subject_id, score, COUNT(*) AS n
+        FROM scored GROUP BY year, term, class_id, subject_id, score
+    ),
+    by_grade AS (
+        SELECT year, term, class_id, subject_id, jsonb_object_agg(grade, n) AS grade_counts
+        FROM (SELECT year, term, class_id, subject_id, grade, COUNT(*) AS n
+              FROM scored GROUP BY year, term, class_id, subject_id, grade) g
+        GROUP BY year, term, class_id, subject_id
+    )
+    INSERT INTO public.results_rollup
+        (year, term, class_id, subject_id, result_count, score_sum, min_score, max_score, histogram, grade_counts)
+    SELECT h.year, h.term, h.class_id, h.subject_id, h.result_count, h.score_sum, h.min_score, h.max_score,
+           ARRAY(SELECT COALESCE((h.counts ->> i::text)::int, 0) FROM generate_series(0, 100) i ORDER BY i),
+           g.grade_counts
+    FROM (
+        SELECT year, term, class_id, subject_id, SUM(n) AS result_count, SUM(n * score) AS score_sum,
+               MIN(score) AS min_score, MAX(score) AS max_score, jsonb_object_agg(score, n) AS counts
+        FROM by_score GROUP BY year, term, class_id, subject_id
+    ) h
+    JOIN by_grade g USING (year, term, class_id, subject_id)
+"""
+
+
+def refresh(conn, full=False):
+    """
+    Recomputes the dirty rollup cells (every cell with full=True) in one
+    transaction and returns how many cells were rebuilt.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_REFRESH_LOCK,))
+        if full:
+            cursor.execute("DELETE FROM public.results_rollup")
+            cursor.execute("""
+                INSERT INTO public.results_rollup_dirty (year, term, class_id, subject_id)
+                SELECT DISTINCT year, term, class_id, subject_id
+                FROM public.exam_results
+                WHERE class_id IS NOT NULL AND subject_id IS NOT NULL AND year IS NOT NULL AND term IS NOT NULL
+                ON CONFLICT DO NOTHING
+            """)
+        cursor.execute("""
+            CREATE TEMP TABLE rollup_cells (year TEXT, term TEXT, class_id INTEGER, subject_id INTEGER) ON COMMIT DROP
+        """)
+        cursor.execute("""
+            WITH taken AS (DELETE FROM public.results_rollup_dirty RETURNING year, term, class_id, subject_id)
+            INSERT INTO rollup_cells SELECT * FROM taken
+        """)
+        cells = cursor.rowcount
+        if cells:
+            cursor.execute("""
+                DELETE FROM public.results_rollup r USING rollup_cells c
+                WHERE r.year = c.year AND r.term = c.term AND r.class_id = c.class_id AND r.subject_id = c.subject_id
+            """)
+            cursor.execute(_BUILD_CELLS)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return cells
+
+
+def refresh_if_dirty(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM public.results_rollup_dirty)")
+    dirty = cursor.fetchone()[0]
+    conn.commit()
+    cursor.close()
+    return refresh(conn) if dirty else 0
+
+
+def _load_cells(cursor, filters, by_teacher):
+    conditions, params = [], []
+    for column in ('year', 'term', 'class_id', 'subject_id'):
+        if filters.get(column) is not None:
+            conditions.append(f"r.{column} = %s")
+            params.append(filters[column])
+    teacher_columns = teacher_join = ""
+    if by_teacher or filters.get('teacher_id') is not None:
+        # Results are credited to the teachers currently assigned to the class and subject
+        teacher_columns = ", ta.teacher_id, COALESCE(u.full_name, 'Unassigned') AS teacher_name"
+        teacher_join = """
+            LEFT JOIN public.teacher_assignments ta ON ta.class_id = r.class_id AND ta.subject_id = r.subject_id
+            LEFT JOIN public.teachers t ON t.teacher_id = ta.teacher_id
+            LEFT JOIN public.users u ON u.user_id = t.user_id
+        """
+        if filters.get('teacher_id') is not None:
+            conditions.append("ta.teacher_id = %s")
+            params.append(filters['teacher_id'])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(f"""
+        SELECT r.year, r.term, r.class_id, c.class_name, r.subject_id, sub.subject_name,
+               r.result_count, r.score_sum, r.min_score, r.max_score, r.histogram, r.grade_counts{teacher_columns}
+        FROM public.results_rollup r
+        JOIN public.classes c ON c.class_id = r.class_id
+        JOIN public.subjects sub ON sub.subject_id = r.subject_id
+        {teacher_join}
+        {where}
+    """, params)
+    return cursor.fetchall()
+
+
+class _Summary:
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.histogram = [0] * HISTOGRAM_SIZE
+        self.grades = {}
+
+    def add(self, cell):
+        self.count += cell['result_count']
+        self.total += cell['score_sum']
+        self.min = cell['min_score'] if self.min is None else min(self.min, cell['min_score'])
+        self.max = cell['max_score'] if self.max is None else max(self.max, cell['max_score'])
+        for score, n in enumerate(cell['histogram']):
+            self.histogram[score] += n
+        for grade, n in cell['grade_counts'].items():
+            self.grades[grade] = self.grades.get(grade, 0) + n
+
+    def _score_at(self, rank):
+        seen = 0
+        for score, n in enumerate(self.histogram):
+            seen += n
+            if seen > rank:
+                return score
+        return self.max
+
+    def quantile(self, q):
+        # Linear interpolation between closest ranks, as percentile_cont does
+        if not self.count:
+            return None
+        position = q * (self.count - 1)
+        lower = int(position)
+        low, high = self._score_at(lower), self._score_at(min(lower + 1, self.count - 1))
+        return round(low + (high - low) * (position - lower), 2)
+
+    def measure(self, name):
+        if name == 'count':
+            return self.count
+        if name == 'mean':
+            return round(self.total / self.count, 2) if self.count else None
+        if name == 'min':
+            return self.min
+        if name == 'max':
+            return self.max
+        if name == 'p25':
+            return self.quantile(0.25)
+        if name == 'median':
+            return self.quantile(0.5)
+        if name == 'p75':
+            return self.quantile(0.75)
+        if name == 'grades':
+            return dict(sorted(self.grades.items()))
+        return {m: self.measure(m) for m in MEASURES if m != 'all'}
+
+
+def pivot(cursor, rows, cols=None, measure='mean', filters=None):
+    """
+    Sums rollup cells by the `rows` dimension (and `cols`, if given) and
+    reports `measure` for each group. Dimensions are the keys of DIMENSIONS;
+    cursor must be a DictCursor.
+    """
+    by_teacher = 'teacher' in (rows, cols)
+    cells = _load_cells(cursor, filters or {}, by_teacher)
+    row_key, row_label = DIMENSIONS[rows]
+    col_key, col_label = DIMENSIONS[cols] if cols else (None, None)
+    row_labels, col_labels, groups = {}, {}, {}
+    for cell in cells:
+        r = cell[row_key]
+        row_labels[r] = cell[row_label] or 'Unassigned'
+        c = None
+        if cols:
+            c = cell[col_key]
+            col_labels[c] = cell[col_label] or 'Unassigned'
+        groups.setdefault((r, c), _Summary()).add(cell)
+    row_order = sorted(row_labels, key=lambda key: str(row_labels[key]))
+    if not cols:
+        return {
+            'rows': [{'key': key, 'label': row_labels[key]} for key in row_order],
+            'measure': measure,
+            'values': [groups[(key, None)].measure(measure) for key in row_order],
+        }
+    col_order = sorted(col_labels, key=lambda key: str(col_labels[key]))
+    return {
+        'rows': [{'key': key, 'label': row_labels[key]} for key in row_order],
+        'cols': [{'key': key, 'label': col_labels[key]} for key in col_order],
+        'measure': measure,
+        'values': [[groups[(r, c)].measure(measure) if (r, c) in groups else None for c in col_order] for r in row_order],
+    }
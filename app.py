@@ -1,4 +1,5 @@
 import os
+import psycopg2.errors
 from flask import Flask, redirect, url_for
 from config import Config
 from routes.auth import auth_bp
@@ -9,8 +10,15 @@ from routes.user import user_bp
 from routes.assignment import assignment_bp
 from routes.profile import profile_bp
 from routes.curriculum import curriculum_bp
+from routes.analytics import analytics_bp
+from routes.ops import ops_bp
 from db import close_db
+from utils import query_timeout_response
+from cli import register_commands
+from compression import CompressionMiddleware
+from template_cache import configure_jinja
 from whitenoise import WhiteNoise
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -20,10 +28,26 @@ STATIC_DIR = os.path.join(BASE_DIR, 'static')
 
 def create_app():
     app = Flask(__name__)
+    configure_jinja(app)  # before anything touches app.jinja_env
     app.secret_key = Config.SECRET_KEY
     app.debug = Config.DEBUG
 
     app.teardown_appcontext(close_db)
+    app.register_error_handler(psycopg2.errors.QueryCanceled, query_timeout_response)
+    register_commands(app)
+
+    if Config.TRUSTED_PROXY_HOPS:
+        # Only the last TRUSTED_PROXY_HOPS X-Forwarded-For entries are believed;
+        # the client can write anything in front of them
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=Config.TRUSTED_PROXY_HOPS)
+
+    if Config.COMPRESSION_ENABLED:
+        app.wsgi_app = CompressionMiddleware(
+            app.wsgi_app,
+            min_size=Config.COMPRESSION_MIN_SIZE,
+            level=Config.COMPRESSION_LEVEL,
+            brotli_level=Config.BROTLI_LEVEL,
+        )
 
     # all blueprints
     app.register_blueprint(auth_bp)
@@ -34,6 +58,8 @@ def create_app():
     app.register_blueprint(assignment_bp, url_prefix='/assignments')
     app.register_blueprint(profile_bp, url_prefix='/profile')
     app.register_blueprint(curriculum_bp, url_prefix='/curriculum')
+    app.register_blueprint(analytics_bp, url_prefix='/analytics')
+    app.register_blueprint(ops_bp)  # /metrics, /healthz, /readyz and request metrics
 
     # Default route
     @app.route('/')
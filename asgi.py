@@ -0,0 +1,15 @@
+# ASGI entry point for the async serving mode:
+#
+#     ASYNC_DB=True uvicorn asgi:asgi_app --workers 2
+#
+# Flask views still run as WSGI inside a thread pool, so blocking code keeps
+# working, while multi-query read paths go through db_async and overlap their
+# database round trips on the worker's event loop.
+from a2wsgi import WSGIMiddleware
+from app import app
+from config import Config
+import db_async
+
+db_async.open_pool()
+
+asgi_app = WSGIMiddleware(app, workers=Config.ASGI_THREADS)
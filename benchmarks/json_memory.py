@@ -0,0 +1,109 @@
+"""
+Peak memory of a 20k-row JSON list response built the old way (DictCursor
+fetchall, a dict copy per row, jsonify) and streamed (server-side cursor,
+tuple rows, batches encoded as they are sent), against the configured
+database.
+
+    python benchmarks/json_memory.py --rows 20000
+
+The rows are student-shaped and generated by the query itself, so nothing
+is written. Each mode runs in a fresh interpreter, and reports the peak of
+Python allocations (tracemalloc) and the growth of the process's peak RSS,
+which also counts libpq's copy of a fully fetched result.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+QUERY = """
+    SELECT n AS student_id, 'HSS' || lpad(n::text, 6, '0') AS student_number,
+           'First' || n AS first_name, CASE WHEN n %% 3 = 0 THEN 'Middle' END AS middle_name, 'Last' || n AS last_name,
+           {dob} AS dob, CASE WHEN n %% 2 = 0 THEN 'Female' ELSE 'Male' END AS gender,
+           '0999' || lpad(n::text, 6, '0') AS guardian_contact, 'GOV' || n AS government_number,
+           '' AS special_needs, n || ' School Road, Blantyre' AS address, {enrolled} AS enrollment_date,
+           n %% 12 + 1 AS class_id, 'active' AS status, 'standard ' || (n %% 8 + 1) AS class_name
+    FROM generate_series(1, %s) n
+"""
+DOB = "DATE '2010-01-01' + n %% 1500"
+ENROLLED = "DATE '2020-01-06' + n %% 900"
+
+
+def old_response(conn, rows):
+    import psycopg2.extras
+    from flask import jsonify
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute(QUERY.format(dob=DOB, enrolled=ENROLLED), (rows,))
+    students = cursor.fetchall()
+    cursor.close()
+    students_list = []
+    for s in students:
+        s_dict = dict(s)
+        s_dict['dob'] = s_dict['dob'].strftime('%Y-%m-%d') if s_dict.get('dob') else None
+        s_dict['enrollment_date'] = s_dict['enrollment_date'].strftime('%Y-%m-%d') if s_dict.get('enrollment_date') else None
+        s_dict['full_name'] = f"{s_dict['first_name']} {s_dict.get('middle_name') or ''} {s_dict['last_name']}".replace('  ', ' ')
+        students_list.append(s_dict)
+    return len(jsonify({"students": students_list}).get_data())
+
+
+def streamed_response(conn, rows):
+    from streaming import server_cursor, json_list_response
+    cursor = server_cursor(conn)
+    query = QUERY.format(dob=f"to_char({DOB}, 'YYYY-MM-DD')", enrolled=f"to_char({ENROLLED}, 'YYYY-MM-DD')")
+    cursor.execute(f"SELECT q.*, concat_ws(' ', first_name, middle_name, last_name) AS full_name FROM ({query}) q", (rows,))
+    response = json_list_response(cursor, 'students')
+    size = 0
+    for chunk in response.response:
+        size += len(chunk)  # sent and dropped, as a WSGI server would
+    response.close()
+    return size
+
+
+def run_mode(mode, rows):
+    from app import app
+    from db import get_db_connection
+    with app.test_request_context():
+        conn = get_db_connection()
+        conn.cursor().execute("SELECT 1")
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        started = time.perf_counter()
+        size = (old_response if mode == 'old' else streamed_response)(conn, rows)
+        elapsed = time.perf_counter() - started
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    print(json.dumps({'bytes': size, 'traced_peak': traced_peak, 'rss_growth_kb': rss_growth, 'seconds': elapsed}))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--mode', choices=('old', 'streamed'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        return run_mode(args.mode, args.rows)
+
+    print(f"{'mode':<10} {'body MB':>8} {'python peak MB':>15} {'rss growth MB':>14} {'seconds':>8}")
+    results = {}
+    for mode in ('old', 'streamed'):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', mode, '--rows', str(args.rows)],
+                                check=True, capture_output=True, text=True).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+        r = results[mode]
+        print(f"{mode:<10} {r['bytes'] / 2**20:>8.2f} {r['traced_peak'] / 2**20:>15.2f} "
+              f"{r['rss_growth_kb'] / 1024:>14.2f} {r['seconds']:>8.3f}")
+    print(f"python peak reduced {results['old']['traced_peak'] / max(results['streamed']['traced_peak'], 1):.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
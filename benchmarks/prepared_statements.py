@@ -0,0 +1,171 @@
+"""
+Database time of the login and results-browsing flows with the hot
+statements prepared (DB_PREPARED_STATEMENTS) and without, against the
+configured database.
+
+    python benchmarks/prepared_statements.py --email teacher@example.com --password secret \
+        --iterations 200
+
+The app runs in-process and every cursor execute is timed, so password
+hashing and template rendering do not hide the parse/plan savings. Each
+flow is warmed up first (connections prepare their statements once), then
+run --iterations times per mode; the planning time Postgres reports for
+each registered statement is printed as well.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import psycopg2
+import psycopg2.extensions
+
+_db_time = [0.0]
+_timed_factories = {}
+
+
+def _timed(factory):
+    if factory not in _timed_factories:
+        def execute(self, query, vars=None):
+            started = time.perf_counter()
+            try:
+                return factory.execute(self, query, vars)
+            finally:
+                _db_time[0] += time.perf_counter() - started
+
+        _timed_factories[factory] = type('Timed' + factory.__name__, (factory,), {'execute': execute})
+    return _timed_factories[factory]
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _timed(factory)
+        return super().cursor(*args, **kwargs)
+
+
+_connect = psycopg2.connect
+
+
+def _timed_connect(*args, **kwargs):
+    kwargs.setdefault('connection_factory', TimedConnection)
+    return _connect(*args, **kwargs)
+
+
+psycopg2.connect = _timed_connect
+
+
+def teacher_context(app):
+    """A teacher's session and one of their classes, for the browsing flow."""
+    from db import get_db_connection
+    with app.app_context():
+        cursor = get_db_connection().cursor()
+        cursor.execute("""
+            SELECT u.user_id, u.full_name, c.class_id, c.class_name
+            FROM public.users u
+            JOIN public.teachers t ON t.user_id = u.user_id
+            JOIN public.teacher_assignments ta ON ta.teacher_id = t.teacher_id
+            JOIN public.classes c ON c.class_id = ta.class_id
+            WHERE u.role = 'teacher' ORDER BY ta.assignment_id LIMIT 1
+        """)
+        row = cursor.fetchone()
+        cursor.close()
+    if row is None:
+        sys.exit("No teacher with a class assignment to browse as.")
+    return {'user_id': row[0], 'full_name': row[1], 'role': 'teacher'}, row[2], row[3]
+
+
+def login_flow(client, args):
+    client.post('/login', data={'email': args.email, 'password': args.password})
+
+
+def browsing_flow(client, teacher, class_id, class_name):
+    with client.session_transaction() as sess:
+        sess.clear()
+        sess.update(teacher)
+    client.get('/teachers/view_results')
+    client.post('/teachers/get_students_for_results', data={'class_name': class_name})
+    client.post('/teachers/get_students_for_class_list', data={'class_id': class_id})
+    client.post('/students/filter', data={'class_name': class_name})
+
+
+def measure(flow, iterations):
+    db_times, wall_times = [], []
+    for _ in range(iterations):
+        _db_time[0] = 0.0
+        started = time.perf_counter()
+        flow()
+        wall_times.append(time.perf_counter() - started)
+        db_times.append(_db_time[0])
+    return statistics.mean(db_times), statistics.mean(wall_times)
+
+
+def planning_times(app, teacher, class_id, class_name, email):
+    """Planning time Postgres reports for each registered statement, in ms."""
+    import db
+    samples = {
+        'user_by_email': (email,),
+        'teacher_classes': (teacher['user_id'],),
+        'class_rosters': ([class_id],),
+        'students_in_class': (class_id,),
+        'classes_id_by_name': (class_name,),
+        'subjects_id_by_name': ('',),
+    }
+    times = {}
+    with app.app_context():
+        conn = db.get_db_connection()
+        cursor = conn.cursor()
+        for name, params in samples.items():
+            if name not in db._statements:
+                continue
+            sql = db._statements[name][0]
+            cursor.execute(f"EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) {sql}", params)
+            times[name] = cursor.fetchone()[0][0]['Planning Time']
+        conn.rollback()
+        cursor.close()
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--email', required=True, help="any user's login, for the login flow")
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    args = parser.parse_args()
+
+    from app import app
+    from config import Config
+    app.config['TESTING'] = True
+    client = app.test_client()
+    teacher, class_id, class_name = teacher_context(app)
+
+    flows = {
+        'login': lambda: login_flow(client, args),
+        'results browsing': lambda: browsing_flow(client, teacher, class_id, class_name),
+    }
+    print(f"{'flow':<18} {'mode':<10} {'db ms':>8} {'request ms':>11}")
+    for name, flow in flows.items():
+        results = {}
+        for prepared in (False, True):
+            Config.DB_PREPARED_STATEMENTS = prepared
+            measure(flow, args.warmup)
+            results[prepared] = measure(flow, args.iterations)
+            mode = 'prepared' if prepared else 'plain'
+            print(f"{name:<18} {mode:<10} {results[prepared][0] * 1000:>8.3f} {results[prepared][1] * 1000:>11.3f}")
+        plain_db, prepared_db = results[False][0], results[True][0]
+        print(f"{'':<18} {'saved':<10} {(plain_db - prepared_db) * 1000:>8.3f} "
+              f"({(1 - prepared_db / plain_db) * 100 if plain_db else 0:.1f}% of db time)")
+
+    print("\nplanning time per call without PREPARE:")
+    for name, ms in planning_times(app, teacher, class_id, class_name, args.email).items():
+        print(f"  {name:<22} {ms:.3f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
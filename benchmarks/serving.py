@@ -0,0 +1,119 @@
+"""
+Side-by-side benchmark of the sync (gunicorn) and async (uvicorn + db_async)
+serving modes against the configured database.
+
+    python benchmarks/serving.py --email admin@example.com --password secret \
+        --path /students/profile/1 --concurrency 20 --requests 400
+
+Each mode is started as a subprocess on a local port, every client thread
+logs in once, then the clients hit --path until --requests responses have
+come back. Prints throughput and latency percentiles per mode.
+"""
+import argparse
+import http.cookiejar
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    'sync': (['gunicorn', 'app:app', '--workers', '{workers}', '--bind', '127.0.0.1:{port}'], {}),
+    'async': (['uvicorn', 'asgi:asgi_app', '--workers', '{workers}', '--port', '{port}', '--log-level', 'warning'], {'ASYNC_DB': 'True'}),
+}
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def make_client(base, email, password):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    data = urllib.parse.urlencode({'email': email, 'password': password}).encode()
+    opener.open(base + '/login', data=data).read()
+    return opener
+
+
+def run_load(base, args):
+    latencies = []
+    errors = [0]
+    remaining = [args.requests]
+    lock = threading.Lock()
+
+    def worker():
+        opener = make_client(base, args.email, args.password)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                opener.open(base + args.path).read()
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return latencies, errors[0], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--email', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--path', default='/students/profile/1')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--modes', default='sync,async')
+    args = parser.parse_args()
+
+    print(f"{'mode':<8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+    for mode in args.modes.split(','):
+        command, extra_env = MODES[mode]
+        command = [part.format(workers=args.workers, port=args.port) for part in command]
+        env = dict(os.environ, **extra_env)
+        server = subprocess.Popen(command, cwd=ROOT, env=env)
+        try:
+            wait_for_port(args.port)
+            base = f'http://127.0.0.1:{args.port}'
+            latencies, errors, elapsed = run_load(base, args)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        if not latencies:
+            print(f"{mode:<8}{'-':>10}{'-':>10}{'-':>10}{errors:>8}")
+            continue
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1000
+        p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+        print(f"{mode:<8}{len(latencies) / elapsed:>10.1f}{p50:>10.1f}{p95:>10.1f}{errors:>8}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Cold-start cost of the app: how long `import app` takes in a fresh
+interpreter, and how long a freshly started gunicorn takes to answer its
+first requests with COLD_START_MODE off and on, against the configured
+database.
+
+    python benchmarks/startup.py --imports 5 --boots 3 --paths /login,/readyz
+
+Each boot starts `gunicorn -c gunicorn.conf.py app:app` with one worker,
+waits for the port to accept connections, then requests each of --paths
+twice in order. The first pass is what the first visitor after a wake-up
+waits for (template compilation, DB connections); the second is the warm
+cost of the same requests. Medians over --boots.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import app; print(time.perf_counter() - started)"
+
+
+def import_times(runs):
+    times = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], cwd=ROOT, check=True,
+                                capture_output=True, text=True).stdout
+        times.append(float(output.strip().splitlines()[-1]))
+    return times
+
+
+def wait_for_port(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.02)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def fetch(url):
+    started = time.perf_counter()
+    try:
+        urllib.request.urlopen(url, timeout=60).read()
+    except urllib.error.HTTPError as e:
+        e.read()
+    return time.perf_counter() - started
+
+
+def boot(cold_start, port, paths):
+    """(seconds until the port is open, seconds until the first response, first pass, second pass)."""
+    env = dict(os.environ, COLD_START_MODE=str(cold_start))
+    command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app',
+               '--workers', '1', '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        listening = time.perf_counter() - started
+        base = f'http://127.0.0.1:{port}'
+        first = [fetch(base + path) for path in paths]
+        first_response = listening + first[0]
+        second = [fetch(base + path) for path in paths]
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return listening, first_response, first, second
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--imports', type=int, default=5, help='fresh-interpreter imports to time')
+    parser.add_argument('--boots', type=int, default=3, help='server starts per mode')
+    parser.add_argument('--paths', default='/login,/readyz')
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+    paths = args.paths.split(',')
+
+    times = import_times(args.imports)
+    print(f"import app: median {statistics.median(times) * 1000:.1f} ms, min {min(times) * 1000:.1f} ms\n")
+
+    print(f"{'cold start':<11}{'listening s':>12}{'1st resp s':>11}" +
+          ''.join(f"{path + ' 1st/2nd ms':>24}" for path in paths))
+    for cold_start in (False, True):
+        boots = [boot(cold_start, args.port, paths) for _ in range(args.boots)]
+        row = f"{'on' if cold_start else 'off':<11}"
+        row += f"{statistics.median(b[0] for b in boots):>12.2f}{statistics.median(b[1] for b in boots):>11.2f}"
+        for i in range(len(paths)):
+            first = statistics.median(b[2][i] for b in boots) * 1000
+            second = statistics.median(b[3][i] for b in boots) * 1000
+            row += f"{f'{first:.1f} / {second:.1f}':>24}"
+        print(row)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
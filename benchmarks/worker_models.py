@@ -0,0 +1,195 @@
+"""
+Throughput of the teacher and accounts flows under different gunicorn
+worker models and counts, served with gunicorn.conf.py against the
+configured database.
+
+    python benchmarks/worker_models.py \
+        --teacher-email teacher@example.com --teacher-password secret \
+        --accounts-email accounts@example.com --accounts-password secret \
+        --models sync:2,sync:4,gthread:2x4,gthread:4x4 --concurrency 16 --duration 20
+
+A model is CLASS:WORKERS, or gthread:WORKERSxTHREADS. For each one the
+server is started on a local port, half the client threads log in as the
+teacher and half as the accounts user (once each, so password hashing is
+not measured), and every client repeats its role's flow for --duration
+seconds:
+
+    teacher:  dashboard, view results, class list, a report card,
+              a subject report, the results entry form
+    accounts: dashboard, fee payments page, filtered payments,
+              the payment form
+
+The flows only read. Prints completed flows per second and request
+latency percentiles per role and model.
+"""
+import argparse
+import http.cookiejar
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def teacher_context(email):
+    """A class and subject the teacher is assigned, a student in it, and a term that has results."""
+    from app import app
+    from db import get_db_connection
+    with app.app_context():
+        cursor = get_db_connection().cursor()
+        cursor.execute("""
+            SELECT ta.class_id, sub.subject_name,
+                   (SELECT MIN(s.student_id) FROM public.students s WHERE s.class_id = ta.class_id)
+            FROM public.users u
+            JOIN public.teachers t ON t.user_id = u.user_id
+            JOIN public.teacher_assignments ta ON ta.teacher_id = t.teacher_id
+            JOIN public.subjects sub ON sub.subject_id = ta.subject_id
+            WHERE u.email = %s ORDER BY ta.assignment_id LIMIT 1
+        """, (email,))
+        assignment = cursor.fetchone()
+        if assignment is None:
+            sys.exit(f"{email} has no class assignments.")
+        cursor.execute("SELECT term, year FROM public.exam_results ORDER BY year DESC, term DESC LIMIT 1")
+        term = cursor.fetchone() or ('Term 1', '')
+        cursor.close()
+    return {'class_id': assignment[0], 'subject': assignment[1], 'student_id': assignment[2],
+            'term': term[0], 'year': term[1]}
+
+
+def teacher_flow(ctx):
+    return [
+        ('GET', '/teachers/dashboard', None),
+        ('GET', '/teachers/view_results', None),
+        ('POST', '/teachers/get_students_for_results', {'class_id': ctx['class_id']}),
+        ('POST', '/teachers/get_student_report_card', {'student_id': ctx['student_id'], 'term': ctx['term'], 'year': ctx['year']}),
+        ('POST', '/teachers/get_subject_report', {'class_id': ctx['class_id'], 'subject': ctx['subject'],
+                                                  'term': ctx['term'], 'year': ctx['year']}),
+        ('GET', '/teachers/enter_results', None),
+    ]
+
+
+def accounts_flow(ctx):
+    return [
+        ('GET', '/admin/accounts_dashboard', None),
+        ('GET', '/admin/view_fee_payments', None),
+        ('POST', '/admin/filter_fee_payments', {'academic_year': ctx['year']}),
+        ('GET', '/admin/fee_payment_form', None),
+    ]
+
+
+def parse_model(model):
+    worker_class, _, size = model.partition(':')
+    workers, _, threads = size.partition('x')
+    return worker_class, int(workers), int(threads or 1)
+
+
+def wait_for_server(base, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base + '/healthz', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server at {base} did not start")
+
+
+def login(base, email, password):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    data = urllib.parse.urlencode({'email': email, 'password': password}).encode()
+    response = opener.open(base + '/login', data=data)
+    response.read()
+    if response.geturl().rstrip('/').endswith('/login'):
+        sys.exit(f"Could not log in as {email}.")
+    return opener
+
+
+def run_load(base, args, flows):
+    stats = {role: {'flows': 0, 'latencies': [], 'errors': 0} for role in flows}
+    lock = threading.Lock()
+    deadline = [None]
+
+    def client(role, email, password, steps):
+        opener = login(base, email, password)
+        barrier.wait()
+        while time.monotonic() < deadline[0]:
+            for method, path, data in steps:
+                started = time.perf_counter()
+                try:
+                    body = urllib.parse.urlencode(data).encode() if data is not None else None
+                    opener.open(base + path, data=body).read()
+                except Exception:
+                    with lock:
+                        stats[role]['errors'] += 1
+                    continue
+                with lock:
+                    stats[role]['latencies'].append(time.perf_counter() - started)
+            with lock:
+                stats[role]['flows'] += 1
+
+    clients = []
+    for i in range(args.concurrency):
+        role = 'teacher' if i % 2 == 0 else 'accounts'
+        email, password, steps = flows[role]
+        clients.append(threading.Thread(target=client, args=(role, email, password, steps)))
+    barrier = threading.Barrier(len(clients), action=lambda: deadline.__setitem__(0, time.monotonic() + args.duration))
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--teacher-email', required=True)
+    parser.add_argument('--teacher-password', required=True)
+    parser.add_argument('--accounts-email', required=True)
+    parser.add_argument('--accounts-password', required=True)
+    parser.add_argument('--models', default='sync:2,sync:4,gthread:2x4,gthread:4x4')
+    parser.add_argument('--concurrency', type=int, default=16, help='client threads, split between the roles')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load per model')
+    parser.add_argument('--port', type=int, default=8767)
+    args = parser.parse_args()
+
+    ctx = teacher_context(args.teacher_email)
+    flows = {
+        'teacher': (args.teacher_email, args.teacher_password, teacher_flow(ctx)),
+        'accounts': (args.accounts_email, args.accounts_password, accounts_flow(ctx)),
+    }
+    base = f'http://127.0.0.1:{args.port}'
+
+    print(f"{'model':<14}{'role':<10}{'flows/s':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'errors':>8}")
+    for model in args.models.split(','):
+        worker_class, workers, threads = parse_model(model)
+        env = dict(os.environ, GUNICORN_WORKER_CLASS=worker_class, GUNICORN_WORKERS=str(workers),
+                   GUNICORN_THREADS=str(threads))
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app',
+                   '--bind', f'127.0.0.1:{args.port}', '--log-level', 'warning']
+        server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+        try:
+            wait_for_server(base)
+            stats = run_load(base, args, flows)
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+        for role, s in stats.items():
+            latencies = sorted(s['latencies'])
+            if not latencies:
+                print(f"{model:<14}{role:<10}{'-':>9}{'-':>9}{'-':>9}{'-':>9}{s['errors']:>8}")
+                continue
+            p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+            print(f"{model:<14}{role:<10}{s['flows'] / args.duration:>9.1f}{len(latencies) / args.duration:>9.1f}"
+                  f"{statistics.median(latencies) * 1000:>9.1f}{p95 * 1000:>9.1f}{s['errors']:>8}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Counts the SQL statements each write route sends to the database, so a
+change to a write path can be compared before and after.
+
+    python benchmarks/write_statements.py --rounds 5
+
+The app runs in-process against the configured database. Every psycopg2
+connection the pools open counts its cursor executes; each route is
+requested through the Flask test client with a session for the first user
+of the role it needs, and reports the statements it issued and its median
+time. Each round creates a throwaway fee payment, student, result,
+assignment and user and deletes them again through the routes (their audit
+log entries remain). Run it on two checkouts to compare.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import psycopg2
+import psycopg2.extensions
+
+_statements = [0]
+_counting_factories = {}
+
+
+def _counting(factory):
+    if factory not in _counting_factories:
+        def execute(self, query, vars=None):
+            _statements[0] += 1
+            return factory.execute(self, query, vars)
+
+        def executemany(self, query, vars_list):
+            vars_list = list(vars_list)
+            _statements[0] += len(vars_list)
+            return factory.executemany(self, query, vars_list)
+
+        _counting_factories[factory] = type('Counting' + factory.__name__, (factory,),
+                                            {'execute': execute, 'executemany': executemany})
+    return _counting_factories[factory]
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _counting(factory)
+        return super().cursor(*args, **kwargs)
+
+
+_connect = psycopg2.connect
+
+
+def _counting_connect(*args, **kwargs):
+    kwargs.setdefault('connection_factory', CountingConnection)
+    return _connect(*args, **kwargs)
+
+
+psycopg2.connect = _counting_connect
+
+
+def setup(app, args):
+    """Users to act as, plus a class, subject and free class/subject pair for the teacher."""
+    from db import get_db_connection
+    with app.app_context():
+        cursor = get_db_connection().cursor()
+        users = {}
+        for role in ('system_admin', 'accounts', 'teacher'):
+            cursor.execute("SELECT user_id, full_name FROM public.users WHERE role = %s ORDER BY user_id LIMIT 1", (role,))
+            row = cursor.fetchone()
+            if row is None:
+                sys.exit(f"No user with role '{role}' to act as.")
+            users[role] = {'user_id': row[0], 'full_name': row[1], 'role': role}
+        cursor.execute("""
+            SELECT ta.class_id, c.class_name, ta.subject_id, s.subject_name
+            FROM public.teacher_assignments ta
+            JOIN public.teachers t ON t.teacher_id = ta.teacher_id
+            JOIN public.classes c ON c.class_id = ta.class_id
+            JOIN public.subjects s ON s.subject_id = ta.subject_id
+            WHERE t.user_id = %s ORDER BY ta.assignment_id LIMIT 1
+        """, (users['teacher']['user_id'],))
+        taught = cursor.fetchone()
+        if taught is None:
+            sys.exit("The teacher has no class assignments.")
+        cursor.execute("""
+            SELECT c.class_id, s.subject_id FROM public.classes c CROSS JOIN public.subjects s
+            WHERE NOT EXISTS (SELECT 1 FROM public.teacher_assignments ta JOIN public.teachers t ON t.teacher_id = ta.teacher_id
+                              WHERE t.user_id = %s AND ta.class_id = c.class_id AND ta.subject_id = s.subject_id)
+            ORDER BY c.class_id, s.subject_id LIMIT 1
+        """, (users['teacher']['user_id'],))
+        free_pair = cursor.fetchone()
+        cursor.close()
+    return users, taught, free_pair
+
+
+def query_one(app, query, params=(), commit=False):
+    from db import get_db_connection
+    with app.app_context():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+        if commit:
+            conn.commit()
+        cursor.close()
+    return row[0] if row else None
+
+
+def run_round(app, client, args, users, taught, free_pair, record):
+    def act(role, name, path, data):
+        with client.session_transaction() as sess:
+            sess.clear()
+            sess.update(users[role])
+        _statements[0] = 0
+        started = time.perf_counter()
+        response = client.post(path, data=data)
+        elapsed = time.perf_counter() - started
+        record(name, _statements[0], elapsed, response.status_code)
+
+    class_id, class_name, subject_id, subject_name = taught
+    student = {
+        'first_name': 'Bench', 'last_name': 'Mark', 'middle_name': '', 'dob': '2010-01-01', 'gender': 'Male',
+        'class_name': class_name, 'class_id': class_id, 'guardian_contact': '000', 'government_number': f'BENCH-{uuid.uuid4().hex[:12]}',
+        'special_needs': '', 'address': 'Nowhere', 'enrollment_date': '2020-01-01',
+    }
+    act('system_admin', 'register_student', '/students/register', student)
+    student_id = query_one(app, "SELECT MAX(student_id) FROM public.students WHERE first_name = 'Bench' AND last_name = 'Mark'")
+    student_number = query_one(app, "SELECT student_number FROM public.students WHERE student_id = %s", (student_id,))
+    act('system_admin', 'edit_student', f'/students/edit/{student_id}', dict(student, address='Somewhere'))
+
+    fee = {'student_number': student_number, 'amount_paid': '10', 'payment_date': '2020-02-01',
+           'term': args.term, 'academic_year': args.year}
+    act('accounts', 'submit_fee', '/admin/submit_fee', fee)
+    payment_id = query_one(app, "SELECT MAX(payment_id) FROM public.fee_payments WHERE student_id = %s", (student_id,))
+    act('accounts', 'edit_fee', f'/admin/edit_fee/{payment_id}', dict(fee, amount_paid='20'))
+    act('accounts', 'delete_fee', f'/admin/delete_fee/{payment_id}', {})
+
+    result = {'student_id': student_id, 'subject': subject_name, 'subject_id': subject_id, 'term': args.term,
+              'academic_year': args.year, 'ca_score': '70', 'midterm_score': '60', 'final_exam_score': '80'}
+    act('teacher', 'enter_results', '/teachers/enter_results', result)
+    act('teacher', 'enter_results (duplicate)', '/teachers/enter_results', result)
+    result_id = query_one(app, "SELECT MAX(result_id) FROM public.exam_results WHERE student_id = %s", (student_id,))
+    act('teacher', 'edit_result', f'/teachers/edit_result/{result_id}',
+        {'ca_score': '75', 'midterm_score': '65', 'final_exam_score': '85'})
+    act('teacher', 'delete_result', f'/teachers/delete_result/{result_id}', {})
+    act('system_admin', 'delete_student', f'/students/delete/{student_id}', {})
+
+    if free_pair:
+        teacher_user_id = users['teacher']['user_id']
+        act('system_admin', 'add_assignment', f'/assignments/add/{teacher_user_id}',
+            {'class_id': free_pair[0], 'subject_id': free_pair[1]})
+        assignment_id = query_one(app, "SELECT MAX(assignment_id) FROM public.teacher_assignments")
+        act('system_admin', 'remove_assignment', f'/assignments/remove/{assignment_id}', {})
+
+    user_id = query_one(app, """
+        INSERT INTO public.users (full_name, email, password, role)
+        VALUES ('Bench User', 'bench-' || md5(random()::text) || '@example.invalid', '-', 'accounts')
+        RETURNING user_id
+    """, commit=True)
+    act('system_admin', 'delete_user', f'/users/delete/{user_id}', {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--year', default='2099')
+    parser.add_argument('--term', default='Term 1')
+    args = parser.parse_args()
+
+    from app import app
+    app.config['TESTING'] = True
+    client = app.test_client()
+    users, taught, free_pair = setup(app, args)
+
+    counts, times, statuses, order = {}, {}, {}, []
+
+    def record(name, statements, elapsed, status):
+        if name not in counts:
+            order.append(name)
+        counts.setdefault(name, []).append(statements)
+        times.setdefault(name, []).append(elapsed)
+        statuses.setdefault(name, set()).add(status)
+
+    for _ in range(args.rounds):
+        run_round(app, client, args, users, taught, free_pair, record)
+
+    print(f"{'route':<28} {'statements':>10} {'median ms':>10}  status")
+    for name in order:
+        statements = sorted(set(counts[name]))
+        shown = str(statements[0]) if len(statements) == 1 else f"{statements[0]}-{statements[-1]}"
+        print(f"{name:<28} {shown:>10} {statistics.median(times[name]) * 1000:>10.1f}  "
+              f"{','.join(str(s) for s in sorted(statuses[name]))}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
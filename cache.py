@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+import metrics
+
+# Each gunicorn worker keeps its own cached values, but invalidation has to reach
+# every worker. A namespace's generation is the mtime of a marker file in
+# CACHE_DIR; bumping it makes all workers on the host drop entries stored under
+# an older generation on their next read.
+
+
+def _marker_path(namespace):
+    safe = ''.join(ch if ch.isalnum() or ch in '-_.' else '_' for ch in namespace)
+    return os.path.join(Config.CACHE_DIR, 'generations', safe)
+
+
+def current_generation(namespace):
+    try:
+        return os.stat(_marker_path(namespace)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def bump_generation(namespace):
+    """Invalidates `namespace` in every worker on this host."""
+    path = _marker_path(namespace)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a'):
+        pass
+    now = time.time_ns()
+    os.utime(path, ns=(now, now))
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded LRU cache with optional TTL. Keys are grouped by
+    namespace so related entries can be invalidated together across workers.
+    With weigh (value -> int) and max_weight, the least recently used entries
+    are also evicted once the values' total weight passes max_weight.
+    """
+
+    def __init__(self, name, max_entries=1024, ttl=None, max_weight=None, weigh=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.weight = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key, default=None):
+        generation = current_generation(namespace)
+        with self._lock:
+            entry = self._data.get((namespace, key))
+            if entry is not None:
+                value, stored_generation, expires, weight = entry
+                if stored_generation == generation and (expires is None or expires > time.monotonic()):
+                    self._data.move_to_end((namespace, key))
+                    metrics.inc('cache_hits', cache=self.name)
+                    return value
+                del self._data[(namespace, key)]
+                self.weight -= weight
+        metrics.inc('cache_misses', cache=self.name)
+        return default
+
+    def set(self, namespace, key, value, generation=None):
+        if generation is None:
+            generation = current_generation(namespace)
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        weight = self.weigh(value) if self.weigh else 0
+        with self._lock:
+            previous = self._data.pop((namespace, key), None)
+            if previous is not None:
+                self.weight -= previous[3]
+            self._data[(namespace, key)] = (value, generation, expires, weight)
+            self.weight += weight
+            while len(self._data) > self.max_entries or (self.max_weight is not None and self.weight > self.max_weight and len(self._data) > 1):
+                _, evicted = self._data.popitem(last=False)
+                self.weight -= evicted[3]
+                metrics.inc('cache_evictions', cache=self.name)
+
+    def get_or_set(self, namespace, key, factory):
+        value = self.get(namespace, key, _MISSING)
+        if value is _MISSING:
+            # Read the generation before building the value so an invalidation
+            # that lands mid-build is not masked by the fresh entry.
+            generation = current_generation(namespace)
+            value = factory()
+            self.set(namespace, key, value, generation=generation)
+        return value
+
+    def invalidate(self, namespace):
+        bump_generation(namespace)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+_MISSING = object()
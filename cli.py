@@ -0,0 +1,125 @@
+import os
+import click
+from flask.cli import AppGroup
+from db import get_db_connection
+import analytics
+import grading
+import log_partitions
+import terms
+
+# Maintenance commands, run with the app's environment, e.g.
+#   flask --app app db migrate
+#   flask --app app logs maintain      (daily from cron)
+#   flask --app app analytics refresh  (optional; the pivot API refreshes on demand)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+db_cli = AppGroup('db', help='Database schema commands.')
+logs_cli = AppGroup('logs', help='Activity log partitions and archives.')
+grades_cli = AppGroup('grades', help='Grading schemes and grade recomputation.')
+terms_cli = AppGroup('terms', help='Term close-out and report-card snapshots.')
+analytics_cli = AppGroup('analytics', help='Subject performance rollup.')
+
+
+def pending_migrations(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS public.schema_migrations (
+            version TEXT PRIMARY KEY,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT version FROM public.schema_migrations")
+    applied = {row[0] for row in cursor.fetchall()}
+    files = sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith('.sql'))
+    return [f for f in files if f[:-4] not in applied]
+
+
+@db_cli.command('migrate')
+def migrate():
+    """Applies migrations/*.sql that have not run yet, each in its own transaction."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    pending = pending_migrations(cursor)
+    conn.commit()
+    if not pending:
+        click.echo("Schema is up to date.")
+    for filename in pending:
+        with open(os.path.join(MIGRATIONS_DIR, filename)) as f:
+            sql = f.read()
+        try:
+            cursor.execute(sql)
+            cursor.execute("INSERT INTO public.schema_migrations (version) VALUES (%s)", (filename[:-4],))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            click.echo(f"Failed: {filename}", err=True)
+            raise
+        click.echo(f"Applied {filename}")
+    cursor.close()
+
+
+@logs_cli.command('maintain')
+@click.option('--ahead', type=int, default=None, help='Months of partitions to create ahead (default LOG_PARTITIONS_AHEAD).')
+@click.option('--keep', type=int, default=None, help='Months kept in the database (default LOG_RETENTION_MONTHS).')
+def maintain_logs(ahead, keep):
+    """Creates upcoming month partitions and archives expired ones."""
+    conn = get_db_connection()
+    for name in log_partitions.ensure_partitions(conn, months_ahead=ahead):
+        click.echo(f"Created partition {name}")
+    for path in log_partitions.archive_expired(conn, keep_months=keep):
+        click.echo(f"Archived to {path}")
+
+
+@grades_cli.command('recompute')
+@click.option('--year', required=True, help='Academic year, e.g. 2024/2025.')
+@click.option('--term', required=True, help='Term, e.g. "Term 1".')
+@click.option('--class-id', type=int, default=None, help='Only this class.')
+@click.option('--apply', is_flag=True, help='Write the changes (default is a dry run).')
+def recompute_grades(year, term, class_id, apply):
+    """Re-grades a term under the current grading schemes and prints the diff."""
+    try:
+        changes = grading.recompute(get_db_connection(), year, term, class_id=class_id, dry_run=not apply)
+    except terms.TermClosed as e:
+        raise click.ClickException(str(e))
+    click.echo(f"{'result':>8} {'student':>8} {'subject':>8}  {'score':>9}  grade")
+    for row in changes:
+        click.echo(f"{row['result_id']:>8} {row['student_id']:>8} {row['subject_id'] or '-':>8}  "
+                   f"{row['old_score']!s:>3} -> {row['new_score']!s:<3}  {row['old_grade']} -> {row['new_grade']}")
+    click.echo(f"{len(changes)} results {'updated' if apply else 'would change'}.")
+
+
+@terms_cli.command('close')
+@click.option('--year', required=True, help='Academic year, e.g. 2024/2025.')
+@click.option('--term', required=True, help='Term, e.g. "Term 1".')
+def close_term(year, term):
+    """Locks a term's results and snapshots its report cards."""
+    written = terms.close_term(get_db_connection(), year, term)
+    if written is None:
+        raise click.ClickException(f"{term}, {year} is already closed.")
+    click.echo(f"Closed {term}, {year}: {written[0]} report cards, {written[1]} subject reports.")
+
+
+@terms_cli.command('reopen')
+@click.option('--year', required=True, help='Academic year, e.g. 2024/2025.')
+@click.option('--term', required=True, help='Term, e.g. "Term 1".')
+def reopen_term(year, term):
+    """Unlocks a closed term and drops its snapshots."""
+    if not terms.reopen_term(get_db_connection(), year, term):
+        raise click.ClickException(f"{term}, {year} is not closed.")
+    click.echo(f"Reopened {term}, {year}.")
+
+
+@analytics_cli.command('refresh')
+@click.option('--full', is_flag=True, help='Rebuild every cell, not just the ones marked dirty.')
+def refresh_analytics(full):
+    """Rebuilds results_rollup cells whose results changed."""
+    cells = analytics.refresh(get_db_connection(), full=full)
+    click.echo(f"Rebuilt {cells} rollup cells.")
+
+
+def register_commands(app):
+    app.cli.add_command(db_cli)
+    app.cli.add_command(logs_cli)
+    app.cli.add_command(grades_cli)
+    app.cli.add_command(terms_cli)
+    app.cli.add_command(analytics_cli)
@@ -0,0 +1,181 @@
+import time
+import zlib
+import metrics
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+)
+
+
+def _parse_accept_encoding(header):
+    """Returns {coding: q} for an Accept-Encoding header."""
+    accepted = {}
+    for part in header.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        coding, _, params = part.partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def negotiate_encoding(header):
+    """Picks 'br' or 'gzip' for the client, or None if neither is acceptable."""
+    accepted = _parse_accept_encoding(header or '')
+    wildcard = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for coding in ('br', 'gzip'):
+        if coding == 'br' and brotli is None:
+            continue
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class _Compressor:
+    def __init__(self, encoding, level, brotli_level):
+        if encoding == 'br':
+            self._obj = brotli.Compressor(quality=brotli_level)
+            self._compress = self._obj.process
+            self._finish = self._obj.finish
+        else:
+            # wbits=31 -> gzip container
+            self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self._compress = self._obj.compress
+            self._finish = self._obj.flush
+
+    def compress(self, data):
+        return self._compress(data)
+
+    def finish(self):
+        return self._finish()
+
+
+class _CompressedBody:
+    """
+    The compressed body of one response. It is a class rather than a
+    generator so that close() reaches app_iter even when the server never
+    started iterating (a client that disconnects before the body), where a
+    generator's finally would never run.
+    """
+
+    def __init__(self, app_iter, encoding, compressor):
+        self._app_iter = app_iter
+        self._encoding = encoding
+        self._compressor = compressor
+        self._raw_bytes = 0
+        self._sent_bytes = 0
+        self._cpu = 0.0
+        self._closed = False
+
+    def _timed(self, step, *args):
+        started = time.thread_time()
+        try:
+            return step(*args)
+        finally:
+            self._cpu += time.thread_time() - started
+
+    def __iter__(self):
+        for chunk in self._app_iter:
+            if not chunk:
+                continue
+            self._raw_bytes += len(chunk)
+            out = self._timed(self._compressor.compress, chunk)
+            if out:
+                self._sent_bytes += len(out)
+                yield out
+        out = self._timed(self._compressor.finish)
+        if out:
+            self._sent_bytes += len(out)
+            yield out
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if hasattr(self._app_iter, 'close'):
+                self._app_iter.close()
+        finally:
+            encoding = self._encoding
+            metrics.observe('response_compression_cpu_seconds', self._cpu, encoding=encoding)
+            if self._sent_bytes:
+                metrics.observe('response_compression_ratio', self._raw_bytes / self._sent_bytes, encoding=encoding)
+            metrics.inc('response_compression_bytes_in', self._raw_bytes, encoding=encoding)
+            metrics.inc('response_compression_bytes_out', self._sent_bytes, encoding=encoding)
+
+
+class CompressionMiddleware:
+    """
+    WSGI middleware that compresses dynamic text responses with brotli or gzip.
+    Bodies are compressed chunk by chunk as the app yields them, so streamed
+    responses are never buffered in full.
+    """
+
+    def __init__(self, app, min_size=1024, level=6, brotli_level=5):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.brotli_level = brotli_level
+
+    def _should_compress(self, status, headers, environ):
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return False
+        code = int(status.split(' ', 1)[0])
+        if code < 200 or code in (204, 206, 304):
+            return False
+        content_type = ''
+        for name, value in headers:
+            lname = name.lower()
+            if lname == 'content-encoding':
+                return False
+            if lname == 'content-type':
+                content_type = value.lower()
+            elif lname == 'content-length':
+                try:
+                    if int(value) < self.min_size:
+                        return False
+                except ValueError:
+                    return False
+            elif lname == 'cache-control' and 'no-transform' in value.lower():
+                return False
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            return self.app(environ, start_response)
+
+        state = {'compress': False}
+
+        def _start_response(status, headers, exc_info=None):
+            if self._should_compress(status, headers, environ):
+                state['compress'] = True
+                vary = [v for n, v in headers if n.lower() == 'vary']
+                headers = [(n, v) for n, v in headers if n.lower() not in ('content-length', 'vary')]
+                headers.append(('Content-Encoding', encoding))
+                merged_vary = ', '.join(vary + ['Accept-Encoding']) if vary else 'Accept-Encoding'
+                headers.append(('Vary', merged_vary))
+            return start_response(status, headers, exc_info)
+
+        app_iter = self.app(environ, _start_response)
+        if not state['compress']:
+            return app_iter
+        return _CompressedBody(app_iter, encoding, _Compressor(encoding, self.level, self.brotli_level))
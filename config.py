@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 class Config:
     SECRET_KEY = os.environ.get("SECRET_KEY")
@@ -8,3 +9,54 @@ class Config:
     DB_PASSWORD = os.environ.get("DB_PASSWORD")
     DB_NAME = os.environ.get("DB_NAME")
     DEBUG = os.environ.get("DEBUG") == "True"
+    COLD_START_MODE = os.environ.get("COLD_START_MODE", "True") == "True"  # gunicorn.conf.py: preload the app and warm up before serving
+    GUNICORN_WORKER_CLASS = os.environ.get("GUNICORN_WORKER_CLASS", "sync")  # sync or gthread
+    GUNICORN_WORKERS = int(os.environ.get("GUNICORN_WORKERS", os.environ.get("WEB_CONCURRENCY", 2)))
+    GUNICORN_THREADS = int(os.environ.get("GUNICORN_THREADS", 4))  # per gthread worker; keep <= DB_POOL_MAX
+    GUNICORN_TIMEOUT = int(os.environ.get("GUNICORN_TIMEOUT", 30))  # seconds; raised to REQUEST_TIME_BUDGET + 10 if lower
+    GUNICORN_GRACEFUL_TIMEOUT = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))  # seconds for in-flight requests on shutdown
+    COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "True") == "True"
+    COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))  # bytes
+    COMPRESSION_LEVEL = int(os.environ.get("COMPRESSION_LEVEL", 6))  # gzip 1-9
+    BROTLI_LEVEL = int(os.environ.get("BROTLI_LEVEL", 5))  # brotli 0-11
+    CACHE_DIR = os.environ.get("CACHE_DIR", os.path.join(tempfile.gettempdir(), "harmony-cache"))
+    METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(tempfile.gettempdir(), "harmony-metrics"))  # per-worker metric files; empty = this process only
+    METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))  # seconds
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # if set, /metrics wants "Authorization: Bearer <token>"
+    FRAGMENT_CACHE_TTL = int(os.environ.get("FRAGMENT_CACHE_TTL", 300))  # seconds
+    FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get("FRAGMENT_CACHE_MAX_ENTRIES", 512))
+    TRANSCRIPT_CACHE_TTL = int(os.environ.get("TRANSCRIPT_CACHE_TTL", 3600))  # seconds
+    TRANSCRIPT_CACHE_MAX_ENTRIES = int(os.environ.get("TRANSCRIPT_CACHE_MAX_ENTRIES", 2048))
+    ROSTER_CACHE_TTL = int(os.environ.get("ROSTER_CACHE_TTL", 3600))  # seconds
+    ROSTER_CACHE_MAX_ENTRIES = int(os.environ.get("ROSTER_CACHE_MAX_ENTRIES", 256))  # classes per worker
+    ROSTER_CACHE_MAX_STUDENTS = int(os.environ.get("ROSTER_CACHE_MAX_STUDENTS", 20000))  # students across cached rosters, per worker
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD")  # e.g. "scrypt:32768:8:1"; unset = calibrated scrypt
+    PASSWORD_HASH_TARGET_MS = int(os.environ.get("PASSWORD_HASH_TARGET_MS", 150))
+    PASSWORD_HASH_MIN_COST = int(os.environ.get("PASSWORD_HASH_MIN_COST", 16384))  # scrypt N, power of two
+    PASSWORD_HASH_MAX_COST = int(os.environ.get("PASSWORD_HASH_MAX_COST", 65536))  # caps memory at 64 MB per hash
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 8))
+    PASSWORD_HASH_TIMEOUT = int(os.environ.get("PASSWORD_HASH_TIMEOUT", 10))  # seconds
+    LOGIN_FAILURE_BURST = int(os.environ.get("LOGIN_FAILURE_BURST", 5))
+    LOGIN_FAILURE_WINDOW = int(os.environ.get("LOGIN_FAILURE_WINDOW", 300))  # seconds to refill the burst
+    TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 0))  # proxies in front of the app whose X-Forwarded-For is trusted; 0 also turns off per-IP login throttling
+    ASYNC_DB = os.environ.get("ASYNC_DB") == "True"
+    ASYNC_DB_POOL_MIN = int(os.environ.get("ASYNC_DB_POOL_MIN", 2))
+    ASYNC_DB_POOL_MAX = int(os.environ.get("ASYNC_DB_POOL_MAX", 10))
+    ASYNC_DB_WAIT_SLACK = float(os.environ.get("ASYNC_DB_WAIT_SLACK", 5))  # seconds past the time budget a gather waits, e.g. for a connection
+    ASGI_THREADS = int(os.environ.get("ASGI_THREADS", 10))  # WSGI threads per ASGI worker
+    DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+    DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 10))  # per worker; keep >= threads per worker
+    DB_POOL_CHECK_IDLE = float(os.environ.get("DB_POOL_CHECK_IDLE", 5))  # seconds idle before a pooled connection is pinged on checkout
+    DB_PREPARED_STATEMENTS = os.environ.get("DB_PREPARED_STATEMENTS", "True") == "True"  # off behind a transaction-mode pooler
+    STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", 1000))  # rows per FETCH for streamed JSON lists
+    PROFILE_HISTORY_TERMS = int(os.environ.get("PROFILE_HISTORY_TERMS", 3))  # terms of results per page of a profile's history
+    PROFILE_HISTORY_PAYMENTS = int(os.environ.get("PROFILE_HISTORY_PAYMENTS", 20))  # fee payments per page of a profile's history
+    REQUEST_TIME_BUDGET = float(os.environ.get("REQUEST_TIME_BUDGET", 20))  # seconds a request's statements may run; 0 = unlimited
+    DB_READ_DSN = os.environ.get("DB_READ_DSN")  # e.g. "host=... dbname=... user=... password=... sslmode=require"
+    REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", 10))  # read-your-writes window
+    REPLICA_MAX_LAG = float(os.environ.get("REPLICA_MAX_LAG", 5))  # seconds
+    REPLICA_CHECK_INTERVAL = float(os.environ.get("REPLICA_CHECK_INTERVAL", 5))  # seconds between lag checks
+    LOG_PARTITIONS_AHEAD = int(os.environ.get("LOG_PARTITIONS_AHEAD", 3))  # months of activity_logs partitions created in advance
+    LOG_RETENTION_MONTHS = int(os.environ.get("LOG_RETENTION_MONTHS", 12))  # months kept in the database, current one included
+    LOG_ARCHIVE_DIR = os.environ.get("LOG_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "log_archive"))
@@ -6,3 +6,55 @@ class Config:
     DB_PASSWORD = "your-database-password-from-render"
     DB_NAME = "your-database-name-from-render"
     DEBUG = False  # for production
+    COLD_START_MODE = True  # gunicorn.conf.py preloads the app, compiles templates and opens DB pools before serving
+    GUNICORN_WORKER_CLASS = "sync"  # or "gthread" (see benchmarks/worker_models.py)
+    GUNICORN_WORKERS = 2  # worker processes
+    GUNICORN_THREADS = 4  # requests per gthread worker at once; keep <= DB_POOL_MAX
+    GUNICORN_TIMEOUT = 30  # seconds before a stuck worker is killed; at least REQUEST_TIME_BUDGET + 10
+    GUNICORN_GRACEFUL_TIMEOUT = 30  # seconds in-flight requests get to finish on shutdown or restart
+    COMPRESSION_ENABLED = True
+    COMPRESSION_MIN_SIZE = 1024  # responses smaller than this are sent as-is
+    COMPRESSION_LEVEL = 6  # gzip 1-9
+    BROTLI_LEVEL = 5  # brotli 0-11
+    CACHE_DIR = "/tmp/harmony-cache"  # shared by all workers on the host
+    METRICS_DIR = "/tmp/harmony-metrics"  # workers write their metrics here for /metrics to add up; "" = this process only
+    METRICS_FLUSH_INTERVAL = 5  # seconds between each worker's writes
+    METRICS_TOKEN = None  # set to require "Authorization: Bearer <token>" on /metrics
+    FRAGMENT_CACHE_TTL = 300  # seconds
+    FRAGMENT_CACHE_MAX_ENTRIES = 512
+    TRANSCRIPT_CACHE_TTL = 3600  # seconds
+    TRANSCRIPT_CACHE_MAX_ENTRIES = 2048
+    ROSTER_CACHE_TTL = 3600  # seconds
+    ROSTER_CACHE_MAX_ENTRIES = 256  # classes per worker
+    ROSTER_CACHE_MAX_STUDENTS = 20000  # students across cached rosters, per worker
+    PASSWORD_HASH_METHOD = None  # None = scrypt calibrated to PASSWORD_HASH_TARGET_MS
+    PASSWORD_HASH_TARGET_MS = 150
+    PASSWORD_HASH_MIN_COST = 16384  # scrypt N, power of two
+    PASSWORD_HASH_MAX_COST = 65536
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_MAX_PENDING = 8
+    PASSWORD_HASH_TIMEOUT = 10  # seconds
+    LOGIN_FAILURE_BURST = 5  # failed logins allowed per email (and per IP, with TRUSTED_PROXY_HOPS)...
+    LOGIN_FAILURE_WINDOW = 300  # ...before waiting this many seconds for a full refill
+    TRUSTED_PROXY_HOPS = 0  # reverse proxies in front of the app (1 behind nginx or a PaaS router); 0 ignores X-Forwarded-For
+                            # and throttles logins per account only, since every client may share the router's address
+    ASYNC_DB = False  # True when serving through asgi.py
+    ASYNC_DB_POOL_MIN = 2
+    ASYNC_DB_POOL_MAX = 10
+    ASYNC_DB_WAIT_SLACK = 5  # seconds a db_async.gather waits beyond the request's time budget before giving up
+    ASGI_THREADS = 10
+    DB_POOL_MIN = 1
+    DB_POOL_MAX = 10  # per worker; keep >= threads per worker
+    DB_POOL_CHECK_IDLE = 5  # seconds; a connection idle longer is checked with SELECT 1 before use (0 = always)
+    DB_PREPARED_STATEMENTS = True  # PREPARE hot statements per connection; off behind a transaction-mode pooler
+    STREAM_BATCH_SIZE = 1000  # rows fetched and encoded at a time by the streamed JSON list endpoints
+    PROFILE_HISTORY_TERMS = 3  # terms of exam results per "load older" page on a student profile
+    PROFILE_HISTORY_PAYMENTS = 20  # fee payments per page on a student profile (the first page renders with it)
+    REQUEST_TIME_BUDGET = 20  # seconds; statement_timeout for requests without their own budget (0 = unlimited), keep under the worker timeout
+    DB_READ_DSN = None  # libpq DSN of a read replica, None = all reads go to the primary
+    REPLICA_STICKY_SECONDS = 10  # after a write, the session reads from the primary for this long
+    REPLICA_MAX_LAG = 5  # seconds; a replica further behind is skipped
+    REPLICA_CHECK_INTERVAL = 5  # seconds between lag checks
+    LOG_PARTITIONS_AHEAD = 3  # months of activity_logs partitions created in advance
+    LOG_RETENTION_MONTHS = 12  # older months are moved out of the database...
+    LOG_ARCHIVE_DIR = "/var/lib/harmony/log_archive"  # ...into gzip'd CSV files here
@@ -1,21 +1,330 @@
-
+import os
+import re
+import threading
+import time
+import weakref
 import psycopg2
-from flask import g
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.pool
+from flask import g, session, has_request_context
 from config import Config
+import metrics
+
+# Connections are pooled per worker process. Pools are keyed by pid so a
+# forked worker never reuses sockets opened by its parent.
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Hot statements are registered once with prepared_statement() and run with
+# execute_prepared(): each pooled connection PREPAREs a statement the first
+# time it runs it and EXECUTEs it by name after that. Connections are weakly
+# keyed, so one the pool replaces simply starts preparing again.
+_statements = {}
+_prepared = weakref.WeakKeyDictionary()
+
+# Each request's statements are capped at its time budget (utils.time_budget,
+# else REQUEST_TIME_BUDGET) through statement_timeout, so Postgres cancels a
+# runaway query instead of it pinning the worker; app.py turns the
+# QueryCanceled into a timeout response. The setting is per connection and
+# only sent when it changes.
+_timeouts = weakref.WeakKeyDictionary()
+
+# A connection the server or a proxy dropped while it sat in the pool still
+# looks open (conn.closed only notices on the next use), so one that has been
+# idle longer than DB_POOL_CHECK_IDLE is pinged before it is handed out, and
+# replaced once if the ping fails.
+_last_checkin = weakref.WeakKeyDictionary()
+
+_replica_status = {'checked_at': 0.0, 'healthy': False}
+_replica_lock = threading.Lock()
+
+
+_instrumented_factories = {}
+
+
+def _instrumented(factory):
+    # A subclass of the cursor class asked for, timing each execute
+    if factory not in _instrumented_factories:
+        def execute(self, query, vars=None):
+            started = time.perf_counter()
+            try:
+                return factory.execute(self, query, vars)
+            finally:
+                metrics.inc('db_queries')
+                metrics.observe_histogram('db_query_seconds', time.perf_counter() - started)
+
+        def executemany(self, query, vars_list):
+            started = time.perf_counter()
+            try:
+                return factory.executemany(self, query, vars_list)
+            finally:
+                metrics.inc('db_queries')
+                metrics.observe_histogram('db_query_seconds', time.perf_counter() - started)
+
+        _instrumented_factories[factory] = type('Instrumented' + factory.__name__, (factory,),
+                                                {'execute': execute, 'executemany': executemany})
+    return _instrumented_factories[factory]
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Pooled connections count and time their queries for /metrics."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _instrumented(factory)
+        return super().cursor(*args, **kwargs)
+
+
+def _create_pool(name):
+    metrics.set_gauge('db_pool_max_connections', Config.DB_POOL_MAX, pool=name)
+    if name == 'replica':
+        return psycopg2.pool.ThreadedConnectionPool(
+            Config.DB_POOL_MIN, Config.DB_POOL_MAX, dsn=Config.DB_READ_DSN,
+            connection_factory=InstrumentedConnection
+        )
+    return psycopg2.pool.ThreadedConnectionPool(
+        Config.DB_POOL_MIN, Config.DB_POOL_MAX,
+        host=Config.DB_HOST,
+        port=Config.DB_PORT,
+        user=Config.DB_USER,
+        password=Config.DB_PASSWORD,
+        database=Config.DB_NAME,
+        sslmode='require',
+        connection_factory=InstrumentedConnection
+    )
+
+
+def open_pools():
+    """Creates this process's pools now, opening DB_POOL_MIN connections each, rather than on first use."""
+    get_pool('primary')
+    if Config.DB_READ_DSN:
+        get_pool('replica')
+
+
+def close_pools():
+    """Closes this process's pools and their connections, e.g. as a worker exits."""
+    pid = os.getpid()
+    with _pools_lock:
+        for key in [key for key in _pools if key[0] == pid]:
+            _pools.pop(key).closeall()
+
+
+def _record_pool_use(name, pool):
+    # _used holds the pool's checked-out connections
+    metrics.set_gauge('db_pool_connections_in_use', len(pool._used), pool=name)
+
+
+def get_pool(name='primary'):
+    key = (os.getpid(), name)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _create_pool(name)
+                _pools[key] = pool
+    return pool
+
+
+def _alive(conn):
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_checkin.get(conn, 0) < Config.DB_POOL_CHECK_IDLE:
+        return True
+    try:
+        with psycopg2.extensions.cursor(conn) as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+    return True
+
+
+def _checkout(name):
+    pool = get_pool(name)
+    try:
+        conn = pool.getconn()
+        # After a server restart every idle connection is stale; the pool
+        # opens a fresh one once its idle ones are used up
+        for _ in range(Config.DB_POOL_MAX):
+            if _alive(conn):
+                break
+            metrics.inc('db_pool_stale_connections', pool=name)
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+    except psycopg2.pool.PoolError:
+        metrics.inc('db_pool_exhausted', pool=name)
+        raise
+    _record_pool_use(name, pool)
+    if name == 'replica' and not conn.readonly:
+        conn.set_session(readonly=True)
+    return conn
+
+
+def _checkin(name, conn):
+    pool = get_pool(name)
+    try:
+        if not conn.closed:
+            conn.rollback()
+        _last_checkin[conn] = time.monotonic()
+        pool.putconn(conn, close=bool(conn.closed))
+    except psycopg2.Error:
+        pool.putconn(conn, close=True)
+    _record_pool_use(name, pool)
+
+
+def prepared_statement(name, sql):
+    """
+    Registers sql (with positional %s placeholders) under name and returns
+    the name, for execute_prepared().
+    """
+    if name in _statements and _statements[name][0] != sql:
+        raise ValueError(f"Prepared statement '{name}' is already registered with different SQL.")
+    numbers = iter(range(1, sql.count('%s') + 1))
+    _statements[name] = (sql, re.sub(r'%s', lambda match: f'${next(numbers)}', sql))
+    return name
+
+
+def execute_prepared(cursor, name, params=()):
+    """Runs a registered statement on cursor, preparing it on the connection if needed."""
+    sql, numbered_sql = _statements[name]
+    if not Config.DB_PREPARED_STATEMENTS:
+        cursor.execute(sql, params)
+        return
+    conn = cursor.connection
+    prepared = _prepared.setdefault(conn, set())
+    idle = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    if name not in prepared:
+        cursor.execute(f"PREPARE {name} AS {numbered_sql}")
+        prepared.add(name)
+    try:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}", params or None)
+    except psycopg2.errors.InvalidSqlStatementName:
+        # The server forgot its statements (DISCARD ALL, a pooler swapping
+        # sessions). Start over, unless that would lose earlier work.
+        prepared.clear()
+        if not idle:
+            raise
+        conn.rollback()
+        execute_prepared(cursor, name, params)
+
+
+def statement_timeout_ms():
+    """This request's statement_timeout in ms; 0 (unlimited) outside a request, e.g. CLI commands."""
+    return int(g.get('time_budget', Config.REQUEST_TIME_BUDGET) * 1000) if has_request_context() else 0
+
+
+def _apply_time_budget(conn):
+    timeout = statement_timeout_ms()
+    if _timeouts.get(conn, 0) == timeout:
+        return
+    # Outside a transaction, so the rollback at check-in does not undo it
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET statement_timeout = %s", (timeout,))
+    finally:
+        conn.autocommit = False
+    _timeouts[conn] = timeout
+
 
 def get_db_connection():
     if 'db' not in g:
-        g.db = psycopg2.connect(
-            host=Config.DB_HOST,
-            port=Config.DB_PORT,
-            user=Config.DB_USER,
-            password=Config.DB_PASSWORD,
-            database=Config.DB_NAME,
-            sslmode='require'
-        )
+        g.db = _checkout('primary')
+        _apply_time_budget(g.db)
     return g.db
 
+
+def mark_write():
+    """Records that this session just wrote, pinning its reads to the primary for a while."""
+    try:
+        session['last_write_at'] = time.time()
+    except RuntimeError:
+        pass  # outside a request
+
+
+def _replica_healthy():
+    now = time.monotonic()
+    if now - _replica_status['checked_at'] < Config.REPLICA_CHECK_INTERVAL:
+        return _replica_status['healthy']
+    with _replica_lock:
+        if now - _replica_status['checked_at'] < Config.REPLICA_CHECK_INTERVAL:
+            return _replica_status['healthy']
+        healthy = False
+        try:
+            conn = _checkout('replica')
+            try:
+                cursor = conn.cursor()
+                # Replay lag; zero when the replica has applied everything it received
+                cursor.execute("""
+                    SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                           END
+                """)
+                lag = float(cursor.fetchone()[0])
+                cursor.close()
+                metrics.observe('db_replica_lag_seconds', lag)
+                healthy = lag <= Config.REPLICA_MAX_LAG
+            finally:
+                _checkin('replica', conn)
+        except (psycopg2.Error, psycopg2.pool.PoolError) as e:
+            print(f"Read replica unavailable: {e}")
+        _replica_status.update(checked_at=now, healthy=healthy)
+        return healthy
+
+
+def replica_readable():
+    """Whether this request's reads may go to the replica right now (see get_read_connection)."""
+    if not g.get('replica_ok') or not Config.DB_READ_DSN:
+        return False
+    if time.time() - session.get('last_write_at', 0) < Config.REPLICA_STICKY_SECONDS:
+        metrics.inc('db_replica_fallbacks', reason='sticky')
+        return False
+    if not _replica_healthy():
+        metrics.inc('db_replica_fallbacks', reason='unhealthy')
+        return False
+    return True
+
+
+def get_read_connection():
+    """
+    Connection for read-only queries. Routes marked with utils.replica_safe
+    read from the replica when one is configured and healthy, unless this
+    session wrote within the last REPLICA_STICKY_SECONDS. Everything else,
+    and every fallback, uses the primary.
+    """
+    if 'db_read' in g:
+        return g.db_read
+    if not replica_readable():
+        return get_db_connection()
+    try:
+        g.db_read = _checkout('replica')
+    except (psycopg2.Error, psycopg2.pool.PoolError):
+        metrics.inc('db_replica_fallbacks', reason='error')
+        return get_db_connection()
+    metrics.inc('db_replica_reads')
+    _apply_time_budget(g.db_read)
+    return g.db_read
+
+
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
\ No newline at end of file
+        _checkin('primary', db)
+    db_read = g.pop('db_read', None)
+    if db_read is not None:
+        _checkin('replica', db_read)
+
+
+def detach_connection(conn):
+    """
+    Takes one of the request's connections away from close_db, for
+    responses that keep reading from it after the view has returned.
+    Returns the function that checks it back in.
+    """
+    for key, name in (('db', 'primary'), ('db_read', 'replica')):
+        if g.get(key) is conn:
+            g.pop(key)
+            return lambda: _checkin(name, conn)
+    raise ValueError("Not a connection of this request.")
@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+import psycopg2.errors
+import psycopg2.extras
+from flask import has_request_context
+from config import Config
+from db import get_read_connection, replica_readable, statement_timeout_ms
+import metrics
+
+# Async data access for read paths that issue several independent queries.
+# Each worker process runs one background event loop holding a psycopg 3
+# AsyncConnectionPool; Flask views hand it a batch of queries and block only
+# until the slowest one finishes instead of waiting on each round trip in turn.
+# With ASYNC_DB off the same calls run sequentially on the request's psycopg2
+# read connection, so views don't need to know which mode is active.
+# asyncio is only imported once async mode is used, which keeps it off the
+# import path of a sync worker's cold start.
+
+_lock = threading.Lock()
+_loop = None
+_loop_pid = None
+_pools = {}
+_pools_opening = {}
+
+
+def _conninfo(name):
+    from psycopg.conninfo import make_conninfo
+    if name == 'replica':
+        return Config.DB_READ_DSN
+    return make_conninfo(
+        host=Config.DB_HOST,
+        port=Config.DB_PORT,
+        user=Config.DB_USER,
+        password=Config.DB_PASSWORD,
+        dbname=Config.DB_NAME,
+        sslmode='require',
+    )
+
+
+def _get_loop():
+    # A forked worker inherits the module globals but not the loop thread,
+    # so the pid check makes every process start its own loop and pools.
+    global _loop, _loop_pid, _pools, _pools_opening
+    import asyncio
+    if _loop is not None and _loop_pid == os.getpid():
+        return _loop
+    with _lock:
+        if _loop is None or _loop_pid != os.getpid():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='db-async-loop', daemon=True).start()
+            _loop, _loop_pid, _pools, _pools_opening = loop, os.getpid(), {}, {}
+    return _loop
+
+
+async def _read_only(conn):
+    await conn.set_read_only(True)
+
+
+async def _get_pool(name='primary'):
+    import asyncio
+    if name not in _pools:
+        from psycopg.rows import dict_row
+        from psycopg_pool import AsyncConnectionPool
+        pool = _pools[name] = AsyncConnectionPool(
+            _conninfo(name),
+            min_size=Config.ASYNC_DB_POOL_MIN,
+            max_size=Config.ASYNC_DB_POOL_MAX,
+            kwargs={'row_factory': dict_row, 'autocommit': True},
+            configure=_read_only if name == 'replica' else None,
+            open=False,
+        )
+        _pools_opening[name] = asyncio.ensure_future(pool.open(wait=True))
+    opening = _pools_opening[name]
+    try:
+        await asyncio.shield(opening)
+    except Exception:
+        # Start over on the next call rather than keep a pool that never opened
+        if _pools_opening.get(name) is opening:
+            _pools_opening.pop(name)
+            await _pools.pop(name).close()
+        raise
+    return _pools[name]
+
+
+async def fetch_all(query, params=None, pool_name='primary', timeout_ms=0):
+    """
+    Rows of one query on a pooled connection, with statement_timeout set
+    for just its transaction (the request's budget, as db.py applies it).
+    """
+    pool = await _get_pool(pool_name)
+    async with pool.connection() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT set_config('statement_timeout', %s, true)", (str(timeout_ms),))
+            started = time.perf_counter()
+            try:
+                cursor = await conn.execute(query, params)
+                return await cursor.fetchall()
+            finally:
+                metrics.inc('db_queries')
+                metrics.observe_histogram('db_query_seconds', time.perf_counter() - started)
+
+
+async def fetch_one(query, params=None, pool_name='primary', timeout_ms=0):
+    rows = await fetch_all(query, params, pool_name, timeout_ms)
+    return rows[0] if rows else None
+
+
+def run(coro, timeout=None):
+    """Runs a coroutine on the worker's DB loop and waits for its result (at most timeout seconds)."""
+    import asyncio
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result(timeout)
+
+
+async def _gather(queries, pool_name, timeout_ms):
+    import asyncio
+    return await asyncio.gather(*(fetch_all(query, params, pool_name, timeout_ms) for query, params in queries))
+
+
+def _gather_async(queries):
+    import concurrent.futures
+    import psycopg
+    timeout_ms = statement_timeout_ms()
+    # Postgres cancels each statement at the budget; the wait for the whole
+    # batch also covers getting connections from the pool
+    wait = timeout_ms / 1000 + Config.ASYNC_DB_WAIT_SLACK if timeout_ms else None
+    pool_name = 'replica' if has_request_context() and replica_readable() else 'primary'
+    try:
+        try:
+            return run(_gather(queries, pool_name, timeout_ms), wait)
+        except psycopg.OperationalError:
+            if pool_name != 'replica':
+                raise
+            metrics.inc('db_replica_fallbacks', reason='error')
+            return run(_gather(queries, 'primary', timeout_ms), wait)
+    except psycopg.errors.QueryCanceled as e:
+        # Handled like a psycopg2 timeout (app.py's error handler)
+        raise psycopg2.errors.QueryCanceled(str(e)) from e
+    except concurrent.futures.TimeoutError as e:
+        raise psycopg2.errors.QueryCanceled("Timed out waiting for the async database pool.") from e
+
+
+def gather(*queries):
+    """
+    Runs independent read-only (query, params) pairs concurrently, each on its
+    own pooled connection, and returns their row lists in the same order.
+    Queries see separate snapshots, so only batch reads that don't need to
+    be consistent with each other or with uncommitted writes in the request.
+    Like get_read_connection, they go to the replica on replica_safe routes
+    and stop at the request's time budget.
+    """
+    if Config.ASYNC_DB:
+        return _gather_async(queries)
+    conn = get_read_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    results = []
+    for query, params in queries:
+        cursor.execute(query, params)
+        results.append(cursor.fetchall())
+    cursor.close()
+    return results
+
+
+def open_pool():
+    """Opens the async pools ahead of the first request (no-op when disabled)."""
+    if Config.ASYNC_DB:
+        run(_get_pool())
+        if Config.DB_READ_DSN:
+            run(_get_pool('replica'))
+
+
+def close_pool():
+    if _loop_pid != os.getpid():
+        return
+    for name in list(_pools):
+        run(_pools.pop(name).close())
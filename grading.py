@@ -0,0 +1,187 @@
+import psycopg2.extras
+import terms
+import transcripts
+
+# Grading schemes live in grading_schemes/grading_bands (migration 004).
+# Results are graded in SQL: record_result() and regrade_result() grade and
+# write one result in a single statement, and recompute() re-grades a whole
+# term with the same arithmetic. A result keeps the class it was entered in
+# (exam_results.class_id), and is regraded with that class's scheme.
+
+# Most specific scheme for a (year, term, class_id); used by every grading path
+_MATCH_SCHEME = """
+    SELECT g.* FROM public.grading_schemes g
+    WHERE (g.year IS NULL OR g.year = {year})
+      AND (g.term IS NULL OR g.term = {term})
+      AND (g.class_id IS NULL OR g.class_id = {class_id})
+    ORDER BY (g.class_id IS NOT NULL) DESC, (g.term IS NOT NULL) DESC, (g.year IS NOT NULL) DESC, g.scheme_id DESC
+    LIMIT 1
+"""
+
+
+class NoGradingScheme(Exception):
+    """No grading scheme applies to the result being graded."""
+
+
+# Final score and grade for one result's scores under the scheme sch
+_GRADE_ONE = """
+    SELECT sch.scheme_id, sc.final_score,
+           COALESCE((SELECT b.grade FROM public.grading_bands b
+                     WHERE b.scheme_id = sch.scheme_id AND b.min_score <= sc.final_score
+                     ORDER BY b.min_score DESC LIMIT 1), 'N/A') AS grade
+    FROM ({match}) sch
+    CROSS JOIN LATERAL (
+        SELECT round((%(ca_score)s * sch.ca_weight + %(midterm_score)s * sch.midterm_weight + %(final_exam_score)s * sch.final_exam_weight)
+                     / (sch.ca_weight + sch.midterm_weight + sch.final_exam_weight))::int AS final_score
+    ) sc
+"""
+
+# The closed-term and scheme checks ride along in the statement and come
+# back with the outcome, so every path is one round trip. The unique key
+# from migration 009 turns a duplicate into a NULL result_id.
+_RECORD_RESULT = """
+    WITH student AS (
+        SELECT s.student_id, s.first_name, s.last_name, s.class_id
+        FROM public.students s WHERE s.student_id = %(student_id)s
+    ), graded AS (
+        SELECT student.student_id, g.* FROM student LEFT JOIN LATERAL ({grade}) g ON true
+    ), closed AS (
+        SELECT EXISTS (SELECT 1 FROM public.closed_terms WHERE year = %(year)s AND term = %(term)s) AS term_closed
+    ), inserted AS (
+        INSERT INTO public.exam_results
+            (student_id, subject_id, ca_score, midterm_score, final_exam_score, final_score, grade, term, year, class_id)
+        SELECT graded.student_id, %(subject_id)s::int, %(ca_score)s, %(midterm_score)s, %(final_exam_score)s,
+               graded.final_score, graded.grade, %(term)s, %(year)s, student.class_id
+        FROM graded JOIN student USING (student_id), closed
+        WHERE graded.scheme_id IS NOT NULL AND NOT closed.term_closed
+        ON CONFLICT (student_id, subject_id, term, year) DO NOTHING
+        RETURNING result_id
+    )
+    SELECT student.first_name, student.last_name, graded.scheme_id, graded.final_score, graded.grade,
+           closed.term_closed, (SELECT result_id FROM inserted) AS result_id
+    FROM student JOIN graded USING (student_id) CROSS JOIN closed
+""".format(grade=_GRADE_ONE.format(match=_MATCH_SCHEME.format(year='%(year)s', term='%(term)s', class_id='student.class_id')))
+
+_REGRADE_RESULT = """
+    WITH existing AS (
+        SELECT er.*, sub.subject_name AS subject, s.first_name, s.last_name,
+               EXISTS (SELECT 1 FROM public.closed_terms ct WHERE ct.year = er.year AND ct.term = er.term) AS term_closed
+        FROM public.exam_results er
+        JOIN public.students s ON s.student_id = er.student_id
+        LEFT JOIN public.subjects sub ON sub.subject_id = er.subject_id
+        WHERE er.result_id = %(result_id)s
+    ), graded AS (
+        SELECT existing.result_id, g.* FROM existing LEFT JOIN LATERAL ({grade}) g ON true
+    ), updated AS (
+        UPDATE public.exam_results er
+        SET ca_score = %(ca_score)s, midterm_score = %(midterm_score)s, final_exam_score = %(final_exam_score)s,
+            final_score = graded.final_score, grade = graded.grade
+        FROM graded, existing
+        WHERE er.result_id = graded.result_id AND existing.result_id = graded.result_id
+          AND graded.scheme_id IS NOT NULL AND NOT existing.term_closed
+        RETURNING er.result_id
+    )
+    SELECT existing.*, graded.scheme_id, graded.final_score AS new_final_score, graded.grade AS new_grade
+    FROM existing JOIN graded USING (result_id)
+""".format(grade=_GRADE_ONE.format(match=_MATCH_SCHEME.format(year='existing.year', term='existing.term', class_id='existing.class_id')))
+
+
+def _scores(ca_score, midterm_score, final_exam_score):
+    return {'ca_score': ca_score, 'midterm_score': midterm_score, 'final_exam_score': final_exam_score}
+
+
+def record_result(cursor, student_id, subject_id, year, term, ca_score, midterm_score, final_exam_score):
+    """
+    Grades and inserts a new result. Returns a row with result_id,
+    final_score, grade and the student's names (None if there is no such
+    student); result_id is None when the student already has a result for
+    that subject and term. Raises terms.TermClosed or NoGradingScheme.
+    Does not commit.
+    """
+    cursor.execute(_RECORD_RESULT, dict(_scores(ca_score, midterm_score, final_exam_score),
+                                        student_id=student_id, subject_id=subject_id, year=year, term=term))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    if row['term_closed']:
+        raise terms.TermClosed(year, term)
+    if row['scheme_id'] is None:
+        raise NoGradingScheme(f"No grading scheme for {term} {year}.")
+    return row
+
+
+def regrade_result(cursor, result_id, ca_score, midterm_score, final_exam_score):
+    """
+    Replaces a result's scores and re-grades it. Returns the result as it
+    was (with subject, student names and class_id) plus new_final_score and
+    new_grade, or None if there is no such result. Raises terms.TermClosed
+    or NoGradingScheme. Does not commit.
+    """
+    cursor.execute(_REGRADE_RESULT, dict(_scores(ca_score, midterm_score, final_exam_score), result_id=result_id))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    if row['term_closed']:
+        raise terms.TermClosed(row['year'], row['term'])
+    if row['scheme_id'] is None:
+        raise NoGradingScheme(f"No grading scheme for {row['term']} {row['year']}.")
+    return row
+
+
+_REGRADED = """
+    WITH scoped AS (
+        SELECT er.result_id, er.student_id, er.subject_id, er.final_score AS old_score, er.grade AS old_grade,
+               sch.scheme_id,
+               round((er.ca_score * sch.ca_weight + er.midterm_score * sch.midterm_weight + er.final_exam_score * sch.final_exam_weight)
+                     / (sch.ca_weight + sch.midterm_weight + sch.final_exam_weight))::int AS new_score
+        FROM public.exam_results er
+        CROSS JOIN LATERAL ({match}) sch
+        WHERE er.year = %(year)s AND er.term = %(term)s
+          AND (%(class_id)s::int IS NULL OR er.class_id = %(class_id)s::int)
+    ), regraded AS (
+        SELECT scoped.*,
+               COALESCE((SELECT b.grade FROM public.grading_bands b
+                         WHERE b.scheme_id = scoped.scheme_id AND b.min_score <= scoped.new_score
+                         ORDER BY b.min_score DESC LIMIT 1), 'N/A') AS new_grade
+        FROM scoped
+    )
+""".format(match=_MATCH_SCHEME.format(year='er.year', term='er.term', class_id='er.class_id'))
+
+_CHANGED = "(r.new_score IS DISTINCT FROM r.old_score OR r.new_grade IS DISTINCT FROM r.old_grade)"
+
+
+def recompute(conn, year, term, class_id=None, dry_run=True):
+    """
+    Re-grades every result of a term (optionally one class) under the
+    schemes now in force. Returns the rows whose score or grade changes,
+    with old and new values. With dry_run nothing is written; otherwise all
+    changes are applied by one UPDATE and committed. Raises
+    terms.TermClosed when applying to a closed term.
+    """
+    params = {'year': year, 'term': term, 'class_id': class_id}
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    if not dry_run:
+        try:
+            terms.ensure_open(cursor, year, term)
+        except terms.TermClosed:
+            cursor.close()
+            raise
+    if dry_run:
+        cursor.execute(_REGRADED + f"""
+            SELECT r.result_id, r.student_id, r.subject_id, r.scheme_id, r.old_score, r.new_score, r.old_grade, r.new_grade
+            FROM regraded r WHERE {_CHANGED} ORDER BY r.student_id, r.subject_id
+        """, params)
+    else:
+        cursor.execute(_REGRADED + f"""
+            UPDATE public.exam_results er
+            SET final_score = r.new_score, grade = r.new_grade
+            FROM regraded r
+            WHERE er.result_id = r.result_id AND {_CHANGED}
+            RETURNING r.result_id, r.student_id, r.subject_id, r.scheme_id, r.old_score, r.new_score, r.old_grade, r.new_grade
+        """, params)
+    changes = [dict(row) for row in cursor.fetchall()]
+    if not dry_run:
+        conn.commit()
+        transcripts.invalidate_transcript(*(row['student_id'] for row in changes))
+    cursor.close()
+    return changes
@@ -0,0 +1,66 @@
+# gunicorn -c gunicorn.conf.py app:app
+#
+# Production profile. GUNICORN_WORKER_CLASS picks sync workers (one
+# request at a time per process) or gthread (GUNICORN_THREADS requests
+# per process, sharing its pool and caches); benchmarks/worker_models.py
+# compares them. gunicorn binds to $PORT when it is set.
+#
+# With COLD_START_MODE on, the app is imported once in the master and the
+# workers are forked from it with templates already compiled, and each
+# worker warms up before it accepts requests (see warmup.py).
+#
+# Everything that holds sockets or threads is per worker: post_fork
+# opens the worker's DB pools and starts its metrics flusher, and
+# worker_exit, which runs once in-flight requests have finished, writes
+# the last metrics and closes the pools.
+from config import Config
+
+worker_class = Config.GUNICORN_WORKER_CLASS
+workers = Config.GUNICORN_WORKERS
+threads = Config.GUNICORN_THREADS if worker_class == 'gthread' else 1
+# Longer than any request's statement budget, so a slow query is cancelled
+# by Postgres and answered before the worker is killed
+timeout = max(Config.GUNICORN_TIMEOUT, int(Config.REQUEST_TIME_BUDGET) + 10)
+graceful_timeout = Config.GUNICORN_GRACEFUL_TIMEOUT
+keepalive = 5
+preload_app = Config.COLD_START_MODE
+
+
+def on_starting(server):
+    import metrics
+    metrics.clear_worker_files()
+    if threads > Config.DB_POOL_MAX:
+        server.log.warning("GUNICORN_THREADS (%s) is more than DB_POOL_MAX (%s); busy workers will run out of connections",
+                           threads, Config.DB_POOL_MAX)
+    if Config.COLD_START_MODE:
+        import warmup
+        from app import app
+        warmup.warm_app(app, server.log)
+
+
+def post_fork(server, worker):
+    import psycopg2
+    import db
+    import metrics
+    metrics.start_flusher()
+    try:
+        db.open_pools()
+    except psycopg2.Error as e:
+        # Requests open the pools lazily once the database answers
+        server.log.warning("Worker %s could not open its database pools: %s", worker.pid, e)
+
+
+def post_worker_init(worker):
+    if Config.COLD_START_MODE:
+        import warmup
+        from app import app
+        warmup.warm_worker(app, worker.log)
+
+
+def worker_exit(server, worker):
+    import db
+    import db_async
+    import metrics
+    metrics.flush()
+    db_async.close_pool()
+    db.close_pools()
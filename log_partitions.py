@@ -0,0 +1,189 @@
+import csv
+import gzip
+import os
+import re
+from collections import deque
+from datetime import date, datetime
+from config import Config
+
+# activity_logs is range-partitioned by month on "timestamp" (see
+# migrations/001_partition_activity_logs.sql). Month partitions are named
+# activity_logs_yYYYYmMM; anything without a partition lands in
+# activity_logs_default. Months past LOG_RETENTION_MONTHS are detached and
+# written to LOG_ARCHIVE_DIR as gzip'd CSV, one file per month.
+
+PARTITION_RE = re.compile(r'^activity_logs_y(\d{4})m(\d{2})$')
+ARCHIVE_COLUMNS = ['log_id', 'user_id', 'user_full_name', 'action', 'timestamp', 'event_type', 'entity_type', 'entity_id', 'payload']
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def parse_month(text):
+    """'YYYY-MM' -> first day of that month, or None if malformed."""
+    try:
+        return datetime.strptime(text, '%Y-%m').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def partition_name(month):
+    return f"activity_logs_y{month.year:04d}m{month.month:02d}"
+
+
+def archive_path(month):
+    return os.path.join(Config.LOG_ARCHIVE_DIR, f"activity_logs_{month:%Y-%m}.csv.gz")
+
+
+def _partition_months(cursor, attached_only=False):
+    # Detached partitions are still plain tables with the partition's name,
+    # so a retention run that died before archiving is picked up next time.
+    if attached_only:
+        cursor.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'public.activity_logs'::regclass
+        """)
+    else:
+        cursor.execute("""
+            SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'public' AND c.relkind = 'r' AND c.relname LIKE 'activity\\_logs\\_y%'
+        """)
+    months = []
+    for (name,) in cursor.fetchall():
+        match = PARTITION_RE.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def _create_partition(cursor, month):
+    # Rows for this month may already sit in the default partition; Postgres
+    # refuses to attach over them, so they are moved into the new table first.
+    name = partition_name(month)
+    lower, upper = month, add_months(month, 1)
+    cursor.execute(f"CREATE TABLE public.{name} (LIKE public.activity_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(f"""
+        WITH moved AS (
+            DELETE FROM public.activity_logs_default
+            WHERE timestamp >= %s AND timestamp < %s
+            RETURNING *
+        )
+        INSERT INTO public.{name} SELECT * FROM moved
+    """, (lower, upper))
+    cursor.execute(f"ALTER TABLE public.activity_logs ATTACH PARTITION public.{name} FOR VALUES FROM (%s) TO (%s)", (lower, upper))
+
+
+def ensure_partitions(conn, months_ahead=None, today=None):
+    """
+    Creates partitions for the current month and months_ahead months after
+    it, plus any earlier month that still has rows in the default partition.
+    Returns the names of the partitions created.
+    """
+    months_ahead = Config.LOG_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+    current = month_start(today or date.today())
+    cursor = conn.cursor()
+    existing = set(_partition_months(cursor))
+    cursor.execute("SELECT DISTINCT date_trunc('month', timestamp)::date FROM public.activity_logs_default WHERE timestamp < %s", (current,))
+    months = sorted(row[0] for row in cursor.fetchall())
+    months += [add_months(current, offset) for offset in range(months_ahead + 1)]
+    created = []
+    for month in months:
+        if month not in existing:
+            _create_partition(cursor, month)
+            conn.commit()
+            existing.add(month)
+            created.append(partition_name(month))
+    cursor.close()
+    return created
+
+
+def retention_cutoff(today=None, keep_months=None):
+    """First month still kept in the database."""
+    keep_months = Config.LOG_RETENTION_MONTHS if keep_months is None else keep_months
+    return add_months(month_start(today or date.today()), -(keep_months - 1))
+
+
+def _write_archive(cursor, name, month):
+    os.makedirs(Config.LOG_ARCHIVE_DIR, exist_ok=True)
+    path = archive_path(month)
+    partial = path + '.partial'
+    columns = ', '.join(ARCHIVE_COLUMNS)
+    with gzip.open(partial, 'wb') as raw:
+        cursor.copy_expert(f"COPY (SELECT {columns} FROM public.{name} ORDER BY timestamp, log_id) TO STDOUT WITH CSV HEADER", raw)
+    if os.path.exists(path):
+        # Several detach runs for the same month: keep both sets of rows
+        with gzip.open(path, 'rt', newline='') as old, gzip.open(partial, 'rt', newline='') as new:
+            rows = list(csv.DictReader(old)) + list(csv.DictReader(new))
+        rows.sort(key=lambda row: (row['timestamp'], int(row['log_id'])))
+        with gzip.open(partial, 'wt', newline='') as out:
+            writer = csv.DictWriter(out, fieldnames=ARCHIVE_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    os.replace(partial, path)
+    return path
+
+
+def archive_expired(conn, keep_months=None, today=None):
+    """
+    Detaches month partitions older than the retention window, writes each
+    to LOG_ARCHIVE_DIR (empty months get no file) and drops it. The table is dropped only after its
+    archive file is in place. Returns the archive paths written.
+    """
+    cutoff = retention_cutoff(today, keep_months)
+    cursor = conn.cursor()
+    attached = set(_partition_months(cursor, attached_only=True))
+    written = []
+    for month in _partition_months(cursor):
+        if month >= cutoff:
+            continue
+        name = partition_name(month)
+        if month in attached:
+            cursor.execute(f"ALTER TABLE public.activity_logs DETACH PARTITION public.{name}")
+            conn.commit()
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM public.{name})")
+        if cursor.fetchone()[0]:
+            written.append(_write_archive(cursor, name, month))
+        cursor.execute(f"DROP TABLE public.{name}")
+        conn.commit()
+    cursor.close()
+    return written
+
+
+def archived_months():
+    if not os.path.isdir(Config.LOG_ARCHIVE_DIR):
+        return []
+    months = []
+    for filename in os.listdir(Config.LOG_ARCHIVE_DIR):
+        match = re.match(r'^activity_logs_(\d{4}-\d{2})\.csv\.gz$', filename)
+        if match:
+            months.append(match.group(1))
+    return sorted(months, reverse=True)
+
+
+def read_archive(month, before=None, limit=None):
+    """
+    One page of an archived month, newest first, shaped like the
+    activity_logs query: the limit rows before the (timestamp, log_id)
+    cursor before, or the newest ones. Archives are written oldest first,
+    so the file is streamed up to the cursor and only a page is kept.
+    """
+    path = archive_path(month)
+    if not os.path.exists(path):
+        return None
+    rows = deque(maxlen=limit)
+    with gzip.open(path, 'rt', newline='') as f:
+        for row in csv.DictReader(f):
+            row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+            row['log_id'] = int(row['log_id'])
+            if before is not None and (row['timestamp'], row['log_id']) >= before:
+                break
+            rows.append(row)
+    rows.reverse()
+    return list(rows)
@@ -0,0 +1,47 @@
+from db import prepared_statement, execute_prepared
+
+# students and exam_results reference classes and subjects by id. Forms and
+# older API clients still send names, so the resolvers accept either, and
+# the SELECTs below put the names back under their old column names
+# (class_name, subject) for templates and JSON responses.
+
+STUDENTS_WITH_CLASS = """
+    SELECT s.*, c.class_name
+    FROM public.students s
+    LEFT JOIN public.classes c ON c.class_id = s.class_id
+"""
+
+RESULTS_WITH_SUBJECT = """
+    SELECT er.*, sub.subject_name AS subject
+    FROM public.exam_results er
+    LEFT JOIN public.subjects sub ON sub.subject_id = er.subject_id
+"""
+
+
+_BY_NAME = {
+    table: prepared_statement(f'{table}_id_by_name', f"SELECT {id_column} FROM public.{table} WHERE lower({name_column}) = lower(%s) ORDER BY {id_column} LIMIT 1")
+    for table, id_column, name_column in (('classes', 'class_id', 'class_name'), ('subjects', 'subject_id', 'subject_name'))
+}
+
+
+def _resolve(cursor, table, id_column, name_column, id_value, name_value):
+    if id_value not in (None, ''):
+        try:
+            return int(id_value)
+        except (TypeError, ValueError):
+            return None
+    if not name_value:
+        return None
+    execute_prepared(cursor, _BY_NAME[table], (name_value.strip(),))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def resolve_class_id(cursor, class_id=None, class_name=None):
+    """class_id as an int, or the id of class_name (case-insensitive). None if unknown."""
+    return _resolve(cursor, 'classes', 'class_id', 'class_name', class_id, class_name)
+
+
+def resolve_subject_id(cursor, subject_id=None, subject_name=None):
+    """subject_id as an int, or the id of subject_name (case-insensitive). None if unknown."""
+    return _resolve(cursor, 'subjects', 'subject_id', 'subject_name', subject_id, subject_name)
@@ -0,0 +1,248 @@
+import json
+import os
+import re
+import threading
+import time
+from config import Config
+
+# In-process metrics store. Values are keyed by (metric name, sorted label pairs)
+# so call sites can record without registering anything up front.
+#
+# Gunicorn runs several workers, and a scrape of /metrics reaches only one,
+# so with METRICS_DIR set each worker also writes its values to a file there
+# every METRICS_FLUSH_INTERVAL seconds and render() adds up every worker's
+# file. Counters, summaries and histograms of workers that have exited are
+# kept (their totals still happened); gauges only count live workers. Clear
+# the directory (clear_worker_files) before workers start.
+_lock = threading.Lock()
+_counters = {}
+_summaries = {}
+_histograms = {}
+_gauges = {}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_flusher_pid = None
+
+
+def _after_fork():
+    # The flusher thread may have held the lock when the process forked
+    global _lock
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name, amount=1, **labels):
+    """Adds `amount` to a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    start_flusher()
+
+
+def observe(name, value, **labels):
+    """Records one observation (count, sum, max) for a summary metric."""
+    key = _key(name, labels)
+    with _lock:
+        count, total, peak = _summaries.get(key, (0, 0.0, value))
+        _summaries[key] = (count + 1, total + value, max(peak, value))
+    start_flusher()
+
+
+def observe_histogram(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Records one observation in a histogram with the given upper bounds."""
+    key = _key(name, labels)
+    with _lock:
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = {'buckets': list(buckets), 'counts': [0] * len(buckets), 'count': 0, 'sum': 0.0}
+        for i, bound in enumerate(entry['buckets']):
+            if value <= bound:
+                entry['counts'][i] += 1
+                break
+        entry['count'] += 1
+        entry['sum'] += value
+    start_flusher()
+
+
+def set_gauge(name, value, **labels):
+    """Sets a gauge; across workers the live workers' values are added up."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+    start_flusher()
+
+
+def snapshot():
+    """Returns a copy of every metric recorded so far in this process."""
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'summaries': dict(_summaries),
+            'histograms': {key: dict(entry, counts=list(entry['counts'])) for key, entry in _histograms.items()},
+            'gauges': dict(_gauges),
+        }
+
+
+# --- Sharing between workers ---
+
+def _worker_path(pid):
+    return os.path.join(Config.METRICS_DIR, f'worker-{pid}.json')
+
+
+def flush():
+    """Writes this process's metrics to its file in METRICS_DIR."""
+    if not Config.METRICS_DIR:
+        return
+    data = snapshot()
+    encoded = {kind: [[name, list(labels), value] for (name, labels), value in values.items()] for kind, values in data.items()}
+    os.makedirs(Config.METRICS_DIR, exist_ok=True)
+    path = _worker_path(os.getpid())
+    with open(path + '.tmp', 'w') as f:
+        json.dump(encoded, f)
+    os.replace(path + '.tmp', path)
+
+
+def _flush_forever():
+    while True:
+        time.sleep(Config.METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def start_flusher():
+    """
+    Starts this process's flusher thread, once. Recording a metric starts
+    it too, so a worker forked from a preloaded master always gets its own.
+    """
+    global _flusher_pid
+    if _flusher_pid == os.getpid() or not Config.METRICS_DIR:
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_forever, name='metrics-flush', daemon=True).start()
+
+
+def clear_worker_files():
+    if not Config.METRICS_DIR or not os.path.isdir(Config.METRICS_DIR):
+        return
+    for filename in os.listdir(Config.METRICS_DIR):
+        if filename.startswith('worker-'):
+            os.remove(os.path.join(Config.METRICS_DIR, filename))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _load(data, into, live):
+    for name, labels, value in data.get('counters', []):
+        key = (name, tuple(map(tuple, labels)))
+        into['counters'][key] = into['counters'].get(key, 0) + value
+    for name, labels, (count, total, peak) in data.get('summaries', []):
+        key = (name, tuple(map(tuple, labels)))
+        previous = into['summaries'].get(key)
+        into['summaries'][key] = (count, total, peak) if previous is None else \
+            (previous[0] + count, previous[1] + total, max(previous[2], peak))
+    for name, labels, entry in data.get('histograms', []):
+        key = (name, tuple(map(tuple, labels)))
+        previous = into['histograms'].get(key)
+        if previous is None or previous['buckets'] != entry['buckets']:
+            into['histograms'][key] = entry
+        else:
+            previous['counts'] = [a + b for a, b in zip(previous['counts'], entry['counts'])]
+            previous['count'] += entry['count']
+            previous['sum'] += entry['sum']
+    if live:
+        for name, labels, value in data.get('gauges', []):
+            key = (name, tuple(map(tuple, labels)))
+            into['gauges'][key] = into['gauges'].get(key, 0) + value
+
+
+def collect():
+    """Every worker's metrics added together (this process only without METRICS_DIR)."""
+    if not Config.METRICS_DIR:
+        return snapshot()
+    flush()
+    merged = {'counters': {}, 'summaries': {}, 'histograms': {}, 'gauges': {}}
+    for filename in os.listdir(Config.METRICS_DIR):
+        match = re.fullmatch(r'worker-(\d+)\.json', filename)
+        if not match:
+            continue
+        try:
+            with open(os.path.join(Config.METRICS_DIR, filename)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        _load(data, merged, _alive(int(match.group(1))))
+    return merged
+
+
+# --- Prometheus text format ---
+
+def _metric_name(name):
+    return 'harmony_' + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def _by_name(values):
+    grouped = {}
+    for (name, labels), value in sorted(values.items(), key=lambda item: (item[0][0], item[0][1])):
+        grouped.setdefault(name, []).append((labels, value))
+    return grouped.items()
+
+
+def render():
+    """All workers' metrics in the Prometheus text exposition format."""
+    data = collect()
+    lines = []
+    for name, series in _by_name(data['counters']):
+        metric = _metric_name(name) + '_total'
+        lines.append(f'# TYPE {metric} counter')
+        lines.extend(f'{metric}{_labels(labels)} {value}' for labels, value in series)
+    for name, series in _by_name(data['gauges']):
+        metric = _metric_name(name)
+        lines.append(f'# TYPE {metric} gauge')
+        lines.extend(f'{metric}{_labels(labels)} {value}' for labels, value in series)
+    for name, series in _by_name(data['summaries']):
+        metric = _metric_name(name)
+        lines.append(f'# TYPE {metric} summary')
+        for labels, (count, total, peak) in series:
+            lines.append(f'{metric}_count{_labels(labels)} {count}')
+            lines.append(f'{metric}_sum{_labels(labels)} {total}')
+        lines.append(f'# TYPE {metric}_max gauge')
+        lines.extend(f'{metric}_max{_labels(labels)} {peak}' for labels, (_, _, peak) in series)
+    for name, series in _by_name(data['histograms']):
+        metric = _metric_name(name)
+        lines.append(f'# TYPE {metric} histogram')
+        for labels, entry in series:
+            cumulative = 0
+            for bound, count in zip(entry['buckets'], entry['counts']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{metric}_bucket{_labels(labels, [("le", "+Inf")])} {entry["count"]}')
+            lines.append(f'{metric}_sum{_labels(labels)} {entry["sum"]}')
+            lines.append(f'{metric}_count{_labels(labels)} {entry["count"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,28 @@
+-- Turns activity_logs into a table range-partitioned by month on "timestamp".
+-- Existing rows are copied into the default partition; `flask logs maintain`
+-- then moves them into month partitions and creates the upcoming months.
+
+ALTER TABLE public.activity_logs RENAME TO activity_logs_unpartitioned;
+ALTER TABLE public.activity_logs_unpartitioned ALTER COLUMN log_id DROP DEFAULT;
+ALTER SEQUENCE public.activity_logs_log_id_seq OWNED BY NONE;
+
+CREATE TABLE public.activity_logs (
+    log_id INTEGER NOT NULL DEFAULT nextval('public.activity_logs_log_id_seq'),
+    user_id INTEGER,
+    user_full_name TEXT,
+    action TEXT,
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (log_id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+ALTER SEQUENCE public.activity_logs_log_id_seq OWNED BY public.activity_logs.log_id;
+
+CREATE TABLE public.activity_logs_default PARTITION OF public.activity_logs DEFAULT;
+
+CREATE INDEX activity_logs_timestamp_idx ON public.activity_logs (timestamp DESC);
+
+INSERT INTO public.activity_logs (log_id, user_id, user_full_name, action, timestamp)
+SELECT log_id, user_id, user_full_name, action, COALESCE(timestamp, CURRENT_TIMESTAMP)
+FROM public.activity_logs_unpartitioned;
+
+DROP TABLE public.activity_logs_unpartitioned;
@@ -0,0 +1,13 @@
+-- Typed audit columns on activity_logs. user_id stays the actor; "action"
+-- keeps the human-readable sentence shown in the log viewer.
+
+ALTER TABLE public.activity_logs
+    ADD COLUMN event_type TEXT,
+    ADD COLUMN entity_type TEXT,
+    ADD COLUMN entity_id INTEGER,
+    ADD COLUMN payload JSONB;
+
+-- Entity history: one index range per (entity_type, entity_id), newest first
+CREATE INDEX activity_logs_entity_idx ON public.activity_logs (entity_type, entity_id, timestamp DESC);
+-- "All fee edits last week"
+CREATE INDEX activity_logs_event_type_idx ON public.activity_logs (event_type, timestamp DESC);
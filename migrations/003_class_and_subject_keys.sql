@@ -0,0 +1,30 @@
+-- students.class_name -> students.class_id and exam_results.subject ->
+-- exam_results.subject_id. Names that have no row in classes/subjects yet
+-- are added first so no student or result loses its reference.
+
+INSERT INTO public.classes (class_name)
+SELECT DISTINCT trim(s.class_name) FROM public.students s
+WHERE s.class_name IS NOT NULL AND trim(s.class_name) <> ''
+  AND NOT EXISTS (SELECT 1 FROM public.classes c WHERE lower(c.class_name) = lower(trim(s.class_name)));
+
+INSERT INTO public.subjects (subject_name)
+SELECT DISTINCT trim(er.subject) FROM public.exam_results er
+WHERE er.subject IS NOT NULL AND trim(er.subject) <> ''
+  AND NOT EXISTS (SELECT 1 FROM public.subjects sub WHERE lower(sub.subject_name) = lower(trim(er.subject)));
+
+ALTER TABLE public.students ADD COLUMN class_id INTEGER REFERENCES public.classes (class_id);
+UPDATE public.students s SET class_id = (
+    SELECT min(c.class_id) FROM public.classes c WHERE lower(c.class_name) = lower(trim(s.class_name))
+);
+
+ALTER TABLE public.exam_results ADD COLUMN subject_id INTEGER REFERENCES public.subjects (subject_id);
+UPDATE public.exam_results er SET subject_id = (
+    SELECT min(sub.subject_id) FROM public.subjects sub WHERE lower(sub.subject_name) = lower(trim(er.subject))
+);
+
+ALTER TABLE public.students DROP COLUMN class_name;
+ALTER TABLE public.exam_results DROP COLUMN subject;
+
+CREATE INDEX students_class_id_idx ON public.students (class_id);
+CREATE INDEX exam_results_subject_id_idx ON public.exam_results (subject_id, year, term);
+CREATE INDEX exam_results_student_id_idx ON public.exam_results (student_id, year, term);
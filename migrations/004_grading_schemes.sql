@@ -0,0 +1,30 @@
+-- Grading policy as data. A scheme weights the three score components
+-- (relative weights, final = round(weighted mean)) and maps final scores to
+-- grades through its bands. year/term/class_id narrow where a scheme
+-- applies; NULL means "any". The most specific matching scheme wins.
+
+CREATE TABLE public.grading_schemes (
+    scheme_id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    ca_weight NUMERIC NOT NULL DEFAULT 1 CHECK (ca_weight >= 0),
+    midterm_weight NUMERIC NOT NULL DEFAULT 1 CHECK (midterm_weight >= 0),
+    final_exam_weight NUMERIC NOT NULL DEFAULT 1 CHECK (final_exam_weight >= 0),
+    year TEXT,
+    term TEXT,
+    class_id INTEGER REFERENCES public.classes (class_id) ON DELETE CASCADE,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CHECK (ca_weight + midterm_weight + final_exam_weight > 0)
+);
+
+CREATE TABLE public.grading_bands (
+    scheme_id INTEGER NOT NULL REFERENCES public.grading_schemes (scheme_id) ON DELETE CASCADE,
+    min_score NUMERIC NOT NULL,
+    grade TEXT NOT NULL,
+    PRIMARY KEY (scheme_id, min_score)
+);
+
+-- The policy that used to be hardcoded in teacher.py: equal thirds and these bands
+INSERT INTO public.grading_schemes (scheme_id, name) VALUES (1, 'Default');
+SELECT setval('public.grading_schemes_scheme_id_seq', 1);
+INSERT INTO public.grading_bands (scheme_id, min_score, grade) VALUES
+    (1, 90, 'A+'), (1, 80, 'A'), (1, 70, 'B'), (1, 60, 'C'), (1, 50, 'D'), (1, 40, 'E'), (1, 0, 'F');
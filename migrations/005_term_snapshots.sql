@@ -0,0 +1,68 @@
+-- Closed terms and their report snapshots. Closing a term (terms.close_term)
+-- fills both snapshot tables in one transaction; from then on the report
+-- endpoints read a single row by primary key and exam_results rows of that
+-- term can no longer change.
+
+CREATE TABLE public.closed_terms (
+    year TEXT NOT NULL,
+    term TEXT NOT NULL,
+    closed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    closed_by INTEGER,
+    PRIMARY KEY (year, term)
+);
+
+-- One row per student: the report card with totals and class position
+CREATE TABLE public.report_card_snapshots (
+    year TEXT NOT NULL,
+    term TEXT NOT NULL,
+    student_id INTEGER NOT NULL,
+    class_id INTEGER,
+    class_name TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    student_number TEXT,
+    subject_count INTEGER NOT NULL,
+    total_score NUMERIC NOT NULL,
+    average_score NUMERIC NOT NULL,
+    class_position INTEGER NOT NULL,
+    class_size INTEGER NOT NULL,
+    results JSONB NOT NULL,
+    PRIMARY KEY (year, term, student_id),
+    FOREIGN KEY (year, term) REFERENCES public.closed_terms (year, term) ON DELETE CASCADE
+);
+
+-- One row per class and subject: the subject report with class statistics
+CREATE TABLE public.subject_report_snapshots (
+    year TEXT NOT NULL,
+    term TEXT NOT NULL,
+    class_id INTEGER NOT NULL,
+    subject_id INTEGER NOT NULL,
+    class_name TEXT,
+    subject_name TEXT,
+    student_count INTEGER NOT NULL,
+    mean_score NUMERIC,
+    min_score INTEGER,
+    max_score INTEGER,
+    rows JSONB NOT NULL,
+    PRIMARY KEY (year, term, class_id, subject_id),
+    FOREIGN KEY (year, term) REFERENCES public.closed_terms (year, term) ON DELETE CASCADE
+);
+
+-- Backstop for the checks in the app: no writes to a closed term's results
+CREATE FUNCTION public.exam_results_term_lock() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM public.closed_terms ct
+               WHERE (TG_OP <> 'INSERT' AND ct.year = OLD.year AND ct.term = OLD.term)
+                  OR (TG_OP <> 'DELETE' AND ct.year = NEW.year AND ct.term = NEW.term)) THEN
+        RAISE EXCEPTION 'term is closed' USING ERRCODE = 'object_not_in_prerequisite_state';
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER exam_results_term_lock
+    BEFORE INSERT OR UPDATE OR DELETE ON public.exam_results
+    FOR EACH ROW EXECUTE FUNCTION public.exam_results_term_lock();
@@ -0,0 +1,94 @@
+-- Subject performance rollup: one row per (year, term, class, subject) with
+-- counts, score sums and a 0-100 score histogram. Histograms add up, so any
+-- coarser pivot (a whole year, a subject across classes, a teacher) still
+-- gets exact means, quantiles and grade counts by summing rows.
+-- Writes to exam_results (and class moves of students) only mark cells as
+-- dirty; analytics.refresh() recomputes just those cells.
+
+CREATE TABLE public.results_rollup (
+    year TEXT NOT NULL,
+    term TEXT NOT NULL,
+    class_id INTEGER NOT NULL,
+    subject_id INTEGER NOT NULL,
+    result_count INTEGER NOT NULL,
+    score_sum BIGINT NOT NULL,
+    min_score INTEGER,
+    max_score INTEGER,
+    histogram INTEGER[] NOT NULL,
+    grade_counts JSONB NOT NULL,
+    refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (year, term, class_id, subject_id)
+);
+
+CREATE INDEX results_rollup_subject_idx ON public.results_rollup (subject_id, year, term);
+
+CREATE TABLE public.results_rollup_dirty (
+    year TEXT NOT NULL,
+    term TEXT NOT NULL,
+    class_id INTEGER NOT NULL,
+    subject_id INTEGER NOT NULL,
+    PRIMARY KEY (year, term, class_id, subject_id)
+);
+
+CREATE FUNCTION public.exam_results_rollup_dirty() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO public.results_rollup_dirty (year, term, class_id, subject_id)
+        SELECT DISTINCT n.year, n.term, s.class_id, n.subject_id
+        FROM new_rows n JOIN public.students s ON s.student_id = n.student_id
+        WHERE s.class_id IS NOT NULL AND n.subject_id IS NOT NULL AND n.year IS NOT NULL AND n.term IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO public.results_rollup_dirty (year, term, class_id, subject_id)
+        SELECT DISTINCT o.year, o.term, s.class_id, o.subject_id
+        FROM old_rows o JOIN public.students s ON s.student_id = o.student_id
+        WHERE s.class_id IS NOT NULL AND o.subject_id IS NOT NULL AND o.year IS NOT NULL AND o.term IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level, so a bulk regrade marks each cell once
+CREATE TRIGGER exam_results_rollup_insert
+    AFTER INSERT ON public.exam_results REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.exam_results_rollup_dirty();
+CREATE TRIGGER exam_results_rollup_update
+    AFTER UPDATE ON public.exam_results REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.exam_results_rollup_dirty();
+CREATE TRIGGER exam_results_rollup_delete
+    AFTER DELETE ON public.exam_results REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.exam_results_rollup_dirty();
+
+-- A student's results count towards their current class. Deletes are caught
+-- BEFORE the row goes, while its cascaded results can still be found.
+CREATE FUNCTION public.students_rollup_dirty() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO public.results_rollup_dirty (year, term, class_id, subject_id)
+    SELECT DISTINCT er.year, er.term, c.class_id, er.subject_id
+    FROM public.exam_results er
+    CROSS JOIN (SELECT OLD.class_id AS class_id UNION SELECT NEW.class_id) c
+    WHERE er.student_id = OLD.student_id AND c.class_id IS NOT NULL
+      AND er.subject_id IS NOT NULL AND er.year IS NOT NULL AND er.term IS NOT NULL
+    ON CONFLICT DO NOTHING;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER students_rollup_class_change
+    AFTER UPDATE OF class_id ON public.students
+    FOR EACH ROW WHEN (OLD.class_id IS DISTINCT FROM NEW.class_id)
+    EXECUTE FUNCTION public.students_rollup_dirty();
+CREATE TRIGGER students_rollup_delete
+    BEFORE DELETE ON public.students
+    FOR EACH ROW EXECUTE FUNCTION public.students_rollup_dirty();
+
+-- Everything starts dirty; the first refresh builds the whole rollup
+INSERT INTO public.results_rollup_dirty (year, term, class_id, subject_id)
+SELECT DISTINCT er.year, er.term, s.class_id, er.subject_id
+FROM public.exam_results er JOIN public.students s ON s.student_id = er.student_id
+WHERE s.class_id IS NOT NULL AND er.subject_id IS NOT NULL AND er.year IS NOT NULL AND er.term IS NOT NULL;
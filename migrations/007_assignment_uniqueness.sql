@@ -0,0 +1,22 @@
+-- Bulk assignment and curriculum copies insert with ON CONFLICT DO NOTHING,
+-- which needs the pairs to be unique. Earlier duplicates are dropped first,
+-- keeping the oldest row.
+
+DELETE FROM public.teacher_assignments ta
+USING public.teacher_assignments older
+WHERE older.teacher_id = ta.teacher_id AND older.class_id = ta.class_id AND older.subject_id = ta.subject_id
+  AND older.assignment_id < ta.assignment_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS teacher_assignments_pair_key
+    ON public.teacher_assignments (teacher_id, class_id, subject_id);
+
+CREATE INDEX IF NOT EXISTS teacher_assignments_class_subject_idx
+    ON public.teacher_assignments (class_id, subject_id);
+
+DELETE FROM public.curriculum cu
+USING public.curriculum older
+WHERE older.class_id = cu.class_id AND older.subject_id = cu.subject_id
+  AND older.curriculum_id < cu.curriculum_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS curriculum_class_subject_key
+    ON public.curriculum (class_id, subject_id);
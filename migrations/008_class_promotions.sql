@@ -0,0 +1,36 @@
+-- Year-end promotion. class_promotions maps each class to what happens to
+-- its students: move to another class, graduate or leave. A promotion run
+-- applies the mapping with one UPDATE and records every student's previous
+-- class and status in promotion_run_students, so the run can be undone.
+
+ALTER TABLE public.students ADD COLUMN status TEXT NOT NULL DEFAULT 'active'
+    CHECK (status IN ('active', 'graduated', 'left'));
+CREATE INDEX students_status_class_idx ON public.students (status, class_id);
+
+CREATE TABLE public.class_promotions (
+    from_class_id INTEGER PRIMARY KEY REFERENCES public.classes (class_id) ON DELETE CASCADE,
+    outcome TEXT NOT NULL CHECK (outcome IN ('promote', 'graduate', 'leave')),
+    to_class_id INTEGER REFERENCES public.classes (class_id) ON DELETE SET NULL,
+    CHECK (outcome <> 'promote' OR to_class_id IS NOT NULL)
+);
+
+CREATE TABLE public.promotion_runs (
+    run_id SERIAL PRIMARY KEY,
+    year TEXT NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    applied_by INTEGER,
+    student_count INTEGER NOT NULL DEFAULT 0,
+    summary JSONB,
+    rolled_back_at TIMESTAMP,
+    rolled_back_by INTEGER
+);
+
+CREATE TABLE public.promotion_run_students (
+    run_id INTEGER NOT NULL REFERENCES public.promotion_runs (run_id) ON DELETE CASCADE,
+    student_id INTEGER NOT NULL REFERENCES public.students (student_id) ON DELETE CASCADE,
+    from_class_id INTEGER,
+    from_status TEXT NOT NULL,
+    to_class_id INTEGER,
+    to_status TEXT NOT NULL,
+    PRIMARY KEY (run_id, student_id)
+);
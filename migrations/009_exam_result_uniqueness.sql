@@ -0,0 +1,17 @@
+-- Exam results are entered with INSERT ... ON CONFLICT DO NOTHING, which
+-- needs one result per student, subject and term to be enforced. Earlier
+-- duplicates (from concurrent entry) are dropped first, keeping the oldest
+-- row; the term lock is lifted for the cleanup so closed terms are included.
+
+ALTER TABLE public.exam_results DISABLE TRIGGER exam_results_term_lock;
+
+DELETE FROM public.exam_results er
+USING public.exam_results older
+WHERE older.student_id = er.student_id AND older.subject_id = er.subject_id
+  AND older.term = er.term AND older.year = er.year
+  AND older.result_id < er.result_id;
+
+ALTER TABLE public.exam_results ENABLE TRIGGER exam_results_term_lock;
+
+CREATE UNIQUE INDEX IF NOT EXISTS exam_results_student_subject_term_key
+    ON public.exam_results (student_id, subject_id, term, year);
@@ -0,0 +1,6 @@
+-- Student profiles page through a student's fee payments newest first,
+-- after (payment_date, payment_id). Results are paged by (year, term) on
+-- exam_results_student_id_idx, added in 003.
+
+CREATE INDEX IF NOT EXISTS fee_payments_student_date_idx
+    ON public.fee_payments (student_id, payment_date DESC, payment_id DESC);
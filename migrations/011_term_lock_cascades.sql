@@ -0,0 +1,22 @@
+-- exam_results_term_lock (005) also fired on the results removed by a
+-- student delete (ON DELETE CASCADE), so a student with results in a
+-- closed term could not be deleted. Deletes issued from another trigger,
+-- which is how cascades run, now pass; the closed term keeps its
+-- report-card snapshot. Direct writes are checked as before.
+
+CREATE OR REPLACE FUNCTION public.exam_results_term_lock() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' AND pg_trigger_depth() > 1 THEN
+        RETURN OLD;
+    END IF;
+    IF EXISTS (SELECT 1 FROM public.closed_terms ct
+               WHERE (TG_OP <> 'INSERT' AND ct.year = OLD.year AND ct.term = OLD.term)
+                  OR (TG_OP <> 'DELETE' AND ct.year = NEW.year AND ct.term = NEW.term)) THEN
+        RAISE EXCEPTION 'term is closed' USING ERRCODE = 'object_not_in_prerequisite_state';
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,60 @@
+-- results_rollup (006) filed every result under the student's current
+-- class, so a year-end promotion moved all past years' marks to the new
+-- class and graduates' and leavers' results (no class) dropped out.
+-- exam_results now records the class the student was in when the result
+-- was entered, and the rollup is keyed on that.
+--
+-- Existing results take the class from their term's report-card snapshot,
+-- else the class the student left in that year's promotion run, else the
+-- student's current class.
+
+ALTER TABLE public.exam_results ADD COLUMN class_id INTEGER REFERENCES public.classes (class_id) ON DELETE SET NULL;
+
+ALTER TABLE public.exam_results DISABLE TRIGGER exam_results_term_lock;
+ALTER TABLE public.exam_results DISABLE TRIGGER exam_results_rollup_update;
+
+UPDATE public.exam_results er SET class_id = COALESCE(
+    (SELECT rc.class_id FROM public.report_card_snapshots rc
+     WHERE rc.year = er.year AND rc.term = er.term AND rc.student_id = er.student_id),
+    (SELECT ps.from_class_id FROM public.promotion_run_students ps
+     JOIN public.promotion_runs pr ON pr.run_id = ps.run_id
+     WHERE ps.student_id = er.student_id AND pr.year = er.year AND pr.rolled_back_at IS NULL
+     ORDER BY pr.applied_at DESC LIMIT 1),
+    (SELECT s.class_id FROM public.students s WHERE s.student_id = er.student_id)
+);
+
+ALTER TABLE public.exam_results ENABLE TRIGGER exam_results_rollup_update;
+ALTER TABLE public.exam_results ENABLE TRIGGER exam_results_term_lock;
+
+CREATE OR REPLACE FUNCTION public.exam_results_rollup_dirty() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO public.results_rollup_dirty (year, term, class_id, subject_id)
+        SELECT DISTINCT n.year, n.term, n.class_id, n.subject_id
+        FROM new_rows n
+        WHERE n.class_id IS NOT NULL AND n.subject_id IS NOT NULL AND n.year IS NOT NULL AND n.term IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO public.results_rollup_dirty (year, term, class_id, subject_id)
+        SELECT DISTINCT o.year, o.term, o.class_id, o.subject_id
+        FROM old_rows o
+        WHERE o.class_id IS NOT NULL AND o.subject_id IS NOT NULL AND o.year IS NOT NULL AND o.term IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Class moves no longer touch the rollup; a deleted student's results are
+-- caught by exam_results_rollup_delete as they cascade
+DROP TRIGGER students_rollup_class_change ON public.students;
+DROP TRIGGER students_rollup_delete ON public.students;
+DROP FUNCTION public.students_rollup_dirty();
+
+-- Rebuilt from scratch on the next refresh
+DELETE FROM public.results_rollup;
+DELETE FROM public.results_rollup_dirty;
+INSERT INTO public.results_rollup_dirty (year, term, class_id, subject_id)
+SELECT DISTINCT year, term, class_id, subject_id FROM public.exam_results
+WHERE class_id IS NOT NULL AND subject_id IS NOT NULL AND year IS NOT NULL AND term IS NOT NULL;
@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from werkzeug.security import check_password_hash, generate_password_hash
+from config import Config
+import metrics
+
+# Hashing runs on a small dedicated pool so a burst of logins queues for a
+# bounded number of hashing threads instead of every worker burning CPU at
+# once. hashlib releases the GIL while hashing, so the pool threads run in
+# parallel with request threads.
+_executor = ThreadPoolExecutor(max_workers=Config.PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+_pending = threading.BoundedSemaphore(Config.PASSWORD_HASH_MAX_PENDING)
+
+_method = None
+_method_lock = threading.Lock()
+
+
+class PasswordServiceBusy(Exception):
+    """Raised when too many hash jobs are already queued."""
+
+
+def _calibrate_scrypt_n(target_ms, min_n, max_n):
+    # scrypt time grows linearly with N: time a small N and scale it up to
+    # the largest power of two that stays within the target.
+    sample_n = 4096
+    started = time.perf_counter()
+    generate_password_hash('calibration', method=f'scrypt:{sample_n}:8:1')
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    n = sample_n
+    while n * 2 <= max_n and elapsed_ms * (n * 2 // sample_n) <= target_ms:
+        n *= 2
+    return max(min_n, n)
+
+
+def current_method():
+    """
+    Werkzeug method string used for new hashes. PASSWORD_HASH_METHOD wins if
+    set; otherwise scrypt's N is calibrated once per process so a hash costs
+    about PASSWORD_HASH_TARGET_MS on this machine.
+    """
+    global _method
+    if _method is None:
+        with _method_lock:
+            if _method is None:
+                if Config.PASSWORD_HASH_METHOD:
+                    _method = Config.PASSWORD_HASH_METHOD
+                else:
+                    n = _calibrate_scrypt_n(Config.PASSWORD_HASH_TARGET_MS, Config.PASSWORD_HASH_MIN_COST, Config.PASSWORD_HASH_MAX_COST)
+                    _method = f'scrypt:{n}:8:1'
+    return _method
+
+
+def _run(op, fn, *args):
+    # The slot is held until the hash job itself finishes, so requests that
+    # time out waiting cannot push more work than the bound onto the pool.
+    if not _pending.acquire(blocking=False):
+        metrics.inc('password_hash_rejected', op=op)
+        raise PasswordServiceBusy()
+    queued = time.perf_counter()
+
+    def _timed():
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            metrics.observe('password_hash_seconds', time.perf_counter() - started, op=op)
+            _pending.release()
+
+    try:
+        future = _executor.submit(_timed)
+    except RuntimeError:
+        _pending.release()
+        raise
+    try:
+        return future.result(timeout=Config.PASSWORD_HASH_TIMEOUT)
+    except FuturesTimeout:
+        metrics.inc('password_hash_rejected', op=op)
+        raise PasswordServiceBusy()
+    finally:
+        metrics.observe('password_hash_wait_seconds', time.perf_counter() - queued, op=op)
+
+
+def hash_password(password):
+    return _run('hash', generate_password_hash, password, current_method())
+
+
+def verify_password(pwhash, password):
+    return _run('verify', check_password_hash, pwhash, password)
+
+
+def _cost(method):
+    """Splits a Werkzeug method string into (family, work factor)."""
+    parts = method.split(':')
+    if parts[0] == 'scrypt':
+        return 'scrypt', int(parts[1]) if len(parts) > 1 else 0
+    if parts[0] == 'pbkdf2':
+        digest = parts[1] if len(parts) > 1 else 'sha256'
+        return f'pbkdf2:{digest}', int(parts[2]) if len(parts) > 2 else 0
+    return method, 0
+
+
+def needs_rehash(pwhash):
+    """
+    True if the stored hash uses another algorithm or a noticeably lower cost
+    than current_method(). Hashes are only ever upgraded, never downgraded.
+    """
+    stored = pwhash.split('$', 1)[0]
+    current = current_method()
+    if stored == current:
+        return False
+    stored_family, stored_cost = _cost(stored)
+    current_family, current_cost = _cost(current)
+    if stored_family != current_family:
+        return True
+    return stored_cost < current_cost * 0.8
+
+
+class LoginThrottle:
+    """
+    In-memory token buckets keyed by email and by client IP. Every failed login
+    spends a token from both buckets; tokens refill at a steady rate. A login
+    is refused before any hashing happens when either bucket is empty.
+
+    At max_keys, full buckets are dropped first and then the least recently
+    spent ones, so a flood of new keys cannot reset a bucket under attack.
+    """
+
+    def __init__(self, capacity, refill_per_second, max_keys=10000):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.refill_per_second)
+
+    def allow(self, *keys):
+        now = time.monotonic()
+        with self._lock:
+            return all(self._tokens(key, now) >= 1 for key in keys if key)
+
+    def record_failure(self, *keys):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._buckets) >= self.max_keys:
+                self._prune(now)
+            for key in keys:
+                if key:
+                    self._buckets[key] = (max(0.0, self._tokens(key, now) - 1), now)
+                    self._buckets.move_to_end(key)
+
+    def _prune(self, now):
+        full = [key for key in self._buckets if self._tokens(key, now) >= self.capacity]
+        for key in full:
+            del self._buckets[key]
+        # Down to 90% so a flood of new keys does not rescan on every failure
+        while len(self._buckets) > self.max_keys * 9 // 10:
+            self._buckets.popitem(last=False)
+
+
+login_throttle = LoginThrottle(Config.LOGIN_FAILURE_BURST, Config.LOGIN_FAILURE_BURST / Config.LOGIN_FAILURE_WINDOW)
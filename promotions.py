@@ -0,0 +1,169 @@
+import re
+
+# Year-end promotion (migration 008). class_promotions says where each
+# class's active students go; apply() moves them all with one UPDATE and
+# keeps their previous class and status per run, which rollback() restores.
+# Graduates and leavers keep no class.
+
+OUTCOMES = ('promote', 'graduate', 'leave')
+_OUTCOME_STATUS = "CASE m.outcome WHEN 'promote' THEN 'active' WHEN 'graduate' THEN 'graduated' ELSE 'left' END"
+
+
+class PromotionError(Exception):
+    pass
+
+
+def load_mapping(cursor):
+    """Every class with its promotion rule (outcome None where none is set), as dicts."""
+    cursor.execute("""
+        SELECT c.class_id, c.class_name, m.outcome, m.to_class_id,
+               (SELECT COUNT(*) FROM public.students s WHERE s.class_id = c.class_id AND s.status = 'active') AS student_count
+        FROM public.classes c
+        LEFT JOIN public.class_promotions m ON m.from_class_id = c.class_id
+        ORDER BY c.class_name
+    """)
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def save_mapping(cursor, rules):
+    """
+    rules: {from_class_id: (outcome, to_class_id)}. An outcome of None
+    removes the class's rule. Does not commit.
+    """
+    for outcome, to_class_id in rules.values():
+        if outcome is not None and outcome not in OUTCOMES:
+            raise PromotionError(f"Unknown outcome '{outcome}'.")
+        if outcome == 'promote' and not to_class_id:
+            raise PromotionError("Choose the class students are promoted to.")
+    keep = [(class_id, outcome, to_class_id if outcome == 'promote' else None)
+            for class_id, (outcome, to_class_id) in rules.items() if outcome]
+    drop = [class_id for class_id, (outcome, _) in rules.items() if not outcome]
+    if drop:
+        cursor.execute("DELETE FROM public.class_promotions WHERE from_class_id = ANY(%s)", (drop,))
+    if keep:
+        cursor.execute("""
+            INSERT INTO public.class_promotions (from_class_id, outcome, to_class_id)
+            SELECT * FROM unnest(%s::int[], %s::text[], %s::int[])
+            ON CONFLICT (from_class_id) DO UPDATE SET outcome = EXCLUDED.outcome, to_class_id = EXCLUDED.to_class_id
+        """, ([k[0] for k in keep], [k[1] for k in keep], [k[2] for k in keep]))
+
+
+def parse_student_numbers(text):
+    return sorted({number for number in re.split(r'[\s,;]+', text or '') if number})
+
+
+def resolve_repeaters(cursor, student_numbers):
+    """Student ids for the numbers given, and the numbers that matched nobody."""
+    if not student_numbers:
+        return [], []
+    cursor.execute("SELECT student_id, student_number FROM public.students WHERE student_number = ANY(%s)", (student_numbers,))
+    rows = cursor.fetchall()
+    found = {row[1] for row in rows}
+    return [row[0] for row in rows], [number for number in student_numbers if number not in found]
+
+
+def preview(cursor, repeater_ids):
+    """Per source class: how many active students move, and how many repeat."""
+    cursor.execute("""
+        SELECT c.class_id, c.class_name, m.outcome, m.to_class_id, tc.class_name AS to_class_name,
+               COUNT(s.student_id) FILTER (WHERE NOT s.student_id = ANY(%(repeaters)s)) AS moving,
+               COUNT(s.student_id) FILTER (WHERE s.student_id = ANY(%(repeaters)s)) AS repeating
+        FROM public.class_promotions m
+        JOIN public.classes c ON c.class_id = m.from_class_id
+        LEFT JOIN public.classes tc ON tc.class_id = m.to_class_id
+        LEFT JOIN public.students s ON s.class_id = m.from_class_id AND s.status = 'active'
+        GROUP BY c.class_id, c.class_name, m.outcome, m.to_class_id, tc.class_name
+        ORDER BY c.class_name
+    """, {'repeaters': list(repeater_ids)})
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def apply(conn, year, repeater_ids, user_id=None):
+    """
+    Promotes every active student whose class has a rule, except the
+    repeaters, in one transaction. Returns (run_id, moved student ids).
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT INTO public.promotion_runs (year, applied_by) VALUES (%s, %s) RETURNING run_id", (year, user_id))
+        run_id = cursor.fetchone()[0]
+        # The FROM copy of students is the pre-update row, so RETURNING can
+        # report old and new values; chained rules (1->2, 2->3) move each
+        # student exactly once.
+        cursor.execute(f"""
+            WITH moved AS (
+                UPDATE public.students s
+                SET class_id = CASE WHEN m.outcome = 'promote' THEN m.to_class_id END,
+                    status = {_OUTCOME_STATUS}
+                FROM public.class_promotions m, public.students old
+                WHERE old.student_id = s.student_id AND m.from_class_id = old.class_id
+                  AND old.status = 'active' AND NOT old.student_id = ANY(%(repeaters)s)
+                RETURNING s.student_id, old.class_id AS from_class_id, old.status AS from_status,
+                          s.class_id AS to_class_id, s.status AS to_status
+            )
+            INSERT INTO public.promotion_run_students (run_id, student_id, from_class_id, from_status, to_class_id, to_status)
+            SELECT %(run_id)s, student_id, from_class_id, from_status, to_class_id, to_status FROM moved
+            RETURNING student_id
+        """, {'run_id': run_id, 'repeaters': list(repeater_ids)})
+        moved = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""
+            UPDATE public.promotion_runs r
+            SET student_count = %(count)s,
+                summary = (SELECT COALESCE(jsonb_object_agg(k.transition, k.n), '{}') FROM (
+                    SELECT COALESCE(p.from_class_id::text, '-') || '->' || COALESCE(p.to_class_id::text, p.to_status) AS transition,
+                           COUNT(*) AS n
+                    FROM public.promotion_run_students p WHERE p.run_id = r.run_id
+                    GROUP BY 1) k)
+            WHERE r.run_id = %(run_id)s
+        """, {'run_id': run_id, 'count': len(moved)})
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return run_id, moved
+
+
+def rollback(conn, run_id, user_id=None):
+    """
+    Restores the classes and statuses a run changed. Only the latest run
+    that is still in effect can be rolled back, and students edited since
+    the run are left alone. Returns (restored ids, skipped count).
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(run_id) FROM public.promotion_runs WHERE rolled_back_at IS NULL")
+        latest = cursor.fetchone()[0]
+        if latest != run_id:
+            raise PromotionError("Only the most recent promotion that has not been rolled back can be undone.")
+        cursor.execute("""
+            UPDATE public.students s
+            SET class_id = p.from_class_id, status = p.from_status
+            FROM public.promotion_run_students p
+            WHERE p.run_id = %s AND p.student_id = s.student_id
+              AND s.class_id IS NOT DISTINCT FROM p.to_class_id AND s.status = p.to_status
+            RETURNING s.student_id
+        """, (run_id,))
+        restored = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""
+            UPDATE public.promotion_runs SET rolled_back_at = CURRENT_TIMESTAMP, rolled_back_by = %s
+            WHERE run_id = %s RETURNING student_count
+        """, (user_id, run_id))
+        student_count = cursor.fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return restored, student_count - len(restored)
+
+
+def recent_runs(cursor, limit=10):
+    cursor.execute("""
+        SELECT r.run_id, r.year, r.applied_at, r.student_count, r.rolled_back_at, u.full_name AS applied_by_name
+        FROM public.promotion_runs r LEFT JOIN public.users u ON u.user_id = r.applied_by
+        ORDER BY r.run_id DESC LIMIT %s
+    """, (limit,))
+    return [dict(row) for row in cursor.fetchall()]
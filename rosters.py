@@ -0,0 +1,61 @@
+from collections import namedtuple
+from config import Config
+from cache import LRUCache, current_generation
+from db import prepared_statement, execute_prepared
+
+# Class rosters (the students of a class, by name) back the class pickers
+# on the results pages. Each worker caches them per class as tuples of
+# RosterEntry, bounded by class count and by total students, and student
+# writes invalidate the classes they touch.
+
+RosterEntry = namedtuple('RosterEntry', 'student_id first_name last_name student_number')
+
+roster_cache = LRUCache('rosters', max_entries=Config.ROSTER_CACHE_MAX_ENTRIES, ttl=Config.ROSTER_CACHE_TTL,
+                        max_weight=Config.ROSTER_CACHE_MAX_STUDENTS, weigh=len)
+
+_ROSTERS = prepared_statement('class_rosters', """
+    SELECT class_id, student_id, first_name, last_name, student_number FROM public.students
+    WHERE class_id = ANY(%s) ORDER BY class_id, last_name, first_name
+""")
+
+
+def _namespace(class_id):
+    return f'roster:{class_id}'
+
+
+def get_rosters(cursor, class_ids):
+    """{class_id: roster tuple} for class_ids; uncached rosters are loaded together."""
+    rosters = {}
+    missing = []
+    for class_id in set(class_ids):
+        roster = roster_cache.get(_namespace(class_id), class_id)
+        if roster is None:
+            missing.append(class_id)
+        else:
+            rosters[class_id] = roster
+    if missing:
+        generations = {class_id: current_generation(_namespace(class_id)) for class_id in missing}
+        loaded = {class_id: [] for class_id in missing}
+        execute_prepared(cursor, _ROSTERS, (missing,))
+        for row in cursor.fetchall():
+            loaded[row[0]].append(RosterEntry(*row[1:]))
+        for class_id, entries in loaded.items():
+            rosters[class_id] = tuple(entries)
+            roster_cache.set(_namespace(class_id), class_id, rosters[class_id], generation=generations[class_id])
+    return rosters
+
+
+def get_roster(cursor, class_id):
+    return get_rosters(cursor, [class_id])[class_id]
+
+
+def invalidate_roster(*class_ids):
+    for class_id in set(class_ids):
+        if class_id is not None:
+            roster_cache.invalidate(_namespace(int(class_id)))
+
+
+def invalidate_all_rosters(cursor):
+    """For bulk moves such as promotions, which can touch every class."""
+    cursor.execute("SELECT class_id FROM public.classes")
+    invalidate_roster(*(row[0] for row in cursor.fetchall()))
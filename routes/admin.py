@@ -1,28 +1,127 @@
 from flask import Blueprint, render_template, session, redirect, url_for, flash, request, jsonify
-from db import get_db_connection
-from utils import role_required, log_activity
+from db import get_db_connection, get_read_connection, prepared_statement, execute_prepared
+import db_async
+from utils import role_required, replica_safe, time_budget, log_activity, changed_fields
+from template_cache import invalidate_fragment
+from streaming import server_cursor, json_list_response
+import log_partitions
+import transcripts
+from lookups import resolve_class_id
+from datetime import datetime
 import psycopg2
 import psycopg2.extras
 
 
 admin_bp = Blueprint('admin', __name__)
 
+# Payments are recorded all day during fee collection; the student is looked up by number in the INSERT
+_RECORD_PAYMENT = prepared_statement('record_payment', """
+    INSERT INTO public.fee_payments (student_id, amount_paid, payment_date, term, academic_year)
+    SELECT s.student_id, %s::numeric, %s::date, %s, %s FROM public.students s WHERE s.student_number = %s
+    RETURNING payment_id, student_id,
+              (SELECT concat_ws(' ', first_name, last_name) FROM public.students WHERE student_id = fee_payments.student_id) AS student_name
+""")
+
 # --- View Logs ---
+LOG_PAGE_SIZE = 200
+
 @admin_bp.route('/logs')
 @role_required('system_admin')
+@replica_safe
+@time_budget(10)
 def view_logs():
-    conn = get_db_connection()
+    # ?month=YYYY-MM shows one month, read from its archive file once the
+    # month has been moved out of the database. Either way a page holds the
+    # newest LOG_PAGE_SIZE entries, then older pages after ?before=&before_id=.
+    selected_month = request.args.get('month', '')
+    month = log_partitions.parse_month(selected_month)
+    archived = log_partitions.archived_months()
+    if month is None:
+        selected_month = ''
+    try:
+        before = (datetime.fromisoformat(request.args.get('before', '')), int(request.args.get('before_id', '')))
+    except ValueError:
+        before = None
+    logs = None
+    if month and selected_month in archived:
+        logs = log_partitions.read_archive(month, before, LOG_PAGE_SIZE)
+    if logs is None:
+        conn = get_read_connection()
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        query = "SELECT log_id, user_full_name, action, timestamp FROM public.activity_logs"
+        filters = []
+        params = []
+        if month:
+            filters.append("timestamp >= %s AND timestamp < %s")
+            params += [month, log_partitions.add_months(month, 1)]
+        if before:
+            filters.append("(timestamp, log_id) < (%s, %s)")
+            params += before
+        if filters:
+            query += " WHERE " + " AND ".join(filters)
+        cursor.execute(query + " ORDER BY timestamp DESC, log_id DESC LIMIT %s", (*params, LOG_PAGE_SIZE))
+        logs = cursor.fetchall()
+        cursor.close()
+    older_url = None
+    if len(logs) == LOG_PAGE_SIZE:
+        older_url = url_for('admin.view_logs', month=selected_month or None,
+                            before=logs[-1]['timestamp'].isoformat(), before_id=logs[-1]['log_id'])
+    return render_template('view_logs.html', logs=logs, selected_month=selected_month, archived_months=archived, older_url=older_url)
+
+# --- Audit History ---
+AUDIT_PAGE_SIZE = 50
+
+@admin_bp.route('/audit/<entity_type>/<int:entity_id>')
+@role_required('system_admin')
+@replica_safe
+def entity_history(entity_type, entity_id):
+    # Newest first; the response's next_before/next_before_id fetch the next page.
+    # Served by activity_logs_entity_idx, so cost depends on the page size, not the table size.
+    before = request.args.get('before')
+    before_id = request.args.get('before_id', type=int)
+    limit = min(request.args.get('limit', AUDIT_PAGE_SIZE, type=int), 500)
+    query = "SELECT log_id, timestamp, event_type, user_id, user_full_name, action, payload FROM public.activity_logs WHERE entity_type = %s AND entity_id = %s"
+    params = [entity_type, entity_id]
+    if before:
+        try:
+            params.append(datetime.fromisoformat(before))
+        except ValueError:
+            return jsonify({'error': "Invalid 'before' timestamp."}), 400
+        if before_id is not None:
+            params.append(before_id)
+            query += " AND (timestamp, log_id) < (%s, %s)"
+        else:
+            query += " AND timestamp < %s"
+    query += " ORDER BY timestamp DESC, log_id DESC LIMIT %s"
+    params.append(limit)
+    conn = get_read_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT user_full_name, action, timestamp FROM public.activity_logs ORDER BY timestamp DESC")
-    logs = cursor.fetchall()
+    cursor.execute(query, tuple(params))
+    events = []
+    for row in cursor.fetchall():
+        event = dict(row)
+        event['timestamp'] = event['timestamp'].isoformat()
+        events.append(event)
     cursor.close()
-    return render_template('view_logs.html', logs=logs)
+    more = len(events) == limit
+    return jsonify({
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'events': events,
+        'next_before': events[-1]['timestamp'] if more else None,
+        'next_before_id': events[-1]['log_id'] if more else None,
+    })
 
 # --- Fee Payment Functions ---
-def _get_filtered_fee_payments(selected_year, selected_term, selected_class):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    query = "SELECT fp.payment_id, s.student_number, s.first_name, s.middle_name, s.last_name, fp.amount_paid, fp.payment_date, fp.term, fp.academic_year, s.class_name FROM public.fee_payments fp JOIN public.students s ON fp.student_id = s.student_id"
+def _filtered_fee_payments_cursor(selected_year, selected_term, selected_class):
+    conn = get_read_connection()
+    query = """
+        SELECT fp.payment_id, s.student_number, s.first_name, s.middle_name, s.last_name,
+               concat_ws(' ', s.first_name, NULLIF(s.middle_name, ''), s.last_name) AS full_name,
+               fp.amount_paid, to_char(fp.payment_date, 'YYYY-MM-DD') AS payment_date, fp.term, fp.academic_year, c.class_name
+        FROM public.fee_payments fp JOIN public.students s ON fp.student_id = s.student_id
+        LEFT JOIN public.classes c ON c.class_id = s.class_id
+    """
     filters = []
     params = []
     if selected_year:
@@ -32,15 +131,16 @@ def _get_filtered_fee_payments(selected_year, selected_term, selected_class):
         filters.append("fp.term = %s")
         params.append(selected_term)
     if selected_class:
-        filters.append("s.class_name = %s")
-        params.append(selected_class)
+        lookup = conn.cursor()
+        filters.append("s.class_id = %s")
+        params.append(resolve_class_id(lookup, class_name=selected_class))
+        lookup.close()
     if filters:
         query += " WHERE " + " AND ".join(filters)
     query += " ORDER BY fp.payment_date DESC"
+    cursor = server_cursor(conn)
     cursor.execute(query, tuple(params))
-    results = cursor.fetchall()
-    cursor.close()
-    return results
+    return cursor
 
 @admin_bp.route('/fee_payment_form')
 @role_required('accounts')
@@ -65,49 +165,45 @@ def submit_fee():
         return redirect(url_for('admin.fee_payment_form'))
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT student_id, first_name, last_name FROM public.students WHERE student_number = %s", (student_number,))
-    student = cursor.fetchone()
-    if not student:
-        flash("Student number not found.", "error")
-        cursor.close()
-        return redirect(url_for('admin.fee_payment_form'))
-    student_id = student['student_id']
-    student_name = f"{student['first_name']} {student.get('last_name', '')}".strip()
-    cursor.execute("INSERT INTO public.fee_payments (student_id, amount_paid, payment_date, term, academic_year) VALUES (%s, %s, %s, %s, %s)", (student_id, amount_paid, payment_date, term, academic_year))
+    execute_prepared(cursor, _RECORD_PAYMENT, (amount_paid, payment_date, term, academic_year, student_number))
+    payment = cursor.fetchone()
     conn.commit()
     cursor.close()
-    log_activity(f"Recorded fee payment of {amount_paid} for student '{student_name}' ({student_number}).")
+    if not payment:
+        flash("Student number not found.", "error")
+        return redirect(url_for('admin.fee_payment_form'))
+    payment_id, student_id, student_name = payment['payment_id'], payment['student_id'], payment['student_name']
+    invalidate_fragment('dashboard_stats')
+    transcripts.invalidate_transcript(student_id)
+    log_activity(f"Recorded fee payment of {amount_paid} for student '{student_name}' ({student_number}).",
+                 event_type='fee_payment.created', entity_type='student', entity_id=student_id,
+                 payload={'payment_id': payment_id, 'amount_paid': amount_paid, 'payment_date': payment_date, 'term': term, 'academic_year': academic_year})
     flash("Fee payment recorded successfully.", "success")
     return redirect(url_for('admin.fee_payment_form'))
 
 @admin_bp.route('/view_fee_payments')
 @role_required('system_admin', 'school_admin', 'accounts')
+@replica_safe
 def view_fee_payments():
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT DISTINCT academic_year FROM public.fee_payments ORDER BY academic_year DESC")
-    academic_years = [row['academic_year'] for row in cursor.fetchall()]
-    cursor.execute("SELECT DISTINCT term FROM public.fee_payments ORDER BY term")
-    terms = [row['term'] for row in cursor.fetchall()]
-    cursor.execute("SELECT DISTINCT class_name FROM public.classes ORDER BY class_name")
-    classes = [row['class_name'] for row in cursor.fetchall()]
-    cursor.close()
+    year_rows, term_rows, class_rows = db_async.gather(
+        ("SELECT DISTINCT academic_year FROM public.fee_payments ORDER BY academic_year DESC", None),
+        ("SELECT DISTINCT term FROM public.fee_payments ORDER BY term", None),
+        ("SELECT DISTINCT class_name FROM public.classes ORDER BY class_name", None),
+    )
+    academic_years = [row['academic_year'] for row in year_rows]
+    terms = [row['term'] for row in term_rows]
+    classes = [row['class_name'] for row in class_rows]
     return render_template('view_fee_payments.html', academic_years=academic_years, terms=terms, classes=classes)
 
 @admin_bp.route('/filter_fee_payments', methods=['POST'])
 @role_required('system_admin', 'school_admin', 'accounts')
+@replica_safe
+@time_budget(10)
 def filter_fee_payments():
     selected_year = request.form.get('academic_year')
     selected_term = request.form.get('term')
     selected_class = request.form.get('class_name')
-    results = _get_filtered_fee_payments(selected_year, selected_term, selected_class)
-    payments = []
-    for r in results:
-        r_dict = dict(r)
-        r_dict["full_name"] = f"{r_dict['first_name']} {r_dict.get('middle_name') or ''} {r_dict['last_name']}".replace('  ', ' ')
-        r_dict["payment_date"] = r_dict["payment_date"].strftime("%Y-%m-%d")
-        payments.append(r_dict)
-    return jsonify({"payments": payments})
+    return json_list_response(_filtered_fee_payments_cursor(selected_year, selected_term, selected_class), 'payments')
 
 @admin_bp.route('/edit_fee/<int:payment_id>', methods=['GET', 'POST'])
 @role_required('accounts')
@@ -129,10 +225,24 @@ def edit_fee(payment_id):
             flash("Invalid amount entered.", "error")
             cursor.close()
             return redirect(url_for('admin.edit_fee', payment_id=payment_id))
-        cursor.execute("UPDATE public.fee_payments SET amount_paid = %s, payment_date = %s, term = %s, academic_year = %s WHERE payment_id = %s", (amount_paid, payment_date, term, academic_year, payment_id))
+        # The FROM copy is the pre-update row, so RETURNING gives the old values for the audit diff
+        cursor.execute("""
+            UPDATE public.fee_payments fp SET amount_paid = %s, payment_date = %s, term = %s, academic_year = %s
+            FROM public.fee_payments old WHERE fp.payment_id = %s AND old.payment_id = fp.payment_id
+            RETURNING old.*
+        """, (amount_paid, payment_date, term, academic_year, payment_id))
+        old_payment = cursor.fetchone()
         conn.commit()
         cursor.close()
-        log_activity(f"Edited fee payment record (ID: {payment_id}).")
+        if not old_payment:
+            flash("Fee payment record not found.", "error")
+            return redirect(url_for('admin.view_fee_payments'))
+        invalidate_fragment('dashboard_stats')
+        transcripts.invalidate_transcript(old_payment['student_id'])
+        changes = changed_fields(old_payment, {'amount_paid': amount_paid, 'payment_date': payment_date, 'term': term, 'academic_year': academic_year})
+        log_activity(f"Edited fee payment record (ID: {payment_id}).",
+                     event_type='fee_payment.updated', entity_type='student', entity_id=old_payment['student_id'],
+                     payload=dict(changes, payment_id=payment_id))
         flash("Fee payment updated successfully.", "success")
         return redirect(url_for('admin.view_fee_payments'))
     
@@ -153,17 +263,24 @@ def edit_fee(payment_id):
 def delete_fee(payment_id):
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT s.student_number FROM public.fee_payments fp JOIN public.students s ON fp.student_id = s.student_id WHERE payment_id = %s", (payment_id,))
+    cursor.execute("""
+        DELETE FROM public.fee_payments fp USING public.students s
+        WHERE fp.payment_id = %s AND s.student_id = fp.student_id
+        RETURNING s.student_number, fp.*
+    """, (payment_id,))
     payment_to_delete = cursor.fetchone()
+    conn.commit()
+    cursor.close()
     if not payment_to_delete:
         flash("Payment record not found.", "error")
-        cursor.close()
         return redirect(url_for('admin.view_fee_payments'))
-    cursor.execute("DELETE FROM public.fee_payments WHERE payment_id = %s", (payment_id,))
-    conn.commit()
-    cursor.close()
+    invalidate_fragment('dashboard_stats')
+    transcripts.invalidate_transcript(payment_to_delete['student_id'])
     student_number = payment_to_delete['student_number']
-    log_activity(f"Deleted fee payment record (ID: {payment_id}) for student {student_number}.")
+    log_activity(f"Deleted fee payment record (ID: {payment_id}) for student {student_number}.",
+                 event_type='fee_payment.deleted', entity_type='student', entity_id=payment_to_delete['student_id'],
+                 payload={'payment_id': payment_id, 'amount_paid': payment_to_delete['amount_paid'],
+                          'term': payment_to_delete['term'], 'academic_year': payment_to_delete['academic_year']})
     flash("Fee payment deleted successfully.", "success")
     return redirect(url_for('admin.view_fee_payments'))
 
@@ -171,70 +288,69 @@ def delete_fee(payment_id):
 def unauthorized():
     return render_template('unauthorized.html'), 403
 
+# Dashboard panels are cached fragments (see template_cache); the loaders
+# below only run when a panel has to be re-rendered. Each one is a single
+# query returning the whole panel, counters and chart series together, as
+# one JSON object, which the template also embeds for its charts.
+_SYSTEM_ADMIN_STATS = """
+    WITH roles AS (
+        SELECT role, COUNT(*) AS user_count FROM public.users GROUP BY role
+    ), class_sizes AS (
+        SELECT c.class_name, COUNT(s.student_id) AS student_count
+        FROM public.students s JOIN public.classes c ON c.class_id = s.class_id
+        GROUP BY c.class_id, c.class_name
+    )
+    SELECT json_build_object(
+        'total_students', (SELECT COUNT(*) FROM public.students WHERE status = 'active'),
+        'total_teachers', COALESCE((SELECT user_count FROM roles WHERE role = 'teacher'), 0),
+        'total_classes', (SELECT COUNT(DISTINCT class_name) FROM public.classes),
+        'total_users', COALESCE((SELECT SUM(user_count) FROM roles), 0),
+        'recent_activities', (SELECT COALESCE(json_agg(r), '[]') FROM (
+            SELECT full_name AS user, 'User Created' AS action, role AS timestamp
+            FROM public.users ORDER BY user_id DESC LIMIT 5) r),
+        'students_per_class', (SELECT json_build_object(
+            'labels', COALESCE(json_agg(class_name ORDER BY class_name), '[]'),
+            'values', COALESCE(json_agg(student_count ORDER BY class_name), '[]')) FROM class_sizes),
+        'users_by_role', (SELECT json_build_object(
+            'labels', COALESCE(json_agg(initcap(replace(role, '_', ' ')) ORDER BY role), '[]'),
+            'values', COALESCE(json_agg(user_count ORDER BY role), '[]')) FROM roles)
+    )
+"""
+
+_ACCOUNTS_STATS = """
+    SELECT json_build_object('payment_count', COUNT(payment_id), 'total_collected', COALESCE(SUM(amount_paid), 0))
+    FROM public.fee_payments
+"""
+
+_SCHOOL_ADMIN_STATS = """
+    SELECT json_build_object(
+        'total_students', (SELECT COUNT(*) FROM public.students WHERE status = 'active'),
+        'total_teachers', (SELECT COUNT(*) FROM public.users WHERE role = 'teacher'),
+        'total_classes', (SELECT COUNT(DISTINCT class_name) FROM public.classes)
+    )
+"""
+
+def _load_dashboard_stats(query, params=None):
+    cursor = get_read_connection().cursor()
+    cursor.execute(query, params)
+    stats = cursor.fetchone()[0]
+    cursor.close()
+    return stats
+
 @admin_bp.route('/system_admin_dashboard')
 @role_required('system_admin')
+@replica_safe
 def system_admin_dashboard():
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT COUNT(*) as count FROM public.students")
-    total_students = cursor.fetchone()['count']
-    cursor.execute("SELECT COUNT(*) as count FROM public.users WHERE role = 'teacher'")
-    total_teachers = cursor.fetchone()['count']
-    cursor.execute("SELECT COUNT(DISTINCT class_name) as count FROM public.classes")
-    total_classes = cursor.fetchone()['count']
-    cursor.execute("SELECT COUNT(*) as count FROM public.users")
-    total_users = cursor.fetchone()['count']
-    cursor.execute("SELECT full_name as user, 'User Created' as action, role as timestamp FROM public.users ORDER BY user_id DESC LIMIT 5")
-    recent_activities = cursor.fetchall()
-    cursor.close()
-    return render_template('system_admin_dashboard.html', total_students=total_students, total_teachers=total_teachers, total_classes=total_classes, total_users=total_users, recent_activities=recent_activities)
+    return render_template('system_admin_dashboard.html', load_stats=lambda: _load_dashboard_stats(_SYSTEM_ADMIN_STATS))
 
 @admin_bp.route('/accounts_dashboard', endpoint='accounts_dashboard')
 @role_required('accounts')
+@replica_safe
 def accounts_dashboard():
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT COUNT(payment_id) as count FROM public.fee_payments")
-    payment_count = cursor.fetchone()['count']
-    cursor.execute("SELECT SUM(amount_paid) as total FROM public.fee_payments")
-    total_collected = cursor.fetchone()['total'] or 0
-    cursor.close()
-    return render_template('accounts_dashboard.html', payment_count=payment_count, total_collected=total_collected)
+    return render_template('accounts_dashboard.html', load_stats=lambda: _load_dashboard_stats(_ACCOUNTS_STATS))
 
 @admin_bp.route('/school_admin_dashboard', endpoint='school_admin_dashboard')
 @role_required('school_admin')
+@replica_safe
 def school_admin_dashboard():
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT COUNT(*) as count FROM public.students")
-    total_students = cursor.fetchone()['count']
-    cursor.execute("SELECT COUNT(*) as count FROM public.users WHERE role = 'teacher'")
-    total_teachers = cursor.fetchone()['count']
-    cursor.execute("SELECT COUNT(DISTINCT class_name) as count FROM public.classes")
-    total_classes = cursor.fetchone()['count']
-    cursor.close()
-    return render_template('school_admin_dashboard.html', total_students=total_students, total_teachers=total_teachers, total_classes=total_classes)
-
-@admin_bp.route('/data/students_per_class')
-@role_required('system_admin')
-def get_students_per_class_data():
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT class_name, COUNT(student_id) as student_count FROM public.students GROUP BY class_name ORDER BY class_name;")
-    data = cursor.fetchall()
-    cursor.close()
-    labels = [row['class_name'] for row in data]
-    values = [row['student_count'] for row in data]
-    return jsonify({'labels': labels, 'values': values})
-
-@admin_bp.route('/data/users_by_role')
-@role_required('system_admin')
-def get_users_by_role_data():
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT role, COUNT(user_id) as user_count FROM public.users GROUP BY role ORDER BY role;")
-    data = cursor.fetchall()
-    cursor.close()
-    labels = [row['role'].replace('_', ' ').title() for row in data]
-    values = [row['user_count'] for row in data]
-    return jsonify({'labels': labels, 'values': values})
\ No newline at end of file
+    return render_template('school_admin_dashboard.html', load_stats=lambda: _load_dashboard_stats(_SCHOOL_ADMIN_STATS))
\ No newline at end of file
@@ -0,0 +1,53 @@
+from flask import Blueprint, render_template, request, jsonify
+from db import get_db_connection, get_read_connection
+from utils import role_required, replica_safe
+import analytics
+import psycopg2
+import psycopg2.extras
+
+analytics_bp = Blueprint('analytics', __name__)
+
+def _int_arg(name):
+    value = request.args.get(name)
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+@analytics_bp.route('/')
+@role_required('school_admin', 'system_admin')
+@replica_safe
+def dashboard():
+    conn = get_read_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute("SELECT DISTINCT year FROM public.results_rollup ORDER BY year DESC")
+    years = [row['year'] for row in cursor.fetchall()]
+    cursor.close()
+    return render_template('analytics_dashboard.html', years=years, selected_year=request.args.get('year') or (years[0] if years else None))
+
+@analytics_bp.route('/pivot')
+@role_required('school_admin', 'system_admin')
+@replica_safe
+def pivot():
+    # e.g. /analytics/pivot?rows=subject&cols=term&measure=median&year=2024/2025
+    rows = request.args.get('rows', 'subject')
+    cols = request.args.get('cols') or None
+    measure = request.args.get('measure', 'mean')
+    if rows not in analytics.DIMENSIONS or (cols and cols not in analytics.DIMENSIONS) or rows == cols:
+        return jsonify({'error': f"rows and cols must be different dimensions out of: {', '.join(analytics.DIMENSIONS)}."}), 400
+    if measure not in analytics.MEASURES:
+        return jsonify({'error': f"measure must be one of: {', '.join(analytics.MEASURES)}."}), 400
+    filters = {
+        'year': request.args.get('year') or None,
+        'term': request.args.get('term') or None,
+        'class_id': _int_arg('class_id'),
+        'subject_id': _int_arg('subject_id'),
+        'teacher_id': _int_arg('teacher_id'),
+    }
+    # Cells dirtied by recent result changes are rebuilt on the primary first;
+    # with nothing dirty this is one EXISTS query.
+    analytics.refresh_if_dirty(get_db_connection())
+    cursor = get_read_connection().cursor(cursor_factory=psycopg2.extras.DictCursor)
+    result = analytics.pivot(cursor, rows, cols, measure, filters)
+    cursor.close()
+    return jsonify(result)
@@ -1,6 +1,8 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from db import get_db_connection
+import db_async
 from utils import role_required, log_activity
+from template_cache import invalidate_fragment
 # --- CHANGES START HERE ---
 import psycopg2
 import psycopg2.extras
@@ -11,32 +13,25 @@ assignment_bp = Blueprint('assignment', __name__)
 @assignment_bp.route('/manage/<int:teacher_user_id>')
 @role_required('system_admin', 'school_admin')
 def manage(teacher_user_id):
-    conn = get_db_connection()
-    # Use the correct cursor factory
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT user_id, full_name FROM users WHERE user_id = %s AND role = 'teacher'", (teacher_user_id,))
-    teacher = cursor.fetchone()
-    if not teacher:
+    teacher_rows, current_assignments, all_classes, all_subjects = db_async.gather(
+        ("SELECT user_id, full_name FROM users WHERE user_id = %s AND role = 'teacher'", (teacher_user_id,)),
+        ("""
+            SELECT ta.assignment_id, c.class_name, s.subject_name
+            FROM teacher_assignments ta
+            JOIN subjects s ON ta.subject_id = s.subject_id
+            JOIN teachers t ON ta.teacher_id = t.teacher_id
+            JOIN classes c ON ta.class_id = c.class_id
+            WHERE t.user_id = %s
+            ORDER BY c.class_name, s.subject_name
+        """, (teacher_user_id,)),
+        ("SELECT class_id, class_name FROM classes ORDER BY class_name", None),
+        ("SELECT subject_id, subject_name FROM subjects ORDER BY subject_name", None),
+    )
+    if not teacher_rows:
         flash("Teacher not found.", "error")
-        cursor.close()
         return redirect(url_for('user.view_users'))
-    cursor.execute("""
-        SELECT ta.assignment_id, c.class_name, s.subject_name
-        FROM teacher_assignments ta
-        JOIN subjects s ON ta.subject_id = s.subject_id
-        JOIN teachers t ON ta.teacher_id = t.teacher_id
-        JOIN classes c ON ta.class_id = c.class_id
-        WHERE t.user_id = %s
-        ORDER BY c.class_name, s.subject_name
-    """, (teacher_user_id,))
-    current_assignments = cursor.fetchall()
-    cursor.execute("SELECT class_id, class_name FROM classes ORDER BY class_name")
-    all_classes = cursor.fetchall()
-    cursor.execute("SELECT subject_id, subject_name FROM subjects ORDER BY subject_name")
-    all_subjects = cursor.fetchall()
-    cursor.close()
     return render_template('manage_assignments.html',
-                           teacher=teacher,
+                           teacher=teacher_rows[0],
                            current_assignments=current_assignments,
                            all_classes=all_classes,
                            all_subjects=all_subjects)
@@ -54,41 +49,90 @@ def add_assignment(teacher_user_id):
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
+    # One statement: the unique pair index turns a duplicate into no row,
+    # and RETURNING brings back the names for the audit message
+    cursor.execute("""
+        INSERT INTO teacher_assignments (teacher_id, class_id, subject_id)
+        SELECT t.teacher_id, %(class_id)s::int, %(subject_id)s::int FROM teachers t WHERE t.user_id = %(user_id)s
+        ON CONFLICT (teacher_id, class_id, subject_id) DO NOTHING
+        RETURNING assignment_id,
+                  (SELECT full_name FROM users WHERE user_id = %(user_id)s) AS teacher_name,
+                  (SELECT class_name FROM classes WHERE class_id = %(class_id)s) AS class_name,
+                  (SELECT subject_name FROM subjects WHERE subject_id = %(subject_id)s) AS subject_name
+    """, {'user_id': teacher_user_id, 'class_id': class_id, 'subject_id': subject_id})
+    assignment = cursor.fetchone()
+    if not assignment:
+        # Nothing inserted: either there is no teacher profile or the pair exists
+        cursor.execute("SELECT 1 FROM teachers WHERE user_id = %s", (teacher_user_id,))
+        teacher_exists = cursor.fetchone() is not None
+        conn.rollback()
+        cursor.close()
+        if not teacher_exists:
+            flash("Teacher profile not found.", "error")
+            return redirect(url_for('user.view_users'))
+        flash("This teacher is already assigned to that class and subject.", "warning")
+        return redirect(url_for('assignment.manage', teacher_user_id=teacher_user_id))
+    assignment_id = assignment['assignment_id']
+    teacher_name = assignment['teacher_name']
+    class_name = assignment['class_name'] or 'Unknown Class'
+    subject_name = assignment['subject_name'] or 'Unknown Subject'
+    conn.commit()
+    cursor.close()
+    invalidate_fragment('dashboard_stats')
+    invalidate_fragment('coverage_grid')
+
+    log_activity(f"Assigned '{teacher_name}' to teach '{subject_name}' in '{class_name}'.",
+                 event_type='teacher_assignment.created', entity_type='user', entity_id=teacher_user_id,
+                 payload={'assignment_id': assignment_id, 'class_id': class_id, 'subject_id': subject_id})
+    flash("Assignment added successfully.", "success")
+    return redirect(url_for('assignment.manage', teacher_user_id=teacher_user_id))
+
+@assignment_bp.route('/bulk_add/<int:teacher_user_id>', methods=['POST'])
+@role_required('system_admin', 'school_admin')
+def bulk_add_assignments(teacher_user_id):
+    # Every selected class x subject pair, by default only those in the class's curriculum
+    try:
+        class_ids = [int(value) for value in request.form.getlist('class_ids')]
+        subject_ids = [int(value) for value in request.form.getlist('subject_ids')]
+    except ValueError:
+        class_ids = subject_ids = []
+    curriculum_only = request.form.getlist('curriculum_only')  # the form sends 'false' plus the checkbox
+    curriculum_only = 'true' in curriculum_only if curriculum_only else True
+    if not class_ids or not subject_ids:
+        flash("Please select at least one class and one subject.", "error")
+        return redirect(url_for('assignment.manage', teacher_user_id=teacher_user_id))
+
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     cursor.execute("SELECT teacher_id, u.full_name FROM teachers t JOIN users u ON t.user_id = u.user_id WHERE t.user_id = %s", (teacher_user_id,))
     teacher = cursor.fetchone()
     if not teacher:
         flash("Teacher profile not found.", "error")
         cursor.close()
         return redirect(url_for('user.view_users'))
-    teacher_id = teacher['teacher_id']
-    teacher_name = teacher['full_name']
-
-    cursor.execute("SELECT class_name FROM classes WHERE class_id = %s", (class_id,))
-    class_obj = cursor.fetchone()
-    class_name = class_obj['class_name'] if class_obj else 'Unknown Class'
 
-    cursor.execute("SELECT subject_name FROM subjects WHERE subject_id = %s", (subject_id,))
-    subject_obj = cursor.fetchone()
-    subject_name = subject_obj['subject_name'] if subject_obj else 'Unknown Subject'
-
-    cursor.execute(
-        "SELECT assignment_id FROM teacher_assignments WHERE teacher_id = %s AND class_id = %s AND subject_id = %s",
-        (teacher_id, class_id, subject_id)
-    )
-    if cursor.fetchone():
-        flash("This teacher is already assigned to that class and subject.", "warning")
-        cursor.close()
-        return redirect(url_for('assignment.manage', teacher_user_id=teacher_user_id))
-
-    cursor.execute(
-        "INSERT INTO teacher_assignments (teacher_id, class_id, subject_id) VALUES (%s, %s, %s)",
-        (teacher_id, class_id, subject_id)
-    )
+    cursor.execute(f"""
+        INSERT INTO teacher_assignments (teacher_id, class_id, subject_id)
+        SELECT %(teacher_id)s, c.class_id, s.subject_id
+        FROM classes c CROSS JOIN subjects s
+        WHERE c.class_id = ANY(%(class_ids)s) AND s.subject_id = ANY(%(subject_ids)s)
+        {"AND EXISTS (SELECT 1 FROM curriculum cu WHERE cu.class_id = c.class_id AND cu.subject_id = s.subject_id)" if curriculum_only else ""}
+        ON CONFLICT DO NOTHING
+        RETURNING assignment_id, class_id, subject_id
+    """, {'teacher_id': teacher['teacher_id'], 'class_ids': class_ids, 'subject_ids': subject_ids})
+    created = [dict(row) for row in cursor.fetchall()]
     conn.commit()
     cursor.close()
-
-    log_activity(f"Assigned '{teacher_name}' to teach '{subject_name}' in '{class_name}'.")
-    flash("Assignment added successfully.", "success")
+    if created:
+        invalidate_fragment('dashboard_stats')
+        invalidate_fragment('coverage_grid')
+        log_activity(f"Assigned '{teacher['full_name']}' to {len(created)} class/subject pairs in bulk.",
+                     event_type='teacher_assignment.bulk_created', entity_type='user', entity_id=teacher_user_id,
+                     payload={'created': created, 'requested_classes': class_ids, 'requested_subjects': subject_ids,
+                              'curriculum_only': curriculum_only})
+    skipped = len(class_ids) * len(subject_ids) - len(created)
+    flash(f"{len(created)} assignments added; {skipped} pairs skipped (already assigned{' or not in the curriculum' if curriculum_only else ''}).",
+          "success" if created else "warning")
     return redirect(url_for('assignment.manage', teacher_user_id=teacher_user_id))
 
 @assignment_bp.route('/remove/<int:assignment_id>', methods=['POST'])
@@ -98,26 +142,27 @@ def remove_assignment(assignment_id):
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
     cursor.execute("""
-        SELECT t.user_id, u.full_name, c.class_name, s.subject_name
-        FROM teacher_assignments ta
-        JOIN teachers t ON ta.teacher_id = t.teacher_id
-        JOIN users u ON t.user_id = u.user_id
-        JOIN classes c ON ta.class_id = c.class_id
-        JOIN subjects s ON ta.subject_id = s.subject_id
+        DELETE FROM teacher_assignments ta
+        USING teachers t, users u, classes c, subjects s
         WHERE ta.assignment_id = %s
+          AND t.teacher_id = ta.teacher_id AND u.user_id = t.user_id
+          AND c.class_id = ta.class_id AND s.subject_id = ta.subject_id
+        RETURNING t.user_id, u.full_name, ta.class_id, c.class_name, ta.subject_id, s.subject_name
     """, (assignment_id,))
     assignment_to_delete = cursor.fetchone()
-
-    cursor.execute("DELETE FROM teacher_assignments WHERE assignment_id = %s", (assignment_id,))
     conn.commit()
     cursor.close()
+    invalidate_fragment('dashboard_stats')
+    invalidate_fragment('coverage_grid')
     flash("Assignment removed successfully.", "success")
     
     if assignment_to_delete:
         teacher_name = assignment_to_delete['full_name']
         class_name = assignment_to_delete['class_name']
         subject_name = assignment_to_delete['subject_name']
-        log_activity(f"Removed assignment for '{teacher_name}' to teach '{subject_name}' in '{class_name}'.")
+        log_activity(f"Removed assignment for '{teacher_name}' to teach '{subject_name}' in '{class_name}'.",
+                     event_type='teacher_assignment.deleted', entity_type='user', entity_id=assignment_to_delete['user_id'],
+                     payload={'assignment_id': assignment_id, 'class_id': assignment_to_delete['class_id'], 'subject_id': assignment_to_delete['subject_id']})
         return redirect(url_for('assignment.manage', teacher_user_id=assignment_to_delete['user_id']))
     
     return redirect(url_for('user.view_users'))
\ No newline at end of file
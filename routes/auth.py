@@ -1,12 +1,15 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from db import get_db_connection
-from werkzeug.security import check_password_hash
+from db import get_db_connection, prepared_statement, execute_prepared
+from passwords import verify_password, hash_password, needs_rehash, login_throttle, PasswordServiceBusy
 from utils import log_activity
+from config import Config
 import psycopg2
 import psycopg2.extras
 
 auth_bp = Blueprint('auth', __name__)
 
+_USER_BY_EMAIL = prepared_statement('user_by_email', "SELECT user_id, full_name, email, password, role FROM public.users WHERE email = %s")
+
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
     if 'user_id' in session:
@@ -20,16 +23,45 @@ def login():
             flash("Please enter both email and password.", "error")
             return redirect(url_for('auth.login'))
 
+        # Throttle repeated failures before doing any DB or hashing work.
+        # remote_addr is the client only once TRUSTED_PROXY_HOPS (ProxyFix) is
+        # set; until then it may be the router every request comes through,
+        # so failures are counted per account alone.
+        client_ip = request.remote_addr or ''
+        throttle_keys = (f"email:{email.lower()}",)
+        if Config.TRUSTED_PROXY_HOPS:
+            throttle_keys += (f"ip:{client_ip}",)
+        if not login_throttle.allow(*throttle_keys):
+            flash("Too many failed login attempts. Please wait a few minutes and try again.", "error")
+            return redirect(url_for('auth.login'))
+
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         
         # Specifying the 'public' schema
-        cursor.execute("SELECT user_id, full_name, email, password, role FROM public.users WHERE email = %s", (email,))
+        execute_prepared(cursor, _USER_BY_EMAIL, (email,))
         user = cursor.fetchone()
+
+        try:
+            password_ok = user is not None and verify_password(user['password'], password)
+        except PasswordServiceBusy:
+            cursor.close()
+            flash("The server is busy. Please try again in a moment.", "error")
+            return redirect(url_for('auth.login'))
+
+        if password_ok and needs_rehash(user['password']):
+            # Transparently upgrade hashes made with an older method or cost.
+            # Best effort: if the hash pool is busy we retry on the next login.
+            try:
+                cursor.execute("UPDATE public.users SET password = %s WHERE user_id = %s", (hash_password(password), user['user_id']))
+                conn.commit()
+            except PasswordServiceBusy:
+                pass
         cursor.close()
 
-        if user and check_password_hash(user['password'], password):
-            log_activity(f"User logged in successfully.", user_id=user['user_id'], user_full_name=user['full_name'])
+        if password_ok:
+            log_activity(f"User logged in successfully.", user_id=user['user_id'], user_full_name=user['full_name'],
+                         event_type='auth.login', entity_type='user', entity_id=user['user_id'])
 
             session['user_id'] = user['user_id']
             session['full_name'] = user['full_name']
@@ -49,7 +81,10 @@ def login():
                 flash("Your user role is undefined. Please contact an administrator.", "error")
                 return redirect(url_for('auth.login'))
         else:
-            log_activity(f"Failed login attempt for email: '{email}'.")
+            login_throttle.record_failure(*throttle_keys)
+            log_activity(f"Failed login attempt for email: '{email}'.",
+                         event_type='auth.login_failed', entity_type='user' if user else None,
+                         entity_id=user['user_id'] if user else None, payload={'email': email, 'ip': client_ip})
             flash("Invalid email or password. Please try again.", "error")
             return redirect(url_for('auth.login'))
 
@@ -58,7 +93,8 @@ def login():
 @auth_bp.route('/logout')
 def logout():
     if 'full_name' in session:
-        log_activity(f"User '{session['full_name']}' logged out.")
+        log_activity(f"User '{session['full_name']}' logged out.",
+                     event_type='auth.logout', entity_type='user', entity_id=session.get('user_id'))
 
     session.clear()
     flash("You have been successfully logged out.", "success")
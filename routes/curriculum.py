@@ -1,14 +1,14 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from db import get_db_connection
-from utils import role_required, log_activity
+import db_async
+from utils import role_required, replica_safe, log_activity
+from template_cache import invalidate_fragment
 import psycopg2
 import psycopg2.extras
 
 curriculum_bp = Blueprint('curriculum', __name__)
 
-@curriculum_bp.route('/')
-@role_required('system_admin', 'school_admin')
-def manage():
+def _load_curriculum_grid():
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     cursor.execute("SELECT class_id, class_name FROM public.classes ORDER BY class_id")
@@ -29,9 +29,13 @@ def manage():
     cursor.execute("SELECT subject_id, subject_name FROM public.subjects ORDER BY subject_name")
     all_subjects = cursor.fetchall()
     cursor.close()
-    return render_template('manage_curriculum.html', 
-                           classes=classes, 
-                           all_subjects=all_subjects)
+    return {'classes': classes, 'all_subjects': all_subjects}
+
+@curriculum_bp.route('/')
+@role_required('system_admin', 'school_admin')
+def manage():
+    # The grid is a cached fragment; the loader only runs when it is re-rendered.
+    return render_template('manage_curriculum.html', load_grid=_load_curriculum_grid)
 
 @curriculum_bp.route('/add', methods=['POST'])
 @role_required('system_admin', 'school_admin')
@@ -47,11 +51,16 @@ def add_subject_to_class():
     cursor = conn.cursor()
     try:
         cursor.execute(
-            "INSERT INTO public.curriculum (class_id, subject_id) VALUES (%s, %s)",
+            "INSERT INTO public.curriculum (class_id, subject_id) VALUES (%s, %s) RETURNING curriculum_id",
             (class_id, subject_id)
         )
+        curriculum_id = cursor.fetchone()[0]
         conn.commit()
-        log_activity(f"Added subject ID {subject_id} to class ID {class_id} in curriculum.")
+        invalidate_fragment('curriculum_grid')
+        invalidate_fragment('coverage_grid')
+        log_activity(f"Added subject ID {subject_id} to class ID {class_id} in curriculum.",
+                     event_type='curriculum.created', entity_type='class', entity_id=class_id,
+                     payload={'curriculum_id': curriculum_id, 'subject_id': subject_id})
         flash("Subject added to curriculum successfully.", "success")
     except psycopg2.Error as err:
         if err.pgcode == '23505':
@@ -63,15 +72,76 @@ def add_subject_to_class():
     
     return redirect(url_for('curriculum.manage'))
 
+@curriculum_bp.route('/copy', methods=['POST'])
+@role_required('system_admin', 'school_admin')
+def copy_curriculum():
+    # Copies a class's subjects (and optionally its teacher assignments) onto other classes
+    try:
+        source_class_id = int(request.form.get('source_class_id', ''))
+        target_class_ids = [int(value) for value in request.form.getlist('target_class_ids') if int(value) != source_class_id]
+    except ValueError:
+        source_class_id, target_class_ids = None, []
+    include_assignments = request.form.get('include_assignments') == 'true'
+    if source_class_id is None or not target_class_ids:
+        flash("Please select a class to copy from and at least one other class to copy to.", "error")
+        return redirect(url_for('curriculum.manage'))
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO public.curriculum (class_id, subject_id)
+            SELECT t.class_id, cu.subject_id
+            FROM public.curriculum cu
+            CROSS JOIN public.classes t
+            WHERE cu.class_id = %(source)s AND t.class_id = ANY(%(targets)s)
+            ON CONFLICT DO NOTHING
+        """, {'source': source_class_id, 'targets': target_class_ids})
+        subjects_added = cursor.rowcount
+        assignments_added = 0
+        if include_assignments:
+            cursor.execute("""
+                INSERT INTO public.teacher_assignments (teacher_id, class_id, subject_id)
+                SELECT ta.teacher_id, t.class_id, ta.subject_id
+                FROM public.teacher_assignments ta
+                CROSS JOIN public.classes t
+                WHERE ta.class_id = %(source)s AND t.class_id = ANY(%(targets)s)
+                ON CONFLICT DO NOTHING
+            """, {'source': source_class_id, 'targets': target_class_ids})
+            assignments_added = cursor.rowcount
+        conn.commit()
+    except psycopg2.Error as err:
+        conn.rollback()
+        flash(f"A database error occurred: {err}", "error")
+        return redirect(url_for('curriculum.manage'))
+    finally:
+        cursor.close()
+    if subjects_added or assignments_added:
+        invalidate_fragment('curriculum_grid')
+        invalidate_fragment('coverage_grid')
+        invalidate_fragment('dashboard_stats')
+        log_activity(f"Copied curriculum of class ID {source_class_id} to {len(target_class_ids)} classes "
+                     f"({subjects_added} subjects, {assignments_added} teacher assignments added).",
+                     event_type='curriculum.copied', entity_type='class', entity_id=source_class_id,
+                     payload={'target_class_ids': target_class_ids, 'subjects_added': subjects_added,
+                              'include_assignments': include_assignments, 'assignments_added': assignments_added})
+    flash(f"Curriculum copied: {subjects_added} subjects and {assignments_added} teacher assignments added.", "success")
+    return redirect(url_for('curriculum.manage'))
+
 @curriculum_bp.route('/remove/<int:curriculum_id>', methods=['POST'])
 @role_required('system_admin', 'school_admin')
 def remove_subject_from_class(curriculum_id):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM public.curriculum WHERE curriculum_id = %s", (curriculum_id,))
+    cursor.execute("DELETE FROM public.curriculum WHERE curriculum_id = %s RETURNING class_id, subject_id", (curriculum_id,))
+    removed = cursor.fetchone()
     conn.commit()
     cursor.close()
-    log_activity(f"Removed curriculum link ID {curriculum_id}.")
+    invalidate_fragment('curriculum_grid')
+    invalidate_fragment('coverage_grid')
+    log_activity(f"Removed curriculum link ID {curriculum_id}.",
+                 event_type='curriculum.deleted', entity_type='class', entity_id=removed[0] if removed else None,
+                 payload={'curriculum_id': curriculum_id, 'subject_id': removed[1] if removed else None})
     flash("Subject removed from curriculum successfully.", "success")
     return redirect(url_for('curriculum.manage'))
 
@@ -89,4 +159,89 @@ def get_subjects_for_class(class_id):
     """, (class_id,))
     subjects = [dict(row) for row in cursor.fetchall()]
     cursor.close()
-    return jsonify(subjects)
\ No newline at end of file
+    return jsonify(subjects)
+
+# Every (class, subject) pair that is in the curriculum or has a teacher,
+# with its teachers, in one grouped join.
+_COVERAGE_QUERY = """
+    WITH pairs AS (
+        SELECT class_id, subject_id FROM public.curriculum
+        UNION
+        SELECT class_id, subject_id FROM public.teacher_assignments
+    )
+    SELECT p.class_id, p.subject_id, cu.class_id IS NOT NULL AS in_curriculum,
+           COALESCE(jsonb_agg(jsonb_build_object('teacher_id', t.teacher_id, 'user_id', u.user_id, 'full_name', u.full_name)
+                              ORDER BY u.full_name) FILTER (WHERE t.teacher_id IS NOT NULL), '[]') AS teachers
+    FROM pairs p
+    LEFT JOIN (SELECT DISTINCT class_id, subject_id FROM public.curriculum) cu
+           ON cu.class_id = p.class_id AND cu.subject_id = p.subject_id
+    LEFT JOIN public.teacher_assignments ta ON ta.class_id = p.class_id AND ta.subject_id = p.subject_id
+    LEFT JOIN public.teachers t ON t.teacher_id = ta.teacher_id
+    LEFT JOIN public.users u ON u.user_id = t.user_id
+    GROUP BY p.class_id, p.subject_id, cu.class_id
+"""
+
+def _coverage_status(in_curriculum, teacher_count):
+    if not in_curriculum:
+        return 'extra'  # assigned, but the class doesn't take the subject
+    if teacher_count == 0:
+        return 'gap'
+    return 'double' if teacher_count > 1 else 'covered'
+
+def _load_coverage():
+    pair_rows, classes, subjects, teachers = db_async.gather(
+        (_COVERAGE_QUERY, None),
+        ("""
+            SELECT c.class_id, c.class_name, COUNT(s.student_id) AS student_count
+            FROM public.classes c LEFT JOIN public.students s ON s.class_id = c.class_id
+            GROUP BY c.class_id, c.class_name ORDER BY c.class_name
+        """, None),
+        ("SELECT subject_id, subject_name FROM public.subjects ORDER BY subject_name", None),
+        ("""
+            SELECT t.teacher_id, u.user_id, u.full_name
+            FROM public.teachers t JOIN public.users u ON u.user_id = t.user_id
+            ORDER BY u.full_name
+        """, None),
+    )
+    class_sizes = {row['class_id']: row['student_count'] for row in classes}
+    cells = {}
+    loads = {row['teacher_id']: {'teacher_id': row['teacher_id'], 'user_id': row['user_id'], 'full_name': row['full_name'],
+                                 'assignments': 0, 'class_ids': set(), 'subject_ids': set()} for row in teachers}
+    totals = {'covered': 0, 'gap': 0, 'double': 0, 'extra': 0}
+    for row in pair_rows:
+        status = _coverage_status(row['in_curriculum'], len(row['teachers']))
+        totals[status] += 1
+        cells[(row['class_id'], row['subject_id'])] = {'status': status, 'teachers': row['teachers']}
+        for teacher in row['teachers']:
+            load = loads.get(teacher['teacher_id'])
+            if load:
+                load['assignments'] += 1
+                load['class_ids'].add(row['class_id'])
+                load['subject_ids'].add(row['subject_id'])
+    teacher_loads = []
+    for load in loads.values():
+        class_ids = load.pop('class_ids')
+        load['class_count'] = len(class_ids)
+        load['subject_count'] = len(load.pop('subject_ids'))
+        load['student_count'] = sum(class_sizes.get(class_id, 0) for class_id in class_ids)
+        teacher_loads.append(load)
+    teacher_loads.sort(key=lambda load: (-load['assignments'], load['full_name']))
+    return {
+        'subjects': [dict(row) for row in subjects],
+        'classes': [dict(row, cells=[cells.get((row['class_id'], subject['subject_id'])) for subject in subjects]) for row in classes],
+        'teacher_loads': teacher_loads,
+        'totals': totals,
+    }
+
+@curriculum_bp.route('/coverage')
+@role_required('system_admin', 'school_admin')
+@replica_safe
+def coverage():
+    # The grid is a cached fragment, invalidated by curriculum, assignment and user changes.
+    return render_template('curriculum_coverage.html', load_coverage=_load_coverage)
+
+@curriculum_bp.route('/coverage/data')
+@role_required('system_admin', 'school_admin')
+@replica_safe
+def coverage_data():
+    return jsonify(_load_coverage())
@@ -0,0 +1,61 @@
+import hmac
+import time
+from flask import Blueprint, Response, request, g, jsonify
+from config import Config
+from db import get_db_connection
+import metrics
+import psycopg2
+import psycopg2.pool
+
+# Operational endpoints, with no login: /metrics for Prometheus, /healthz
+# and /readyz for the platform's health checks. The blueprint also times
+# every request of the app for the request metrics.
+ops_bp = Blueprint('ops', __name__)
+
+
+@ops_bp.before_app_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+@ops_bp.after_app_request
+def _record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        metrics.observe_histogram('http_request_duration_seconds', time.perf_counter() - started,
+                                  endpoint=endpoint, method=request.method)
+        metrics.inc('http_requests', endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
+
+
+@ops_bp.route('/metrics')
+def prometheus_metrics():
+    if Config.METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {Config.METRICS_TOKEN}'):
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@ops_bp.route('/healthz')
+def healthz():
+    # Liveness: the worker answers and its pool hands out an open connection, without a query
+    try:
+        connected = not get_db_connection().closed
+    except (psycopg2.Error, psycopg2.pool.PoolError):
+        connected = False
+    if not connected:
+        return jsonify({'status': 'error', 'database': 'unavailable'}), 503
+    return jsonify({'status': 'ok'})
+
+
+@ops_bp.route('/readyz')
+def readyz():
+    # Readiness: one round trip to the primary, cut off after two seconds
+    g.time_budget = 2
+    try:
+        cursor = get_db_connection().cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+    except (psycopg2.Error, psycopg2.pool.PoolError):
+        return jsonify({'status': 'error', 'database': 'unreachable'}), 503
+    return jsonify({'status': 'ok'})
@@ -1,7 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
 from db import get_db_connection
-from utils import log_activity
-from werkzeug.security import check_password_hash, generate_password_hash
+from utils import log_activity, changed_fields
+from passwords import verify_password, hash_password, PasswordServiceBusy
 import psycopg2
 import psycopg2.extras
 
@@ -35,13 +35,15 @@ def settings():
                 cursor.close()
                 return redirect(url_for('profile.settings'))
             
+            changes = changed_fields({'full_name': session.get('full_name'), 'email': session.get('email')}, {'full_name': new_full_name, 'email': new_email})
             cursor.execute("UPDATE public.users SET full_name = %s, email = %s WHERE user_id = %s", (new_full_name, new_email, user_id))
             conn.commit()
 
             session['full_name'] = new_full_name
             session['email'] = new_email
 
-            log_activity("User updated their profile (name/email).")
+            log_activity("User updated their profile (name/email).",
+                         event_type='user.updated', entity_type='user', entity_id=user_id, payload=changes)
             flash("Your profile has been updated successfully.", "success")
 
         elif action == 'change_password':
@@ -62,16 +64,22 @@ def settings():
             cursor.execute("SELECT password FROM public.users WHERE user_id = %s", (user_id,))
             user = cursor.fetchone()
 
-            if not user or not check_password_hash(user['password'], current_password):
-                flash("Your current password is incorrect.", "error")
+            try:
+                if not user or not verify_password(user['password'], current_password):
+                    flash("Your current password is incorrect.", "error")
+                    cursor.close()
+                    return redirect(url_for('profile.settings'))
+                
+                new_hashed_password = hash_password(new_password)
+            except PasswordServiceBusy:
+                flash("The server is busy. Please try again in a moment.", "error")
                 cursor.close()
                 return redirect(url_for('profile.settings'))
-            
-            new_hashed_password = generate_password_hash(new_password)
             cursor.execute("UPDATE public.users SET password = %s WHERE user_id = %s", (new_hashed_password, user_id))
             conn.commit()
 
-            log_activity("User changed their own password successfully.")
+            log_activity("User changed their own password successfully.",
+                         event_type='user.password_changed', entity_type='user', entity_id=user_id)
             flash("Your password has been updated successfully.", "success")
         
         cursor.close()
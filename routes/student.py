@@ -1,29 +1,222 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
-from db import get_db_connection
-from utils import role_required, log_activity
+import csv
+import io
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, Response
+from werkzeug.utils import secure_filename
+from db import get_db_connection, get_read_connection, prepared_statement, execute_prepared
+import db_async
+import transcripts
+import rosters
+import promotions
+from utils import role_required, replica_safe, time_budget, log_activity, changed_fields
+from template_cache import invalidate_fragment
+from streaming import server_cursor, json_list_response
+from lookups import STUDENTS_WITH_CLASS, resolve_class_id
+from config import Config
 from datetime import datetime, date
 import psycopg2
 import psycopg2.extras
 
 student_bp = Blueprint('student', __name__)
 
+# Columns of the filter endpoint's JSON, dates and full_name formatted by Postgres
+_STUDENT_LIST = """
+    SELECT s.student_id, s.student_number, s.first_name, s.middle_name, s.last_name,
+           to_char(s.dob, 'YYYY-MM-DD') AS dob, s.gender, s.guardian_contact, s.government_number,
+           s.special_needs, s.address, to_char(s.enrollment_date, 'YYYY-MM-DD') AS enrollment_date,
+           s.class_id, s.status, c.class_name,
+           concat_ws(' ', s.first_name, NULLIF(s.middle_name, ''), s.last_name) AS full_name
+    FROM public.students s
+    LEFT JOIN public.classes c ON c.class_id = s.class_id
+"""
+_STUDENTS_IN_CLASS = prepared_statement('students_in_class', f"{_STUDENT_LIST} WHERE s.class_id = %s ORDER BY s.last_name, s.first_name")
+
+# A profile's result and payment history is paged newest first with keyset
+# cursors: results whole terms at a time, after (year, term), and payments
+# after (payment_date, payment_id), both walking the per-student indexes.
+# The profile renders the latest term and the first payments; older pages
+# come from the JSON endpoints below, each naming the URL of the next page.
+_RESULT_HISTORY = """
+    WITH page_terms AS (
+        SELECT DISTINCT year, term
+        FROM public.exam_results
+        WHERE student_id = %(student_id)s{before}
+        ORDER BY year DESC, term DESC
+        LIMIT %(terms)s
+    )
+    SELECT er.year, er.term, sub.subject_name AS subject, er.final_score, er.grade
+    FROM page_terms pt
+    JOIN public.exam_results er ON er.student_id = %(student_id)s AND er.year = pt.year AND er.term = pt.term
+    LEFT JOIN public.subjects sub ON sub.subject_id = er.subject_id
+    ORDER BY er.year DESC, er.term DESC, subject
+"""
+
+_PAYMENT_HISTORY = """
+    SELECT payment_id, to_char(payment_date, 'YYYY-MM-DD') AS payment_date,
+           to_char(payment_date, 'DD-Mon-YYYY') AS paid_on, academic_year, term, amount_paid
+    FROM public.fee_payments
+    WHERE student_id = %(student_id)s{before}
+    ORDER BY payment_date DESC, payment_id DESC
+    LIMIT %(limit)s
+"""
+
+def _result_history_query(student_id, terms, before_year=None, before_term=None):
+    # One term more than the page, to know whether there is a next page
+    params = {'student_id': student_id, 'terms': terms + 1, 'year': before_year, 'term': before_term}
+    before = " AND (year, term) < (%(year)s, %(term)s)" if before_year else ""
+    return _RESULT_HISTORY.format(before=before), params
+
+def _result_history_page(student_id, rows, terms):
+    """(result dicts of the first `terms` terms, URL of the next page or None)."""
+    page, seen = [], []
+    for row in rows:
+        if not seen or seen[-1] != (row['year'], row['term']):
+            if len(seen) == terms:
+                return page, url_for('student.profile_results', student_id=student_id,
+                                     before_year=seen[-1][0], before_term=seen[-1][1])
+            seen.append((row['year'], row['term']))
+        page.append(dict(row))
+    return page, None
+
+def _payment_history_query(student_id, limit, before_date=None, before_id=None):
+    params = {'student_id': student_id, 'limit': limit + 1, 'date': before_date, 'payment_id': before_id}
+    before = " AND (payment_date, payment_id) < (%(date)s, %(payment_id)s)" if before_date else ""
+    return _PAYMENT_HISTORY.format(before=before), params
+
+def _payment_history_page(student_id, rows, limit):
+    """(payment dicts, up to `limit`, URL of the next page or None)."""
+    page = [dict(row) for row in rows[:limit]]
+    if len(rows) <= limit:
+        return page, None
+    last = page[-1]
+    return page, url_for('student.profile_payments', student_id=student_id,
+                         before_date=last['payment_date'], before_id=last['payment_id'])
+
 @student_bp.route('/profile/<int:student_id>')
 @role_required('teacher', 'school_admin', 'system_admin', 'accounts')
 def profile(student_id):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT * FROM public.students WHERE student_id = %s", (student_id,))
-    student = cursor.fetchone()
-    if not student:
+    student_rows, result_rows, payment_rows = db_async.gather(
+        (f"{STUDENTS_WITH_CLASS} WHERE s.student_id = %s", (student_id,)),
+        _result_history_query(student_id, 1),
+        _payment_history_query(student_id, Config.PROFILE_HISTORY_PAYMENTS),
+    )
+    if not student_rows:
         flash("Student not found.", "error")
-        cursor.close()
         return redirect(url_for('student.view_students'))
-    cursor.execute("SELECT * FROM public.exam_results WHERE student_id = %s ORDER BY year DESC, term DESC, subject ASC", (student_id,))
-    results = cursor.fetchall()
-    cursor.execute("SELECT * FROM public.fee_payments WHERE student_id = %s ORDER BY payment_date DESC", (student_id,))
-    payments = cursor.fetchall()
+    results, results_next = _result_history_page(student_id, result_rows, 1)
+    payments, payments_next = _payment_history_page(student_id, payment_rows, Config.PROFILE_HISTORY_PAYMENTS)
+    # The progress summary covers the whole history; the page fetches it from /transcript
+    return render_template('student_profile.html', student=student_rows[0], results=results, results_next=results_next,
+                           payments=payments, payments_next=payments_next)
+
+
+@student_bp.route('/profile/<int:student_id>/results')
+@role_required('teacher', 'school_admin', 'system_admin', 'accounts')
+@replica_safe
+def profile_results(student_id):
+    before_year = request.args.get('before_year')
+    before_term = request.args.get('before_term')
+    if bool(before_year) != bool(before_term):
+        return jsonify({'error': 'before_year and before_term must be given together.'}), 400
+    cursor = get_read_connection().cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute(*_result_history_query(student_id, Config.PROFILE_HISTORY_TERMS, before_year, before_term))
+    results, next_page = _result_history_page(student_id, cursor.fetchall(), Config.PROFILE_HISTORY_TERMS)
+    cursor.close()
+    return jsonify({'results': results, 'next': next_page})
+
+
+@student_bp.route('/profile/<int:student_id>/payments')
+@role_required('teacher', 'school_admin', 'system_admin', 'accounts')
+@replica_safe
+def profile_payments(student_id):
+    before_date = request.args.get('before_date')
+    before_id = request.args.get('before_id', type=int)
+    if before_date:
+        try:
+            before_date = datetime.strptime(before_date, '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({'error': 'before_date must be YYYY-MM-DD.'}), 400
+        if before_id is None:
+            return jsonify({'error': 'before_date and before_id must be given together.'}), 400
+    cursor = get_read_connection().cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute(*_payment_history_query(student_id, Config.PROFILE_HISTORY_PAYMENTS, before_date, before_id))
+    payments, next_page = _payment_history_page(student_id, cursor.fetchall(), Config.PROFILE_HISTORY_PAYMENTS)
+    cursor.close()
+    return jsonify({'payments': payments, 'next': next_page})
+
+
+@student_bp.route('/transcript/<int:student_id>')
+@role_required('teacher', 'school_admin', 'system_admin', 'accounts')
+@replica_safe
+def transcript(student_id):
+    cursor = get_read_connection().cursor(cursor_factory=psycopg2.extras.DictCursor)
+    student_transcript = transcripts.get_transcript(cursor, student_id)
+    cursor.close()
+    if student_transcript is None:
+        return jsonify({'error': 'Student not found.'}), 404
+    return jsonify(student_transcript)
+
+
+# A class's students for a year: everyone with results entered in it that
+# year, or moved out of it by that year's promotion run, so a class still
+# exports after its students have been promoted or graduated.
+_CLASS_COHORT = """
+    SELECT s.student_id FROM public.students s
+    WHERE s.student_id IN (
+        SELECT er.student_id FROM public.exam_results er WHERE er.class_id = %(class_id)s AND er.year = %(year)s
+        UNION
+        SELECT ps.student_id FROM public.promotion_run_students ps
+        JOIN public.promotion_runs pr ON pr.run_id = ps.run_id
+        WHERE ps.from_class_id = %(class_id)s AND pr.year = %(year)s AND pr.rolled_back_at IS NULL
+    )
+    ORDER BY s.last_name, s.first_name
+"""
+
+TRANSCRIPT_EXPORT_COLUMNS = ['student_number', 'first_name', 'last_name', 'class_name', 'year', 'year_average',
+                             'term', 'term_average', 'subject', 'final_score', 'grade', 'change', 'fees_paid_in_year']
+
+
+@student_bp.route('/transcripts/export')
+@role_required('school_admin', 'system_admin')
+@replica_safe
+def export_transcripts():
+    # A whole class (e.g. the graduating one) as CSV, one row per result.
+    # ?year= picks the cohort; by default, the last year the class has results for.
+    cursor = get_read_connection().cursor(cursor_factory=psycopg2.extras.DictCursor)
+    class_id = resolve_class_id(cursor, request.args.get('class_id'), request.args.get('class_name'))
+    if class_id is None:
+        cursor.close()
+        return jsonify({'error': 'Unknown class.'}), 400
+    cohort_year = request.args.get('year')
+    if not cohort_year:
+        cursor.execute("SELECT MAX(year) FROM public.exam_results WHERE class_id = %s", (class_id,))
+        cohort_year = cursor.fetchone()[0]
+    if cohort_year:
+        cursor.execute(_CLASS_COHORT, {'class_id': class_id, 'year': cohort_year})
+    else:
+        cursor.execute("SELECT student_id FROM public.students WHERE class_id = %s ORDER BY last_name, first_name", (class_id,))
+    student_ids = [row['student_id'] for row in cursor.fetchall()]
+    class_transcripts = transcripts.get_transcripts(cursor, student_ids)
     cursor.close()
-    return render_template('student_profile.html', student=student, results=results, payments=payments)
+
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=TRANSCRIPT_EXPORT_COLUMNS)
+    writer.writeheader()
+    for item in class_transcripts:
+        student = item['student']
+        for year in item['years']:
+            for term in year['terms']:
+                for result in term['results']:
+                    writer.writerow({
+                        'student_number': student['student_number'], 'first_name': student['first_name'],
+                        'last_name': student['last_name'], 'class_name': student['class_name'],
+                        'year': year['year'], 'year_average': year['average'],
+                        'term': term['term'], 'term_average': term['average'],
+                        'subject': result['subject'], 'final_score': result['final_score'], 'grade': result['grade'],
+                        'change': result['change'], 'fees_paid_in_year': item['fees']['by_year'].get(year['year'], 0),
+                    })
+    filename = secure_filename(f'transcripts_class_{class_id}_{cohort_year.replace("/", "-")}.csv') if cohort_year else f'transcripts_class_{class_id}.csv'
+    return Response(out.getvalue(), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 
 @student_bp.route('/register', methods=['GET', 'POST'])
@@ -49,31 +242,43 @@ def register_student():
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
-        if government_number:
-            cursor.execute("SELECT student_id FROM public.students WHERE government_number = %s", (government_number,))
-            if cursor.fetchone():
-                flash(f"The government number '{government_number}' is already assigned to another student.", "error")
-                cursor.close()
-                return render_template('register_student.html', form_data=request.form)
-        
+        class_id = resolve_class_id(cursor, request.form.get('class_id'), class_name)
+        if class_id is None:
+            flash(f"Unknown class '{class_name}'.", "error")
+            cursor.close()
+            return render_template('register_student.html', form_data=request.form)
+
         try:
-            cursor.execute("SELECT MAX(student_id) as max_id FROM public.students")
-            max_id = cursor.fetchone()['max_id'] or 0
-            student_number = f"HS-2025-{str(max_id + 1).zfill(3)}"
             gov_num_to_insert = government_number if government_number else None
 
-            insert_query = "INSERT INTO public.students (student_number, first_name, middle_name, last_name, dob, gender, class_name, guardian_contact, government_number, special_needs, address, enrollment_date) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-            values = (student_number, first_name, middle_name, last_name, dob, gender, class_name, guardian_contact, gov_num_to_insert, special_needs, address, enrollment_date)
+            # The student number is derived in the same statement; the unique
+            # constraints on student_number and government_number catch clashes
+            insert_query = """
+                INSERT INTO public.students (student_number, first_name, middle_name, last_name, dob, gender, class_id, guardian_contact, government_number, special_needs, address, enrollment_date)
+                SELECT 'HS-2025-' || lpad((COALESCE(MAX(student_id), 0) + 1)::text, 3, '0'), %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+                FROM public.students
+                RETURNING student_id, student_number
+            """
+            values = (first_name, middle_name, last_name, dob, gender, class_id, guardian_contact, gov_num_to_insert, special_needs, address, enrollment_date)
             cursor.execute(insert_query, values)
+            new_student_id, student_number = cursor.fetchone()
             conn.commit()
+            invalidate_fragment('dashboard_stats')
+            invalidate_fragment('coverage_grid')
+            rosters.invalidate_roster(class_id)
 
-            log_activity(f"Registered new student: '{first_name} {last_name}' with number {student_number}.")
+            log_activity(f"Registered new student: '{first_name} {last_name}' with number {student_number}.",
+                         event_type='student.created', entity_type='student', entity_id=new_student_id,
+                         payload={'student_number': student_number, 'first_name': first_name, 'last_name': last_name, 'class_id': class_id})
             flash(f"Student '{first_name} {last_name}' registered successfully.", "success")
             cursor.close()
             return redirect(url_for('student.view_students'))
         
         except psycopg2.Error as err:
-            if err.pgcode == '23505':
+            conn.rollback()
+            if err.pgcode == '23505' and err.diag.constraint_name == 'students_government_number_key':
+                 flash(f"The government number '{government_number}' is already assigned to another student.", "error")
+            elif err.pgcode == '23505':
                  flash(f"A student with these details already exists.", "error")
             else:
                  flash(f"A database error occurred: {err}", "error")
@@ -100,15 +305,41 @@ def edit_student(student_id):
         special_needs = request.form['special_needs']
         address = request.form['address']
         enrollment_date = request.form['enrollment_date']
-        update_query = "UPDATE public.students SET first_name=%s, middle_name=%s, last_name=%s, dob=%s, gender=%s, class_name=%s, guardian_contact=%s, government_number=%s, special_needs=%s, address=%s, enrollment_date=%s WHERE student_id=%s"
-        values = (first_name, middle_name, last_name, dob, gender, class_name, guardian_contact, government_number, special_needs, address, enrollment_date, student_id)
+        class_id = resolve_class_id(cursor, request.form.get('class_id'), class_name)
+        if class_id is None:
+            flash(f"Unknown class '{class_name}'.", "error")
+            cursor.close()
+            return redirect(url_for('student.edit_student', student_id=student_id))
+        # RETURNING old.* reports the pre-update row for the audit diff
+        update_query = """
+            UPDATE public.students s SET first_name=%s, middle_name=%s, last_name=%s, dob=%s, gender=%s, class_id=%s, guardian_contact=%s, government_number=%s, special_needs=%s, address=%s, enrollment_date=%s
+            FROM public.students old WHERE s.student_id=%s AND old.student_id = s.student_id
+            RETURNING old.*
+        """
+        values = (first_name, middle_name, last_name, dob, gender, class_id, guardian_contact, government_number, special_needs, address, enrollment_date, student_id)
         cursor.execute(update_query, values)
+        old_student = cursor.fetchone()
         conn.commit()
-        log_activity(f"Edited student record for '{first_name} {last_name}' (ID: {student_id}).")
+        if not old_student:
+            flash("Student not found.", "error")
+            cursor.close()
+            return redirect(url_for('student.view_students'))
+        invalidate_fragment('dashboard_stats')
+        invalidate_fragment('coverage_grid')
+        transcripts.invalidate_transcript(student_id)
+        rosters.invalidate_roster(old_student['class_id'], class_id)
+        changes = changed_fields(old_student, {
+            'first_name': first_name, 'middle_name': middle_name, 'last_name': last_name, 'dob': dob,
+            'gender': gender, 'class_id': class_id, 'guardian_contact': guardian_contact,
+            'government_number': government_number, 'special_needs': special_needs, 'address': address,
+            'enrollment_date': enrollment_date,
+        })
+        log_activity(f"Edited student record for '{first_name} {last_name}' (ID: {student_id}).",
+                     event_type='student.updated', entity_type='student', entity_id=student_id, payload=changes)
         flash("Student information updated successfully.", "success")
         cursor.close()
         return redirect(url_for('student.view_students'))
-    cursor.execute("SELECT * FROM public.students WHERE student_id = %s", (student_id,))
+    cursor.execute(f"{STUDENTS_WITH_CLASS} WHERE s.student_id = %s", (student_id,))
     student = cursor.fetchone()
     cursor.close()
     if not student:
@@ -126,16 +357,21 @@ def edit_student(student_id):
 def delete_student(student_id):
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT first_name, last_name FROM public.students WHERE student_id = %s", (student_id,))
+    cursor.execute("DELETE FROM public.students WHERE student_id = %s RETURNING first_name, last_name, class_id", (student_id,))
     student_to_delete = cursor.fetchone()
+    conn.commit()
     if not student_to_delete:
         flash("Student not found.", "error")
         cursor.close()
         return redirect(url_for('student.view_students'))
     student_name = f"{student_to_delete['first_name']} {student_to_delete['last_name']}"
-    cursor.execute("DELETE FROM public.students WHERE student_id = %s", (student_id,))
-    conn.commit()
-    log_activity(f"Deleted student record for '{student_name}' (ID: {student_id}).")
+    invalidate_fragment('dashboard_stats')
+    invalidate_fragment('coverage_grid')
+    transcripts.invalidate_transcript(student_id)
+    rosters.invalidate_roster(student_to_delete['class_id'])
+    log_activity(f"Deleted student record for '{student_name}' (ID: {student_id}).",
+                 event_type='student.deleted', entity_type='student', entity_id=student_id,
+                 payload={'first_name': student_to_delete['first_name'], 'last_name': student_to_delete['last_name']})
     flash("Student deleted successfully.", "success")
     cursor.close()
     return redirect(url_for('student.view_students'))
@@ -146,7 +382,7 @@ def delete_student(student_id):
 def view_students():
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT * FROM public.students ORDER BY last_name, first_name")
+    cursor.execute(f"{STUDENTS_WITH_CLASS} ORDER BY s.last_name, s.first_name")
     students = cursor.fetchall()
     cursor.close()
     return render_template('view_students.html', students=students)
@@ -154,21 +390,91 @@ def view_students():
 
 @student_bp.route('/filter', methods=['POST'])
 @role_required('teacher', 'school_admin', 'system_admin', 'accounts')
+@replica_safe
+@time_budget(10)
 def filter_students():
-    selected_class = request.form.get('class_name')
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    conn = get_read_connection()
+    selected_class = request.form.get('class_id') or request.form.get('class_name')
     if selected_class:
-        cursor.execute("SELECT * FROM public.students WHERE class_name = %s ORDER BY last_name, first_name", (selected_class,))
+        # One class is small enough to fetch at once, and keeps its prepared statement
+        cursor = conn.cursor()
+        class_id = resolve_class_id(cursor, request.form.get('class_id'), request.form.get('class_name'))
+        execute_prepared(cursor, _STUDENTS_IN_CLASS, (class_id,))
     else:
-        cursor.execute("SELECT * FROM public.students ORDER BY last_name, first_name")
-    students = cursor.fetchall()
+        cursor = server_cursor(conn)
+        cursor.execute(f"{_STUDENT_LIST} ORDER BY s.last_name, s.first_name")
+    return json_list_response(cursor, 'students')
+
+
+def _promotion_rules(form, mapping):
+    rules = {}
+    for row in mapping:
+        outcome = form.get(f"outcome_{row['class_id']}") or None
+        to_class_id = form.get(f"to_class_{row['class_id']}")
+        rules[row['class_id']] = (outcome, int(to_class_id) if to_class_id else None)
+    return rules
+
+
+@student_bp.route('/promotion', methods=['GET', 'POST'])
+@role_required('school_admin', 'system_admin')
+def promotion():
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    preview_rows = None
+    form_data = request.form
+    if request.method == 'POST':
+        year = (request.form.get('year') or '').strip()
+        repeater_numbers = promotions.parse_student_numbers(request.form.get('repeaters'))
+        try:
+            promotions.save_mapping(cursor, _promotion_rules(request.form, promotions.load_mapping(cursor)))
+            conn.commit()
+        except (promotions.PromotionError, ValueError) as e:
+            conn.rollback()
+            flash(str(e) or "Invalid promotion rule.", "error")
+            cursor.close()
+            return redirect(url_for('student.promotion'))
+        repeater_ids, unknown = promotions.resolve_repeaters(cursor, repeater_numbers)
+        if unknown:
+            flash(f"Unknown student numbers: {', '.join(unknown)}.", "error")
+        elif request.form.get('action') == 'apply':
+            if not year:
+                flash("Enter the academic year being closed, e.g. 2024/2025.", "error")
+            else:
+                run_id, moved = promotions.apply(conn, year, repeater_ids, user_id=session.get('user_id'))
+                invalidate_fragment('dashboard_stats')
+                invalidate_fragment('coverage_grid')
+                transcripts.invalidate_transcript(*moved)
+                rosters.invalidate_all_rosters(cursor)
+                log_activity(f"Promoted {len(moved)} students at the end of {year} (run {run_id}).",
+                             event_type='promotion.applied', entity_type='promotion_run', entity_id=run_id,
+                             payload={'year': year, 'student_count': len(moved), 'repeaters': repeater_numbers})
+                flash(f"Promotion applied: {len(moved)} students moved, {len(repeater_ids)} repeating.", "success")
+                cursor.close()
+                return redirect(url_for('student.promotion'))
+        preview_rows = promotions.preview(cursor, repeater_ids)
+    mapping = promotions.load_mapping(cursor)
+    runs = promotions.recent_runs(cursor)
+    cursor.close()
+    return render_template('promotion.html', mapping=mapping, runs=runs, preview=preview_rows, form_data=form_data)
+
+
+@student_bp.route('/promotion/rollback/<int:run_id>', methods=['POST'])
+@role_required('school_admin', 'system_admin')
+def rollback_promotion(run_id):
+    conn = get_db_connection()
+    try:
+        restored, skipped = promotions.rollback(conn, run_id, user_id=session.get('user_id'))
+    except promotions.PromotionError as e:
+        flash(str(e), "error")
+        return redirect(url_for('student.promotion'))
+    invalidate_fragment('dashboard_stats')
+    invalidate_fragment('coverage_grid')
+    transcripts.invalidate_transcript(*restored)
+    cursor = conn.cursor()
+    rosters.invalidate_all_rosters(cursor)
     cursor.close()
-    students_list = []
-    for s in students:
-        s_dict = dict(s)
-        s_dict['dob'] = s_dict['dob'].strftime('%Y-%m-%d') if s_dict.get('dob') else None
-        s_dict['enrollment_date'] = s_dict['enrollment_date'].strftime('%Y-%m-%d') if s_dict.get('enrollment_date') else None
-        s_dict['full_name'] = f"{s_dict['first_name']} {s_dict.get('middle_name') or ''} {s_dict['last_name']}".replace('  ', ' ')
-        students_list.append(s_dict)
-    return jsonify({"students": students_list})
\ No newline at end of file
+    log_activity(f"Rolled back promotion run {run_id}: {len(restored)} students restored, {skipped} changed since and left as they are.",
+                 event_type='promotion.rolled_back', entity_type='promotion_run', entity_id=run_id,
+                 payload={'restored': len(restored), 'skipped': skipped})
+    flash(f"Promotion rolled back: {len(restored)} students restored" + (f", {skipped} edited since were left unchanged." if skipped else "."), "success")
+    return redirect(url_for('student.promotion'))
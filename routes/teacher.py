@@ -1,59 +1,71 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
-from db import get_db_connection
-from utils import role_required, log_activity
+from db import get_db_connection, get_read_connection, prepared_statement, execute_prepared
+from utils import role_required, replica_safe, time_budget, log_activity, changed_fields
+from streaming import server_cursor, json_list_response
+import grading
+import terms
+import transcripts
+import rosters
+from lookups import STUDENTS_WITH_CLASS, RESULTS_WITH_SUBJECT, resolve_class_id, resolve_subject_id
 from datetime import datetime
 import psycopg2
 import psycopg2.extras
 
 teacher_bp = Blueprint('teacher', __name__)
 
-def get_teacher_assigned_classes(user_id):
-    conn = get_db_connection()
+# Teacher scope is checked on nearly every teacher request
+_TEACHER_CLASSES = prepared_statement('teacher_classes', """
+    SELECT DISTINCT c.class_id, c.class_name
+    FROM public.teacher_assignments ta
+    JOIN public.teachers t ON ta.teacher_id = t.teacher_id
+    JOIN public.classes c ON ta.class_id = c.class_id
+    WHERE t.user_id = %s
+    ORDER BY c.class_id
+""")
+
+def get_teacher_classes(user_id):
+    """(class_id, class_name) rows for the classes the teacher is assigned to."""
+    conn = get_read_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    query = """
-        SELECT DISTINCT c.class_name
+    execute_prepared(cursor, _TEACHER_CLASSES, (user_id,))
+    classes = cursor.fetchall()
+    cursor.close()
+    return classes
+
+def get_teacher_assigned_classes(user_id):
+    return [row['class_name'] for row in get_teacher_classes(user_id)]
+
+def get_teacher_class_ids(user_id):
+    """Ids of the classes the teacher is assigned to; scope checks compare these."""
+    return {row['class_id'] for row in get_teacher_classes(user_id)}
+
+# The dashboard panel in one query, like the admin dashboards
+_TEACHER_STATS = """
+    WITH assigned AS (
+        SELECT DISTINCT ta.class_id
         FROM public.teacher_assignments ta
         JOIN public.teachers t ON ta.teacher_id = t.teacher_id
-        JOIN public.classes c ON ta.class_id = c.class_id
         WHERE t.user_id = %s
-    """
-    cursor.execute(query, (user_id,))
-    assigned_classes = [row['class_name'] for row in cursor.fetchall()]
-    cursor.close()
-    return assigned_classes
+    )
+    SELECT json_build_object(
+        'class_count', (SELECT COUNT(*) FROM assigned),
+        'student_count', (SELECT COUNT(*) FROM public.students WHERE class_id IN (SELECT class_id FROM assigned))
+    )
+"""
 
-def calculate_grade(final_score):
-    if not isinstance(final_score, (int, float)): return 'N/A'
-    if final_score >= 90: return 'A+'
-    elif final_score >= 80: return 'A'
-    elif final_score >= 70: return 'B'
-    elif final_score >= 60: return 'C'
-    elif final_score >= 50: return 'D'
-    elif final_score >= 40: return 'E'
-    else: return 'F'
+def _load_teacher_stats(user_id):
+    cursor = get_read_connection().cursor()
+    cursor.execute(_TEACHER_STATS, (user_id,))
+    stats = cursor.fetchone()[0]
+    cursor.close()
+    return stats
 
 @teacher_bp.route('/dashboard', endpoint='teacher_dashboard')
 @role_required('teacher')
+@replica_safe
 def teacher_dashboard():
     user_id = session['user_id']
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-    assigned_classes = get_teacher_assigned_classes(user_id)
-    
-    total_students = 0
-    if assigned_classes:
-        placeholders = ', '.join(['%s'] * len(assigned_classes))
-        query = f"SELECT COUNT(student_id) as count FROM public.students WHERE class_name IN ({placeholders})"
-        cursor.execute(query, tuple(assigned_classes))
-        result = cursor.fetchone()
-        if result:
-            total_students = result['count']
-    
-    cursor.close()
-    return render_template('teacher_dashboard.html', 
-                           class_count=len(assigned_classes), 
-                           student_count=total_students)
+    return render_template('teacher_dashboard.html', load_stats=lambda: _load_teacher_stats(user_id))
 
 @teacher_bp.route('/enter_results', methods=['GET', 'POST'])
 @role_required('teacher')
@@ -66,7 +78,7 @@ def enter_results():
 
     if request.method == 'POST':
         student_id = request.form.get('student_id')
-        subject = request.form.get('subject')
+        subject = (request.form.get('subject') or '').strip()
         term = request.form.get('term')
         academic_year = request.form.get('academic_year')
         
@@ -81,31 +93,37 @@ def enter_results():
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
-        cursor.execute(
-            "SELECT result_id FROM public.exam_results WHERE student_id = %s AND subject = %s AND term = %s AND year = %s",
-            (student_id, subject, term, academic_year)
-        )
-        if cursor.fetchone():
-            flash(f"A result for {subject} has already been entered for this student in this term. Please use 'View Results' to edit it.", "error")
+        subject_id = resolve_subject_id(cursor, request.form.get('subject_id'), subject)
+        if subject_id is None:
+            flash(f"Unknown subject '{subject}'. Please use a subject from the curriculum.", "error")
             cursor.close()
             return redirect(url_for('teacher.enter_results'))
 
-        final_score = round((ca_score + midterm_score + final_exam_score) / 3)
-        grade = calculate_grade(final_score)
-        
-        cursor.execute("SELECT first_name, last_name FROM public.students WHERE student_id = %s", (student_id,))
-        student = cursor.fetchone()
-        student_name = f"{student['first_name']} {student['last_name']}" if student else "Unknown Student"
-
-        cursor.execute("""
-            INSERT INTO public.exam_results
-            (student_id, subject, ca_score, midterm_score, final_exam_score, final_score, grade, term, year)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (student_id, subject, ca_score, midterm_score, final_exam_score, final_score, grade, term, academic_year))
+        try:
+            recorded = grading.record_result(cursor, student_id, subject_id, academic_year, term,
+                                             ca_score, midterm_score, final_exam_score)
+        except (terms.TermClosed, grading.NoGradingScheme) as e:
+            flash(str(e), "error")
+            cursor.close()
+            return redirect(url_for('teacher.enter_results'))
+        if recorded is None or recorded['result_id'] is None:
+            cursor.close()
+            if recorded is None:
+                flash("Student not found.", "error")
+            else:
+                flash(f"A result for {subject} has already been entered for this student in this term. Please use 'View Results' to edit it.", "error")
+            return redirect(url_for('teacher.enter_results'))
+        result_id, final_score, grade = recorded['result_id'], recorded['final_score'], recorded['grade']
+        student_name = f"{recorded['first_name']} {recorded['last_name']}"
         conn.commit()
         cursor.close()
+        transcripts.invalidate_transcript(student_id)
 
-        log_activity(f"Entered exam result for '{student_name}' in '{subject}' for {term}, {academic_year}.")
+        log_activity(f"Entered exam result for '{student_name}' in '{subject}' for {term}, {academic_year}.",
+                     event_type='exam_result.created', entity_type='student', entity_id=student_id,
+                     payload={'result_id': result_id, 'subject_id': subject_id, 'subject': subject, 'term': term, 'year': academic_year,
+                              'ca_score': ca_score, 'midterm_score': midterm_score, 'final_exam_score': final_exam_score,
+                              'final_score': final_score, 'grade': grade})
         flash(f"Result for {subject} recorded successfully! Final score: {final_score}, Grade: {grade}", "success")
         return redirect(url_for('teacher.enter_results'))
 
@@ -118,14 +136,7 @@ def view_results():
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     user_id = session.get('user_id')
     if session.get('role') == 'teacher':
-        cursor.execute("""
-            SELECT DISTINCT c.class_id, c.class_name
-            FROM public.teacher_assignments ta
-            JOIN public.teachers t ON ta.teacher_id = t.teacher_id
-            JOIN public.classes c ON ta.class_id = c.class_id
-            WHERE t.user_id = %s
-            ORDER BY c.class_id
-        """, (user_id,))
+        execute_prepared(cursor, _TEACHER_CLASSES, (user_id,))
     else:
         cursor.execute("SELECT class_id, class_name FROM public.classes ORDER BY class_id")
     all_classes = cursor.fetchall()
@@ -145,21 +156,33 @@ def edit_result(result_id):
         except (ValueError, TypeError):
             flash("Invalid score entered. Please use numbers only.", "error")
             return redirect(url_for('teacher.edit_result', result_id=result_id))
-        final_score = round((ca_score + midterm_score + final_exam_score) / 3)
-        grade = calculate_grade(final_score)
-        cursor.execute("SELECT s.first_name, s.last_name, er.subject FROM public.exam_results er JOIN public.students s ON er.student_id = s.student_id WHERE er.result_id = %s", (result_id,))
-        result_details = cursor.fetchone()
-        cursor.execute("UPDATE public.exam_results SET ca_score = %s, midterm_score = %s, final_exam_score = %s, final_score = %s, grade = %s WHERE result_id = %s", (ca_score, midterm_score, final_exam_score, final_score, grade, result_id))
+        try:
+            result_details = grading.regrade_result(cursor, result_id, ca_score, midterm_score, final_exam_score)
+        except (terms.TermClosed, grading.NoGradingScheme) as e:
+            flash(str(e), "error")
+            cursor.close()
+            return redirect(url_for('teacher.edit_result', result_id=result_id))
+        if not result_details:
+            flash("Exam result not found.", "error")
+            cursor.close()
+            return redirect(url_for('teacher.view_results'))
+        final_score, grade = result_details['new_final_score'], result_details['new_grade']
         conn.commit()
         cursor.close()
-        if result_details:
-            student_name = f"{result_details['first_name']} {result_details['last_name']}"
-            subject = result_details['subject']
-            log_activity(f"Edited exam result for '{student_name}' in '{subject}'.")
+        transcripts.invalidate_transcript(result_details['student_id'])
+        student_name = f"{result_details['first_name']} {result_details['last_name']}"
+        subject = result_details['subject']
+        changes = changed_fields(result_details, {
+            'ca_score': ca_score, 'midterm_score': midterm_score, 'final_exam_score': final_exam_score,
+            'final_score': final_score, 'grade': grade,
+        })
+        log_activity(f"Edited exam result for '{student_name}' in '{subject}'.",
+                     event_type='exam_result.updated', entity_type='student', entity_id=result_details['student_id'],
+                     payload=dict(changes, result_id=result_id, subject=subject, term=result_details['term'], year=result_details['year']))
         flash("Result updated successfully.", "success")
         return redirect(url_for('teacher.view_results'))
     
-    cursor.execute("SELECT er.*, s.first_name, s.last_name, s.class_name FROM public.exam_results er JOIN public.students s ON er.student_id = s.student_id WHERE er.result_id = %s", (result_id,))
+    cursor.execute(f"SELECT r.*, s.first_name, s.last_name, s.class_name FROM ({RESULTS_WITH_SUBJECT}) r JOIN ({STUDENTS_WITH_CLASS}) s ON r.student_id = s.student_id WHERE r.result_id = %s", (result_id,))
     result = cursor.fetchone()
     cursor.close()
     if not result:
@@ -167,88 +190,157 @@ def edit_result(result_id):
         return redirect(url_for('teacher.view_results'))
     if session.get('role') == 'teacher':
         user_id = session.get('user_id')
-        assigned_classes = get_teacher_assigned_classes(user_id)
-        if result['class_name'] not in assigned_classes:
+        if result['class_id'] not in get_teacher_class_ids(user_id):
             flash("You do not have permission to edit results for this class.", "error")
             return redirect(url_for('teacher.view_results'))
     return render_template('edit_result.html', result=result)
 
+# The scope and closed-term checks are evaluated in the same statement as
+# the delete and returned with the row, so the route makes one round trip
+_DELETE_RESULT = f"""
+    WITH target AS (
+        SELECT r.*, s.first_name, s.last_name,
+               (%(teacher_user_id)s::int IS NULL OR r.class_id IN (
+                   SELECT ta.class_id FROM public.teacher_assignments ta
+                   JOIN public.teachers t ON ta.teacher_id = t.teacher_id
+                   WHERE t.user_id = %(teacher_user_id)s::int)) AS permitted,
+               EXISTS (SELECT 1 FROM public.closed_terms ct WHERE ct.year = r.year AND ct.term = r.term) AS term_closed
+        FROM ({RESULTS_WITH_SUBJECT}) r JOIN public.students s ON r.student_id = s.student_id
+        WHERE r.result_id = %(result_id)s
+    ), deleted AS (
+        DELETE FROM public.exam_results er USING target
+        WHERE er.result_id = target.result_id AND target.permitted AND NOT target.term_closed
+    )
+    SELECT * FROM target
+"""
+
 @teacher_bp.route('/delete_result/<int:result_id>', methods=['POST'])
 @role_required('teacher', 'school_admin', 'system_admin')
 def delete_result(result_id):
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT s.class_name, s.first_name, s.last_name, er.subject FROM public.exam_results er JOIN public.students s ON er.student_id = s.student_id WHERE er.result_id = %s", (result_id,))
+    teacher_user_id = session.get('user_id') if session.get('role') == 'teacher' else None
+    cursor.execute(_DELETE_RESULT, {'result_id': result_id, 'teacher_user_id': teacher_user_id})
     result_to_delete = cursor.fetchone()
     if not result_to_delete:
         flash("Result not found.", "error")
         cursor.close()
         return redirect(url_for('teacher.view_results'))
-    if session.get('role') == 'teacher':
-        user_id = session.get('user_id')
-        assigned_classes = get_teacher_assigned_classes(user_id)
-        if result_to_delete['class_name'] not in assigned_classes:
-            flash("You do not have permission to delete results for this class.", "error")
-            cursor.close()
-            return redirect(url_for('teacher.view_results'))
-    cursor.execute("DELETE FROM public.exam_results WHERE result_id = %s", (result_id,))
+    if not result_to_delete['permitted']:
+        flash("You do not have permission to delete results for this class.", "error")
+        cursor.close()
+        return redirect(url_for('teacher.view_results'))
+    if result_to_delete['term_closed']:
+        flash(str(terms.TermClosed(result_to_delete['year'], result_to_delete['term'])), "error")
+        cursor.close()
+        return redirect(url_for('teacher.view_results'))
     conn.commit()
     cursor.close()
+    transcripts.invalidate_transcript(result_to_delete['student_id'])
     student_name = f"{result_to_delete['first_name']} {result_to_delete['last_name']}"
     subject = result_to_delete['subject']
-    log_activity(f"Deleted exam result for '{student_name}' in '{subject}'.")
+    log_activity(f"Deleted exam result for '{student_name}' in '{subject}'.",
+                 event_type='exam_result.deleted', entity_type='student', entity_id=result_to_delete['student_id'],
+                 payload={'result_id': result_id, 'subject': subject, 'term': result_to_delete['term'], 'year': result_to_delete['year'],
+                          'final_score': result_to_delete['final_score'], 'grade': result_to_delete['grade']})
     flash("Exam result deleted successfully.", "success")
     return redirect(url_for('teacher.view_results'))
 
-@teacher_bp.route('/get_students_for_class_list', methods=['POST'])
-@role_required('teacher')
-def get_students_for_class_list():
-    class_name = request.form.get('class_name')
-    if not class_name: return jsonify([])
+@teacher_bp.route('/recompute_grades', methods=['POST'])
+@role_required('school_admin', 'system_admin')
+def recompute_grades():
+    # Dry run unless apply=true; either way the response lists every result whose score or grade changes
+    term = request.form.get('term')
+    year = request.form.get('year')
+    if not term or not year:
+        return jsonify({'error': 'Missing required parameters.'}), 400
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor()
+    class_id = resolve_class_id(cursor, request.form.get('class_id'), request.form.get('class_name'))
+    cursor.close()
+    dry_run = request.form.get('apply') != 'true'
+    try:
+        changes = grading.recompute(conn, year, term, class_id=class_id, dry_run=dry_run)
+    except terms.TermClosed as e:
+        return jsonify({'error': str(e)}), 409
+    if changes and not dry_run:
+        log_activity(f"Recomputed grades for {term}, {year}: {len(changes)} results changed.",
+                     event_type='grades.recomputed', entity_type='class' if class_id else None, entity_id=class_id,
+                     payload={'term': term, 'year': year, 'changed': len(changes)})
+    return jsonify({'dry_run': dry_run, 'changed': len(changes), 'changes': changes})
+
+@teacher_bp.route('/close_term', methods=['POST'])
+@role_required('school_admin', 'system_admin')
+def close_term():
+    term = request.form.get('term')
+    year = request.form.get('year')
+    if not term or not year:
+        return jsonify({'error': 'Missing required parameters.'}), 400
+    written = terms.close_term(get_db_connection(), year, term, user_id=session.get('user_id'))
+    if written is None:
+        return jsonify({'error': f"{term}, {year} is already closed."}), 409
+    report_cards, subject_reports = written
+    log_activity(f"Closed {term}, {year}.", event_type='term.closed',
+                 payload={'term': term, 'year': year, 'report_cards': report_cards, 'subject_reports': subject_reports})
+    return jsonify({'closed': True, 'report_cards': report_cards, 'subject_reports': subject_reports})
+
+@teacher_bp.route('/reopen_term', methods=['POST'])
+@role_required('system_admin')
+def reopen_term():
+    term = request.form.get('term')
+    year = request.form.get('year')
+    if not term or not year:
+        return jsonify({'error': 'Missing required parameters.'}), 400
+    if not terms.reopen_term(get_db_connection(), year, term):
+        return jsonify({'error': f"{term}, {year} is not closed."}), 409
+    log_activity(f"Reopened {term}, {year}.", event_type='term.reopened', payload={'term': term, 'year': year})
+    return jsonify({'closed': False})
+
+def _class_roster_response():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    class_id = resolve_class_id(cursor, request.form.get('class_id'), request.form.get('class_name'))
+    if class_id is None:
+        cursor.close()
+        return jsonify([])
     if session['role'] == 'teacher':
         user_id = session['user_id']
-        assigned_classes = get_teacher_assigned_classes(user_id)
-        if class_name not in assigned_classes:
+        if class_id not in get_teacher_class_ids(user_id):
             cursor.close()
             return jsonify({'error': 'Unauthorized'}), 403
-    cursor.execute("SELECT student_id, first_name, last_name, student_number FROM public.students WHERE class_name = %s ORDER BY last_name, first_name", (class_name,))
-    students = [dict(row) for row in cursor.fetchall()]
+    roster = rosters.get_roster(cursor, class_id)
     cursor.close()
-    return jsonify(students)
+    return jsonify([entry._asdict() for entry in roster])
+
+@teacher_bp.route('/get_students_for_class_list', methods=['POST'])
+@role_required('teacher')
+def get_students_for_class_list():
+    return _class_roster_response()
 
 @teacher_bp.route('/get_students_for_results', methods=['POST'])
 @role_required('teacher', 'school_admin', 'system_admin')
 def get_students_for_results():
-    class_name = request.form.get('class_name')
-    if not class_name: return jsonify([])
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    if session['role'] == 'teacher':
-        user_id = session['user_id']
-        assigned_classes = get_teacher_assigned_classes(user_id)
-        if class_name not in assigned_classes:
-            cursor.close()
-            return jsonify({'error': 'Unauthorized'}), 403
-    cursor.execute("SELECT student_id, first_name, last_name, student_number FROM public.students WHERE class_name = %s ORDER BY last_name, first_name", (class_name,))
-    students = [dict(row) for row in cursor.fetchall()]
-    cursor.close()
-    return jsonify(students)
+    return _class_roster_response()
 
 @teacher_bp.route('/get_student_report_card', methods=['POST'])
 @role_required('teacher', 'school_admin', 'system_admin')
+@replica_safe
 def get_student_report_card():
     student_id = request.form.get('student_id')
     term = request.form.get('term')
     year = request.form.get('year')
     if not all([student_id, term, year]):
         return jsonify({'error': 'Missing required parameters.'}), 400
-    conn = get_db_connection()
+    conn = get_read_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT student_id, first_name, last_name, class_name FROM public.students WHERE student_id = %s", (student_id,))
+    # Closed terms come precomputed from their snapshot
+    snapshot = terms.snapshot_report_card(cursor, student_id, year, term)
+    if snapshot is not None:
+        cursor.close()
+        return jsonify(snapshot)
+    cursor.execute(f"SELECT student_id, first_name, last_name, class_name FROM ({STUDENTS_WITH_CLASS}) s WHERE student_id = %s", (student_id,))
     student_info = dict(cursor.fetchone())
-    cursor.execute("SELECT * FROM public.exam_results WHERE student_id = %s AND term = %s AND year = %s ORDER BY subject", (student_id, term, year))
+    cursor.execute(f"SELECT * FROM ({RESULTS_WITH_SUBJECT}) r WHERE student_id = %s AND term = %s AND year = %s ORDER BY subject", (student_id, term, year))
     results = [dict(row) for row in cursor.fetchall()]
     cursor.close()
     report_data = {'student': student_info, 'results': results}
@@ -256,22 +348,28 @@ def get_student_report_card():
 
 @teacher_bp.route('/get_subject_report', methods=['POST'])
 @role_required('teacher', 'school_admin', 'system_admin')
+@replica_safe
+@time_budget(10)
 def get_subject_report():
-    class_name = request.form.get('class_name')
-    subject = request.form.get('subject')
     term = request.form.get('term')
     year = request.form.get('year')
-    if not all([class_name, subject, term, year]):
-        return jsonify({'error': 'Missing required parameters.'}), 400
-    conn = get_db_connection()
+    conn = get_read_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    class_id = resolve_class_id(cursor, request.form.get('class_id'), request.form.get('class_name'))
+    subject_id = resolve_subject_id(cursor, request.form.get('subject_id'), request.form.get('subject'))
+    if not all([class_id, subject_id, term, year]):
+        cursor.close()
+        return jsonify({'error': 'Missing required parameters.'}), 400
     if session['role'] == 'teacher':
         user_id = session['user_id']
-        assigned_classes = get_teacher_assigned_classes(user_id)
-        if class_name not in assigned_classes:
+        if class_id not in get_teacher_class_ids(user_id):
             cursor.close()
             return jsonify({'error': 'Unauthorized'}), 403
-    cursor.execute("SELECT s.first_name, s.last_name, s.student_number, er.final_score, er.grade FROM public.exam_results er JOIN public.students s ON er.student_id = s.student_id WHERE s.class_name = %s AND er.subject = %s AND er.term = %s AND er.year = %s ORDER BY s.last_name, s.first_name", (class_name, subject, term, year))
-    results = [dict(row) for row in cursor.fetchall()]
+    snapshot = terms.snapshot_subject_report(cursor, class_id, subject_id, year, term)
+    if snapshot is not None:
+        cursor.close()
+        return jsonify(snapshot)
     cursor.close()
-    return jsonify(results)
\ No newline at end of file
+    cursor = server_cursor(conn)
+    cursor.execute("SELECT s.first_name, s.last_name, s.student_number, er.final_score::float8 AS final_score, er.grade FROM public.exam_results er JOIN public.students s ON er.student_id = s.student_id WHERE er.class_id = %s AND er.subject_id = %s AND er.term = %s AND er.year = %s ORDER BY s.last_name, s.first_name", (class_id, subject_id, term, year))
+    return json_list_response(cursor)
\ No newline at end of file
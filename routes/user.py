@@ -1,7 +1,8 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
 from db import get_db_connection
-from utils import role_required, log_activity
-from werkzeug.security import generate_password_hash
+from utils import role_required, log_activity, changed_fields
+from template_cache import invalidate_fragment
+from passwords import hash_password, PasswordServiceBusy
 import psycopg2
 import psycopg2.extras
 
@@ -31,7 +32,6 @@ def add_user():
         role = request.form.get('role')
         phone = request.form.get('phone')
         default_password = "password123"
-        hashed_password = generate_password_hash(default_password)
         if not all([full_name, email, role]):
             flash("Full Name, Email, and Role are required fields.", "error")
             return render_template('add_user.html', form_data=request.form)
@@ -46,6 +46,14 @@ def add_user():
             flash("A user with this email address already exists.", "error")
             cursor.close()
             return render_template('add_user.html', form_data=request.form)
+
+        # Only hash once the form has been validated
+        try:
+            hashed_password = hash_password(default_password)
+        except PasswordServiceBusy:
+            flash("The server is busy. Please try again in a moment.", "error")
+            cursor.close()
+            return render_template('add_user.html', form_data=request.form)
         
         cursor.execute(
             "INSERT INTO public.users (full_name, email, password, role) VALUES (%s, %s, %s, %s) RETURNING user_id",
@@ -58,7 +66,11 @@ def add_user():
         
         conn.commit()
         cursor.close()
-        log_activity(f"Created new user: '{full_name}' with role '{role}'.")
+        invalidate_fragment('dashboard_stats')
+        invalidate_fragment('coverage_grid')
+        log_activity(f"Created new user: '{full_name}' with role '{role}'.",
+                     event_type='user.created', entity_type='user', entity_id=new_user_id,
+                     payload={'full_name': full_name, 'email': email, 'role': role})
         flash(f"User '{full_name}' created successfully.", "success")
         return redirect(url_for('user.view_users'))
     
@@ -84,6 +96,8 @@ def edit_user(user_id):
                 cursor.close()
                 return redirect(url_for('user.edit_user', user_id=user_id))
 
+            cursor.execute("SELECT u.full_name, u.email, u.role, t.phone FROM public.users u LEFT JOIN public.teachers t ON t.user_id = u.user_id WHERE u.user_id = %s", (user_id,))
+            old_user = cursor.fetchone() or {}
             cursor.execute("UPDATE public.users SET full_name = %s, email = %s, role = %s WHERE user_id = %s", (full_name, email, role, user_id))
             
             if role == 'teacher':
@@ -95,15 +109,25 @@ def edit_user(user_id):
                     cursor.execute("INSERT INTO public.teachers (user_id, phone) VALUES (%s, %s)", (user_id, phone))
             
             conn.commit()
-            log_activity(f"Edited user details for '{full_name}' (ID: {user_id}).")
+            invalidate_fragment('dashboard_stats')
+            invalidate_fragment('coverage_grid')
+            changes = changed_fields(old_user, {'full_name': full_name, 'email': email, 'role': role, 'phone': phone if role == 'teacher' else old_user.get('phone')})
+            log_activity(f"Edited user details for '{full_name}' (ID: {user_id}).",
+                         event_type='user.updated', entity_type='user', entity_id=user_id, payload=changes)
             flash("User details updated successfully.", "success")
 
         elif action == 'reset_password':
             default_password = "password123"
-            hashed_password = generate_password_hash(default_password)
+            try:
+                hashed_password = hash_password(default_password)
+            except PasswordServiceBusy:
+                flash("The server is busy. Please try again in a moment.", "error")
+                cursor.close()
+                return redirect(url_for('user.edit_user', user_id=user_id))
             cursor.execute("UPDATE public.users SET password = %s WHERE user_id = %s", (hashed_password, user_id))
             conn.commit()
-            log_activity(f"Reset password for user ID: {user_id}.")
+            log_activity(f"Reset password for user ID: {user_id}.",
+                         event_type='user.password_reset', entity_type='user', entity_id=user_id)
             flash("User's password has been reset to 'password123'.", "success")
         
         cursor.close()
@@ -132,14 +156,23 @@ def delete_user(user_id):
         return redirect(url_for('user.view_users'))
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT full_name FROM public.users WHERE user_id = %s", (user_id,))
+    # Foreign keys are checked at the end of the statement, so the teacher
+    # profile and the user go together
+    cursor.execute("""
+        WITH teacher AS (DELETE FROM public.teachers WHERE user_id = %(user_id)s)
+        DELETE FROM public.users WHERE user_id = %(user_id)s RETURNING full_name
+    """, {'user_id': user_id})
     user_to_delete = cursor.fetchone()
-    user_name = user_to_delete['full_name'] if user_to_delete else 'Unknown'
-    
-    cursor.execute("DELETE FROM public.teachers WHERE user_id = %s", (user_id,))
-    cursor.execute("DELETE FROM public.users WHERE user_id = %s", (user_id,))
     conn.commit()
+    if not user_to_delete:
+        flash("User not found.", "error")
+        cursor.close()
+        return redirect(url_for('user.view_users'))
+    user_name = user_to_delete['full_name']
+    invalidate_fragment('dashboard_stats')
+    invalidate_fragment('coverage_grid')
     cursor.close()
-    log_activity(f"Deleted user: '{user_name}' (ID: {user_id}).")
+    log_activity(f"Deleted user: '{user_name}' (ID: {user_id}).",
+                 event_type='user.deleted', entity_type='user', entity_id=user_id, payload={'full_name': user_name})
     flash("User deleted successfully.", "success")
     return redirect(url_for('user.view_users'))
\ No newline at end of file
@@ -0,0 +1,62 @@
+import itertools
+import json
+import psycopg2.errors
+from flask import Response, request
+from config import Config
+from db import detach_connection
+import metrics
+
+# List endpoints (student, fee payment and subject report filters) can
+# return a whole school's rows. Rather than fetching them all as DictRows
+# and handing a list of dicts to jsonify, they read tuple rows from a
+# server-side cursor a batch at a time and stream the JSON array out as
+# each batch is encoded. Queries format their own dates (to_char) and cast
+# scores to float8, so rows go to the encoder as they come; anything else
+# it cannot encode (Decimal) becomes a string, as jsonify does.
+#
+# Teardown runs before a streamed body is read, so the response takes the
+# cursor's connection from the request and checks it in (rolling back,
+# which also closes the cursor) when the body is finished or abandoned.
+# The status is sent by then, so a FETCH cancelled at the time budget
+# ends the array early, with "truncated": true beside it when there is an
+# object to put it in.
+
+_cursor_names = itertools.count()
+
+
+def server_cursor(conn):
+    """A named cursor: DECLAREd on execute, then FETCHed a batch at a time by json_list_response."""
+    return conn.cursor(f'json_stream_{next(_cursor_names)}')
+
+
+def _encode_rows(cursor, key, release, endpoint):
+    try:
+        yield
+        yield '{%s:[' % json.dumps(key) if key else '['
+        separator = ''
+        while True:
+            try:
+                rows = cursor.fetchmany(Config.STREAM_BATCH_SIZE)
+            except psycopg2.errors.QueryCanceled:
+                metrics.inc('db_statement_timeouts', endpoint=endpoint)
+                yield '],"truncated":true}' if key else ']'
+                return
+            if not rows:
+                break
+            columns = [column.name for column in cursor.description]
+            # One batch of dicts at a time; the brackets are dropped so batches join into one array
+            yield separator + json.dumps([dict(zip(columns, row)) for row in rows], default=str, separators=(',', ':'))[1:-1]
+            separator = ','
+        yield ']}' if key else ']'
+    finally:
+        release()
+
+
+def json_list_response(cursor, key=None):
+    """
+    Streams the rows of an executed cursor as a JSON array of objects,
+    wrapped as {key: [...]} when key is given.
+    """
+    body = _encode_rows(cursor, key, detach_connection(cursor.connection), request.endpoint)
+    next(body)  # started, so closing an unread response still releases the connection
+    return Response(body, mimetype='application/json')
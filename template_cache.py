@@ -0,0 +1,47 @@
+import os
+from jinja2 import nodes, FileSystemBytecodeCache
+from jinja2.ext import Extension
+from config import Config
+from cache import LRUCache
+
+fragment_cache = LRUCache('fragments', max_entries=Config.FRAGMENT_CACHE_MAX_ENTRIES, ttl=Config.FRAGMENT_CACHE_TTL)
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Adds a `{% cache 'name', key1, key2 %}...{% endcache %}` tag. The rendered
+    block is stored under the fragment name and the key values, so pass the
+    role and/or user id whenever the output differs between them. Drop every
+    cached copy of a fragment with invalidate_fragment('name').
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_render_cached', [nodes.List(args)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, args, caller):
+        name, key = args[0], tuple(args[1:])
+        return fragment_cache.get_or_set('fragment:' + name, key, caller)
+
+
+def invalidate_fragment(name):
+    fragment_cache.invalidate('fragment:' + name)
+
+
+def configure_jinja(app):
+    """
+    Must run before the app's Jinja environment is first used. Compiled
+    templates go to a directory shared by every worker on the host, so only
+    the first worker after a deploy pays for compilation.
+    """
+    bytecode_dir = os.path.join(Config.CACHE_DIR, 'jinja')
+    os.makedirs(bytecode_dir, exist_ok=True)
+    app.jinja_options = dict(app.jinja_options)
+    app.jinja_options['bytecode_cache'] = FileSystemBytecodeCache(bytecode_dir)
+    app.jinja_options['extensions'] = list(app.jinja_options.get('extensions', ())) + [FragmentCacheExtension]
@@ -0,0 +1,137 @@
+from lookups import RESULTS_WITH_SUBJECT
+
+# Term close-out (migration 005). Closing a (year, term) snapshots its
+# report cards and subject reports into denormalized tables and locks its
+# exam_results; the report endpoints then read closed terms by primary key.
+# Both are keyed on exam_results.class_id, the class a result was entered
+# in, so a term closed after promotions still reports its own classes.
+
+
+class TermClosed(Exception):
+    """Raised when writing results for a term that has been closed."""
+
+    def __init__(self, year, term):
+        super().__init__(f"{term}, {year} has been closed. Its results can no longer be changed.")
+
+
+def is_closed(cursor, year, term):
+    cursor.execute("SELECT 1 FROM public.closed_terms WHERE year = %s AND term = %s", (year, term))
+    return cursor.fetchone() is not None
+
+
+def ensure_open(cursor, year, term):
+    if is_closed(cursor, year, term):
+        raise TermClosed(year, term)
+
+
+_SNAPSHOT_REPORT_CARDS = f"""
+    INSERT INTO public.report_card_snapshots
+        (year, term, student_id, class_id, class_name, first_name, last_name, student_number,
+         subject_count, total_score, average_score, class_position, class_size, results)
+    SELECT %(year)s, %(term)s, t.student_id, t.class_id, c.class_name, t.first_name, t.last_name, t.student_number,
+           t.subject_count, t.total_score, t.average_score,
+           RANK() OVER (PARTITION BY t.class_id ORDER BY t.average_score DESC),
+           COUNT(*) OVER (PARTITION BY t.class_id),
+           t.results
+    FROM (
+        SELECT s.student_id, mode() WITHIN GROUP (ORDER BY r.class_id) AS class_id,
+               s.first_name, s.last_name, s.student_number,
+               COUNT(*) AS subject_count,
+               SUM(r.final_score) AS total_score,
+               ROUND(AVG(r.final_score), 2) AS average_score,
+               jsonb_agg(to_jsonb(r) ORDER BY r.subject) AS results
+        FROM ({RESULTS_WITH_SUBJECT}) r
+        JOIN public.students s ON s.student_id = r.student_id
+        WHERE r.year = %(year)s AND r.term = %(term)s
+        GROUP BY s.student_id, s.first_name, s.last_name, s.student_number
+    ) t
+    LEFT JOIN public.classes c ON c.class_id = t.class_id
+"""
+
+_SNAPSHOT_SUBJECT_REPORTS = """
+    INSERT INTO public.subject_report_snapshots
+        (year, term, class_id, subject_id, class_name, subject_name, student_count, mean_score, min_score, max_score, rows)
+    SELECT %(year)s, %(term)s, er.class_id, er.subject_id, c.class_name, sub.subject_name,
+           COUNT(*), ROUND(AVG(er.final_score), 2), MIN(er.final_score), MAX(er.final_score),
+           jsonb_agg(jsonb_build_object(
+               'first_name', s.first_name, 'last_name', s.last_name, 'student_number', s.student_number,
+               'final_score', er.final_score, 'grade', er.grade
+           ) ORDER BY s.last_name, s.first_name)
+    FROM public.exam_results er
+    JOIN public.students s ON s.student_id = er.student_id
+    LEFT JOIN public.classes c ON c.class_id = er.class_id
+    LEFT JOIN public.subjects sub ON sub.subject_id = er.subject_id
+    WHERE er.year = %(year)s AND er.term = %(term)s AND er.class_id IS NOT NULL AND er.subject_id IS NOT NULL
+    GROUP BY er.class_id, er.subject_id, c.class_name, sub.subject_name
+"""
+
+
+def close_term(conn, year, term, user_id=None):
+    """
+    Locks (year, term) and writes its snapshots in one transaction. Returns
+    (report cards, subject reports) written, or None if it was already closed.
+    """
+    params = {'year': year, 'term': term, 'user_id': user_id}
+    cursor = conn.cursor()
+    try:
+        # The term lock trigger cannot see the closed_terms row until this
+        # commits, so writers are held off until then: SHARE waits for
+        # in-flight result writes to commit and blocks new ones, and the
+        # snapshot queries below see every result that made it in.
+        cursor.execute("LOCK TABLE public.exam_results IN SHARE MODE")
+        cursor.execute("""
+            INSERT INTO public.closed_terms (year, term, closed_by) VALUES (%(year)s, %(term)s, %(user_id)s)
+            ON CONFLICT DO NOTHING
+        """, params)
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return None
+        cursor.execute(_SNAPSHOT_REPORT_CARDS, params)
+        report_cards = cursor.rowcount
+        cursor.execute(_SNAPSHOT_SUBJECT_REPORTS, params)
+        subject_reports = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return report_cards, subject_reports
+
+
+def reopen_term(conn, year, term):
+    """Unlocks a closed term; its snapshots go with it. Returns False if it was not closed."""
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM public.closed_terms WHERE year = %s AND term = %s", (year, term))
+    reopened = cursor.rowcount > 0
+    conn.commit()
+    cursor.close()
+    return reopened
+
+
+def snapshot_report_card(cursor, student_id, year, term):
+    """The stored report card of a closed term, shaped like the live one, or None."""
+    cursor.execute("""
+        SELECT * FROM public.report_card_snapshots WHERE year = %s AND term = %s AND student_id = %s
+    """, (year, term, student_id))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return {
+        'student': {'student_id': row['student_id'], 'first_name': row['first_name'],
+                    'last_name': row['last_name'], 'class_name': row['class_name']},
+        'results': row['results'],
+        'summary': {'total_score': row['total_score'], 'average_score': row['average_score'],
+                    'class_position': row['class_position'], 'class_size': row['class_size']},
+        'closed': True,
+    }
+
+
+def snapshot_subject_report(cursor, class_id, subject_id, year, term):
+    """The stored subject report rows of a closed term, or None."""
+    cursor.execute("""
+        SELECT rows FROM public.subject_report_snapshots
+        WHERE year = %s AND term = %s AND class_id = %s AND subject_id = %s
+    """, (year, term, class_id, subject_id))
+    row = cursor.fetchone()
+    return row['rows'] if row else None
@@ -0,0 +1,105 @@
+from config import Config
+from cache import LRUCache, current_generation
+from lookups import STUDENTS_WITH_CLASS, RESULTS_WITH_SUBJECT
+
+# Multi-year transcripts: per-year and per-term averages, each subject's
+# score trend and running fee totals. One query builds any number of
+# transcripts (the window functions partition by student), so a whole class
+# exports in a single round trip. Built transcripts are cached per student
+# and invalidated by the result, payment and student writes that feed them.
+
+transcript_cache = LRUCache('transcripts', max_entries=Config.TRANSCRIPT_CACHE_MAX_ENTRIES, ttl=Config.TRANSCRIPT_CACHE_TTL)
+
+_TRANSCRIPTS = f"""
+    WITH results AS (
+        SELECT r.student_id, r.year, r.term, r.subject_id, r.subject, r.final_score, r.grade,
+               ROUND(AVG(r.final_score) OVER (PARTITION BY r.student_id, r.year, r.term), 2) AS term_average,
+               ROUND(AVG(r.final_score) OVER (PARTITION BY r.student_id, r.year), 2) AS year_average,
+               r.final_score - LAG(r.final_score) OVER (PARTITION BY r.student_id, r.subject_id ORDER BY r.year, r.term) AS change
+        FROM ({RESULTS_WITH_SUBJECT} WHERE er.student_id = ANY(%(ids)s)) r
+    ),
+    payments AS (
+        SELECT fp.student_id, fp.payment_id, fp.payment_date, fp.academic_year, fp.term, fp.amount_paid,
+               SUM(fp.amount_paid) OVER (PARTITION BY fp.student_id, fp.academic_year) AS year_paid,
+               SUM(fp.amount_paid) OVER (PARTITION BY fp.student_id ORDER BY fp.payment_date, fp.payment_id) AS cumulative_paid
+        FROM public.fee_payments fp
+        WHERE fp.student_id = ANY(%(ids)s)
+    )
+    SELECT s.student_id, s.student_number, s.first_name, s.last_name, s.class_id, s.class_name,
+           COALESCE((SELECT jsonb_agg(to_jsonb(r) - 'student_id' ORDER BY r.year, r.term, r.subject)
+                     FROM results r WHERE r.student_id = s.student_id), '[]') AS results,
+           COALESCE((SELECT jsonb_agg(to_jsonb(p) - 'student_id' ORDER BY p.payment_date, p.payment_id)
+                     FROM payments p WHERE p.student_id = s.student_id), '[]') AS payments
+    FROM ({STUDENTS_WITH_CLASS} WHERE s.student_id = ANY(%(ids)s)) s
+    ORDER BY s.last_name, s.first_name
+"""
+
+
+def _namespace(student_id):
+    return f'transcript:{student_id}'
+
+
+def _shape(row):
+    years = []
+    subjects = {}
+    for result in row['results']:
+        if not years or years[-1]['year'] != result['year']:
+            years.append({'year': result['year'], 'average': result['year_average'], 'terms': []})
+        year_terms = years[-1]['terms']
+        if not year_terms or year_terms[-1]['term'] != result['term']:
+            year_terms.append({'term': result['term'], 'average': result['term_average'], 'results': []})
+        year_terms[-1]['results'].append({key: result[key] for key in ('subject_id', 'subject', 'final_score', 'grade', 'change')})
+        subjects.setdefault(result['subject'], []).append(
+            {key: result[key] for key in ('year', 'term', 'final_score', 'grade', 'change')})
+    payments = row['payments']
+    return {
+        'student': {key: row[key] for key in ('student_id', 'student_number', 'first_name', 'last_name', 'class_id', 'class_name')},
+        'years': years,
+        'subjects': subjects,
+        'fees': {
+            'payments': payments,
+            'by_year': {p['academic_year']: p['year_paid'] for p in payments},
+            'total_paid': payments[-1]['cumulative_paid'] if payments else 0,
+        },
+    }
+
+
+def build_transcripts(cursor, student_ids):
+    """{student_id: transcript} for the students that exist, from one query."""
+    if not student_ids:
+        return {}
+    cursor.execute(_TRANSCRIPTS, {'ids': list(student_ids)})
+    return {row['student_id']: _shape(row) for row in cursor.fetchall()}
+
+
+def get_transcripts(cursor, student_ids):
+    """
+    Transcripts for student_ids in the order given (unknown ids are left
+    out). Cached ones are reused; the rest are built together and cached.
+    """
+    found = {}
+    missing = []
+    for student_id in student_ids:
+        transcript = transcript_cache.get(_namespace(student_id), student_id)
+        if transcript is None:
+            missing.append(student_id)
+        else:
+            found[student_id] = transcript
+    if missing:
+        # Generations are read before building, as in LRUCache.get_or_set
+        generations = {student_id: current_generation(_namespace(student_id)) for student_id in missing}
+        for student_id, transcript in build_transcripts(cursor, missing).items():
+            transcript_cache.set(_namespace(student_id), student_id, transcript, generation=generations[student_id])
+            found[student_id] = transcript
+    return [found[student_id] for student_id in student_ids if student_id in found]
+
+
+def get_transcript(cursor, student_id):
+    transcripts = get_transcripts(cursor, [student_id])
+    return transcripts[0] if transcripts else None
+
+
+def invalidate_transcript(*student_ids):
+    for student_id in set(student_ids):
+        if student_id is not None:
+            transcript_cache.invalidate(_namespace(int(student_id)))
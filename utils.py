@@ -1,6 +1,11 @@
+import json
+import time
+from decimal import Decimal
 from functools import wraps
-from flask import session, flash, redirect, url_for
-from db import get_db_connection
+from flask import session, flash, redirect, url_for, g, request, render_template, jsonify
+from psycopg2.extras import Json
+from db import get_db_connection, mark_write
+import metrics
 
 # This decorator is unchanged
 def role_required(*roles):
@@ -14,11 +19,69 @@ def role_required(*roles):
         return decorated_view
     return wrapper
 
+# Marks a read-only view whose queries may be served by the read replica
+# (via db.get_read_connection). Stack it under @role_required.
+def replica_safe(fn):
+    @wraps(fn)
+    def decorated_view(*args, **kwargs):
+        g.replica_ok = True
+        return fn(*args, **kwargs)
+    return decorated_view
+
+# Caps how long a view's queries may run, in seconds, in place of
+# REQUEST_TIME_BUDGET. Stack it under @role_required.
+def time_budget(seconds):
+    def wrapper(fn):
+        @wraps(fn)
+        def decorated_view(*args, **kwargs):
+            g.time_budget = seconds
+            return fn(*args, **kwargs)
+        return decorated_view
+    return wrapper
+
+# Error handler for statements Postgres cancelled at the time budget. Pages
+# get a short explanation, data endpoints a JSON error; both count towards
+# db_statement_timeouts per endpoint.
+def query_timeout_response(e):
+    metrics.inc('db_statement_timeouts', endpoint=request.endpoint or 'unknown')
+    if 'text/html' in request.accept_mimetypes.values():
+        return render_template('timeout.html', back=request.referrer), 503
+    return jsonify({'error': 'This took too long to load. Narrow the filters and try again.', 'timeout': True}), 503
+
 # --- UPGRADED LOGGING FUNCTION ---
-def log_activity(action_description, user_id=None, user_full_name=None):
+def _json_default(value):
+    return str(value)  # dates, Decimals
+
+
+def _audit_value(value):
+    # Form values arrive as strings while the database hands back dates,
+    # Decimals and ints; compare them in one shape.
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return float(value)
+    return str(value)
+
+
+def changed_fields(old, new):
+    """{field: {'from': ..., 'to': ...}} for the fields in new whose value differs from old."""
+    return {
+        field: {'from': old.get(field), 'to': value}
+        for field, value in new.items()
+        if _audit_value(old.get(field)) != _audit_value(value)
+    }
+
+
+def log_activity(action_description, user_id=None, user_full_name=None,
+                 event_type=None, entity_type=None, entity_id=None, payload=None):
     """
     Records an activity. Can be called with specific user info (for logins)
     or will get it from the session automatically (for most actions).
+
+    event_type ('student.updated'), entity_type/entity_id (the record the
+    event is about) and payload (a dict, e.g. from changed_fields) make the
+    event searchable. Exam results and fee payments are filed under their
+    student so a student's whole history is one index range.
     """
     try:
         # If user info is not provided, get it from the session
@@ -32,12 +95,21 @@ def log_activity(action_description, user_id=None, user_full_name=None):
         if user_full_name is None:
             user_full_name = "System/Unknown"
 
+        started = time.perf_counter()
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO activity_logs (user_id, user_full_name, action) VALUES (%s, %s, %s)",
-            (user_id, user_full_name, action_description)
+            """
+            INSERT INTO activity_logs (user_id, user_full_name, action, event_type, entity_type, entity_id, payload)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """,
+            (user_id, user_full_name, action_description, event_type, entity_type, entity_id,
+             Json(payload, dumps=lambda obj: json.dumps(obj, default=_json_default)) if payload is not None else None)
         )
         conn.commit()
+        mark_write()
+        # Audit entries are written inline with the request, so this is what they add to it
+        metrics.observe_histogram('audit_write_seconds', time.perf_counter() - started)
     except Exception as e:
-        print(f"Error logging activity: {e}")
\ No newline at end of file
+        metrics.inc('audit_write_failures')
+        print(f"Error logging activity: {e}")
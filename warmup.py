@@ -0,0 +1,44 @@
+import time
+import db_async
+import passwords
+
+# Work a fresh process would otherwise leave to its first requests. On
+# scale-to-zero hosting the first request after a wake-up pays for all of
+# it, so in cold-start mode gunicorn.conf.py runs warm_app() once in the
+# master, before the workers are forked from it, and warm_worker() in each
+# worker before it accepts connections. Both report to the logger they are
+# given (gunicorn's server.log / worker.log).
+
+
+def compile_templates(app):
+    """Compiles every template into the Jinja environment's cache (and the shared bytecode cache)."""
+    env = app.jinja_env
+    names = env.list_templates(extensions=['html'])
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def warm_app(app, log):
+    """Process-wide state a forked worker inherits. Opens no connections."""
+    started = time.perf_counter()
+    templates = compile_templates(app)
+    passwords.current_method()  # calibrates the scrypt cost once, instead of on the first login
+    log.info("warm-up: %s templates compiled, password hashing calibrated in %.2fs", templates, time.perf_counter() - started)
+
+
+def warm_worker(app, log):
+    """
+    Opens the async pool when async mode is on and runs one request
+    (/healthz) through the app, so the first real one finds Flask's
+    request path warm and a primary connection ready with its settings.
+    The psycopg2 pools are opened by gunicorn.conf.py's post_fork.
+    """
+    started = time.perf_counter()
+    try:
+        db_async.open_pool()
+    except Exception as e:
+        # The database may still be waking up too; requests connect lazily
+        log.warning("warm-up: async pool not opened (%s)", e)
+    response = app.test_client().get('/healthz')
+    log.info("warm-up: worker ready in %.2fs (healthz %s)", time.perf_counter() - started, response.status_code)